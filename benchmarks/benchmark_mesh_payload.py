@@ -0,0 +1,76 @@
+"""Benchmark the size and cost of sending a Wannier function isosurface to the WeasWidget.
+
+The payload sent over the widget comm is the JSON encoding of the ``any_mesh`` settings. The raw
+``.tolist()`` conversion of the double-precision marching-cubes output is compared with ``encode_mesh``.
+Run with::
+
+    python benchmarks/benchmark_mesh_payload.py --sizes 64 100 160
+"""
+
+import argparse
+import json
+import time
+import tracemalloc
+
+import numpy as np
+from skimage import measure
+
+from aiidalab_qe_wannier90.result.utils import encode_mesh
+from aiidalab_qe_wannier90.utils import compute_isosurface
+
+
+def legacy_encode_mesh(vertices, faces):
+    """The conversion used before ``encode_mesh``, on the float64/int64 marching-cubes output."""
+    return vertices.tolist(), faces.tolist()
+
+
+def synthetic_mesh(size):
+    x = np.linspace(-1, 1, size)
+    xx, yy, zz = np.meshgrid(x, x, x, indexing='ij')
+    data = xx * np.exp(-4 * (xx**2 + yy**2 + zz**2))
+    lattice_vectors = np.eye(3) * 10.0
+    verts, faces, _, _ = measure.marching_cubes(data, level=0.05)
+    legacy_vertices = (np.dot(verts / np.array(data.shape), lattice_vectors)).astype(np.float64).ravel()
+    legacy_faces = faces.astype(np.int64).ravel()
+    vertices, faces = compute_isosurface(data, 0.05, np.zeros(3), lattice_vectors)
+    return (legacy_vertices, legacy_faces), (vertices, faces)
+
+
+def encode_payload(encoder, vertices, faces):
+    vertices, faces = encoder(vertices, faces)
+    return json.dumps([{'vertices': vertices, 'faces': faces}])
+
+
+def measure_payload(encoder, vertices, faces):
+    start = time.perf_counter()
+    payload = encode_payload(encoder, vertices, faces)
+    elapsed = time.perf_counter() - start
+    # the memory is traced in a separate run, tracing slows down the allocations
+    tracemalloc.start()
+    encode_payload(encoder, vertices, faces)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return len(payload), elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[64, 100, 160])
+    args = parser.parse_args()
+
+    print(f'{"grid":>8} {"triangles":>10} {"encoder":>10} {"payload (MB)":>13} {"time (s)":>10} {"peak (MB)":>10}')
+    for size in args.sizes:
+        legacy, current = synthetic_mesh(size)
+        for label, encoder, (vertices, faces) in (
+            ('legacy', legacy_encode_mesh, legacy),
+            ('encode', encode_mesh, current),
+        ):
+            nbytes, elapsed, peak = measure_payload(encoder, vertices, faces)
+            print(
+                f'{size:>6}^3 {faces.size // 3:>10} {label:>10} {nbytes / 1e6:>13.2f} '
+                f'{elapsed:>10.3f} {peak / 1e6:>10.1f}'
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""Benchmark the XSF datagrid parser against the previous line-by-line implementation.
+
+Synthetic Wannier-function-like grids are written to temporary XSF files and parsed with both
+implementations. Run with::
+
+    python benchmarks/benchmark_read_xsf.py --sizes 64 100 160
+"""
+
+import argparse
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+from ase.build import bulk
+from ase.io import read, write
+
+from aiidalab_qe_wannier90.utils import parse_xsf_density
+
+
+def legacy_read_xsf_density(handle):
+    """The parser used before the bulk NumPy implementation, kept here as a reference."""
+    atoms = read(handle, format='xsf')
+    lines = handle.readlines()
+    for i, line in enumerate(lines):
+        if 'BEGIN_DATAGRID_3D' in line:
+            grid_start = i + 1
+            break
+    nx, ny, nz = map(int, lines[grid_start].split())
+    origin = np.array([float(x) for x in lines[grid_start + 1].split()])
+    lattice_vectors = np.array([list(map(float, lines[grid_start + j].split())) for j in range(2, 5)])
+    density_data = []
+    for line in lines[grid_start + 5:]:
+        if 'END_DATAGRID_3D' in line:
+            break
+        density_data.extend(map(float, line.split()))
+    density_array = np.array(density_data).reshape((nx, ny, nz), order='F')
+    return atoms, nx, ny, nz, origin, lattice_vectors, density_array
+
+
+def write_synthetic_xsf(path, size):
+    """Write a Gaussian-like lobe on a ``size**3`` grid, mimicking a real-space Wannier function."""
+    atoms = bulk('Si', cubic=True)
+    x = np.linspace(-1, 1, size)
+    xx, yy, zz = np.meshgrid(x, x, x, indexing='ij')
+    data = xx * np.exp(-4 * (xx**2 + yy**2 + zz**2))
+    with open(path, 'w') as f:
+        write(f, atoms, format='xsf', data=data)
+
+
+def measure(parser, path, **kwargs):
+    tracemalloc.start()
+    start = time.perf_counter()
+    with open(path) as f:
+        result = parser(f, **kwargs)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result[-1], elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[48, 80, 120])
+    args = parser.parse_args()
+
+    print(f'{"grid":>8} {"file (MB)":>10} {"parser":>16} {"time (s)":>10} {"peak (MB)":>10}')
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for size in args.sizes:
+            path = Path(tmpdir) / f'grid_{size}.xsf'
+            write_synthetic_xsf(path, size)
+            file_mb = path.stat().st_size / 1e6
+            reference, *_ = measure(legacy_read_xsf_density, path)
+            for label, func, kwargs in (
+                ('legacy', legacy_read_xsf_density, {}),
+                ('bulk float64', parse_xsf_density, {'dtype': np.float64}),
+                ('bulk float32', parse_xsf_density, {'dtype': np.float32}),
+            ):
+                density, elapsed, peak = measure(func, path, **kwargs)
+                np.testing.assert_allclose(density, reference, rtol=1e-6, atol=1e-7)
+                print(f'{size:>6}^3 {file_mb:>10.1f} {label:>16} {elapsed:>10.3f} {peak / 1e6:>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
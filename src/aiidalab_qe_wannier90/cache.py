@@ -0,0 +1,198 @@
+"""Caches for parsed real-space Wannier function data."""
+
+import os
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+from ase import Atoms
+
+CACHE_DIR = Path(os.environ.get('XDG_CACHE_HOME', Path.home() / '.cache')) / 'aiidalab-qe-wannier90' / 'xsf'
+DEFAULT_CACHE_MAX_BYTES = 4 * 1024**3
+
+
+class XsfGridCache:
+    """On-disk LRU cache of parsed XSF grids, keyed by the UUID of the retrieved node and the filename.
+
+    Each entry is stored as a ``.npy`` file holding the density grid, which is memory-mapped on load,
+    and a ``.npz`` sidecar holding the origin, the lattice vectors and the atoms. The least recently
+    used entries are evicted when the total size exceeds ``max_bytes``.
+    """
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=DEFAULT_CACHE_MAX_BYTES):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+
+    def _paths(self, uuid, filename):
+        folder = self.directory / uuid
+        return folder / f'{filename}.npy', folder / f'{filename}.meta.npz'
+
+    def load(self, uuid, filename):
+        """Return ``(atoms, nx, ny, nz, origin, lattice_vectors, density_array)`` or None if not cached."""
+        grid_path, meta_path = self._paths(uuid, filename)
+        try:
+            density_array = np.load(grid_path, mmap_mode='r')
+            with np.load(meta_path) as meta:
+                atoms = Atoms(
+                    numbers=meta['numbers'],
+                    positions=meta['positions'],
+                    cell=meta['cell'],
+                    pbc=meta['pbc'],
+                )
+                origin = meta['origin']
+                lattice_vectors = meta['lattice_vectors']
+            # refresh the access time used for the LRU eviction
+            os.utime(grid_path)
+        except (OSError, ValueError, KeyError):
+            return None
+        nx, ny, nz = density_array.shape
+        return atoms, nx, ny, nz, origin, lattice_vectors, density_array
+
+    def store(self, uuid, filename, atoms, origin, lattice_vectors, density_array):
+        """Store a parsed grid and evict the least recently used entries if needed.
+
+        Failures to write (e.g. read-only or full disk) are ignored, the cache is only an optimisation.
+        """
+        grid_path, meta_path = self._paths(uuid, filename)
+        # write both files to temporary files first, so that a concurrent reader never sees a partial entry and a
+        # failed write does not leave an orphaned sidecar, which would never be evicted
+        tmp_grid = grid_path.with_name(f'.{grid_path.name}.tmp')
+        tmp_meta = meta_path.with_name(f'.{meta_path.name}.tmp')
+        try:
+            grid_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(tmp_grid, 'wb') as f:
+                np.save(f, density_array)
+            with open(tmp_meta, 'wb') as f:
+                np.savez(
+                    f,
+                    numbers=atoms.get_atomic_numbers(),
+                    positions=atoms.get_positions(),
+                    cell=np.asarray(atoms.get_cell()),
+                    pbc=atoms.get_pbc(),
+                    origin=origin,
+                    lattice_vectors=lattice_vectors,
+                )
+            # the entries are listed by their grid, which is therefore moved in place last
+            os.replace(tmp_meta, meta_path)
+            os.replace(tmp_grid, grid_path)
+        except OSError:
+            for path in (tmp_grid, tmp_meta):
+                try:
+                    path.unlink(missing_ok=True)
+                except OSError:
+                    pass
+            return
+        self.evict()
+
+    def _entries(self):
+        """Return ``(mtime, size, grid_path, meta_path)`` for all the cached entries."""
+        entries = []
+        for grid_path in self.directory.glob('*/*.npy'):
+            meta_path = grid_path.with_name(f'{grid_path.name[:-4]}.meta.npz')
+            try:
+                stat = grid_path.stat()
+                size = stat.st_size + (meta_path.stat().st_size if meta_path.exists() else 0)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, size, grid_path, meta_path))
+        return entries
+
+    @property
+    def size(self):
+        """Total size in bytes of the cached entries."""
+        return sum(entry[1] for entry in self._entries())
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits in ``max_bytes``."""
+        entries = sorted(self._entries(), key=lambda entry: entry[0])
+        total = sum(entry[1] for entry in entries)
+        for _, size, grid_path, meta_path in entries:
+            if total <= self.max_bytes:
+                break
+            for path in (grid_path, meta_path):
+                path.unlink(missing_ok=True)
+            total -= size
+
+    def clear(self):
+        """Remove all the cached entries."""
+        for _, _, grid_path, meta_path in self._entries():
+            for path in (grid_path, meta_path):
+                path.unlink(missing_ok=True)
+        for folder in self.directory.glob('*'):
+            if folder.is_dir() and not any(folder.iterdir()):
+                folder.rmdir()
+
+
+xsf_grid_cache = XsfGridCache()
+
+
+def clear_xsf_cache():
+    """Remove all the parsed XSF grids from the on-disk cache."""
+    xsf_grid_cache.clear()
+
+
+def _nbytes(value):
+    """Estimate the memory held by ``value``, counting only the NumPy arrays it contains."""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sum(_nbytes(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(_nbytes(item) for item in value)
+    return 0
+
+
+class LRUCache:
+    """In-memory least-recently-used cache bounded by the total size of the cached arrays."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        """Return the cached value for ``key``, marking it as the most recently used."""
+        try:
+            value, _ = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """Cache ``value``, evicting the least recently used entries to stay within ``max_bytes``.
+
+        Values larger than the whole budget are not cached.
+        """
+        self.pop(key)
+        size = _nbytes(value)
+        if size > self.max_bytes:
+            return
+        while self._data and self.nbytes + size > self.max_bytes:
+            _, (_, evicted_size) = self._data.popitem(last=False)
+            self.nbytes -= evicted_size
+        self._data[key] = (value, size)
+        self.nbytes += size
+
+    def pop(self, key, default=None):
+        """Remove ``key`` from the cache and return its value."""
+        if key not in self._data:
+            return default
+        value, size = self._data.pop(key)
+        self.nbytes -= size
+        return value
+
+    def clear(self):
+        """Remove all the cached values."""
+        self._data.clear()
+        self.nbytes = 0
@@ -0,0 +1,161 @@
+"""Rough estimates of the size of the files and of the cost of a Wannier90 workchain, before submitting it.
+
+The estimates only depend on the structure and the settings of the panel, not on the pseudopotentials or on the
+parsed outputs of any calculation: they are meant to give the order of magnitude, e.g. to spot settings that would
+exceed the scratch quota or run for days.
+"""
+
+import numpy as np
+from ase.units import Bohr
+
+# Approximate k-point distances (in 2π/Å, as ``kpoints_distance``) of the NSCF and SCF for each protocol
+NSCF_KPOINTS_DISTANCE = {'fast': 0.5, 'moderate': 0.2, 'precise': 0.15}
+SCF_KPOINTS_DISTANCE = {'fast': 0.3, 'moderate': 0.15, 'precise': 0.1}
+# Wavefunction cutoffs (in Ry) assumed for each protocol, the actual ones are set by the pseudopotentials
+ECUTWFC = {'fast': 30.0, 'moderate': 45.0, 'precise': 60.0}
+# Number of bands of the NSCF per Wannier function
+NSCF_BANDS_FACTOR = 1.5
+# Number of nearest neighbours of each k-point in the MMN file (b-vectors), 12 is the most for a Bravais lattice
+NUM_NEIGHBOURS = 12
+# Supercell of the real-space Wannier functions (``wannier_plot_supercell``)
+PLOT_SUPERCELL = 2
+# Bytes of each line of the AMN and MMN files, and of each value of the XSF and BXSF files
+AMN_LINE_BYTES = 52
+MMN_LINE_BYTES = 38
+XSF_VALUE_BYTES = 13
+BXSF_VALUE_BYTES = 13
+# Cost model: core-seconds per band, per k-point and per application of the Hamiltonian, for each FFT point
+CORE_SECONDS_PER_FFT_POINT = 5e-9
+SCF_HAMILTONIAN_APPLICATIONS = 60
+NSCF_HAMILTONIAN_APPLICATIONS = 30
+SCF_SYMMETRY_REDUCTION = 4
+# spacing (in 2π/Å) of the k-points along the path of the DFT bands
+BANDS_KPOINTS_DISTANCE = 0.025
+# Wannierizations of the PDWF trials run after the first one, with and without the scan of the thresholds
+SCAN_NUM_TRIALS = 30
+FALLBACK_NUM_TRIALS = 1
+WANNIER90_ITERATIONS = 1000
+SKEAF_CORE_SECONDS_PER_ROTATION = 2.0
+# The settings panel warns above these estimates of the total size of the files and of the total cost
+SIZE_WARNING_BYTES = 100 * 1024**3
+CORE_HOURS_WARNING = 1000.0
+
+
+def count_wannier_functions(numbers, exclude_semicore=True):
+    """Return the expected number of Wannier functions of the atoms with atomic ``numbers``.
+
+    This is the number of pseudo-atomic orbitals used as projectors: the s orbital of H and He, the s and p orbitals
+    of the main-group elements, the s, p and d orbitals of the transition metals and the s, d and f orbitals of the
+    lanthanides and actinides, plus the semicore s and p orbitals of the heavier elements if they are not excluded.
+    """
+    count = 0
+    for number in numbers:
+        if number <= 2:
+            orbitals = 1
+        elif 21 <= number <= 30 or 39 <= number <= 48 or 72 <= number <= 80:
+            orbitals = 9
+        elif 57 <= number <= 71 or 89 <= number <= 103:
+            orbitals = 13
+        else:
+            orbitals = 4
+        if not exclude_semicore and number > 18:
+            orbitals += 4
+        count += orbitals
+    return count
+
+
+def kpoint_mesh(cell, distance):
+    """Return the k-point mesh of ``cell`` (in Å) with a spacing ``distance`` (in 2π/Å, as ``kpoints_distance``)."""
+    reciprocal_lengths = np.linalg.norm(2 * np.pi * np.linalg.inv(cell).T, axis=1)
+    return [max(1, int(np.ceil(length / distance))) for length in reciprocal_lengths]
+
+
+def fft_grid(cell, ecutwfc):
+    """Return the FFT grid of the charge density of ``cell`` (in Å) for a wavefunction cutoff ``ecutwfc`` (in Ry)."""
+    lengths = np.linalg.norm(cell, axis=1) / Bohr
+    # the charge density has a cutoff 4 ecutwfc, i.e. a maximum G vector of 2 sqrt(ecutwfc) (in 1/bohr)
+    return [int(np.ceil(2 * np.sqrt(ecutwfc) * length / np.pi)) + 1 for length in lengths]
+
+
+def estimate_cost(
+    atoms,
+    protocol='moderate',
+    exclude_semicore=True,
+    plot_wannier_functions=False,
+    scan_pdwf_parameter=False,
+    compute_fermi_surface=False,
+    fermi_surface_kpoint_distance=0.04,
+    dhva_num_rotation=0,
+    ecutwfc=None,
+):
+    """Return the estimated sizes (in bytes) of the files and cost (in core-hours) of the steps of the workchain.
+
+    ``atoms`` is the input structure, ``protocol`` the protocol of the Wannier90 workflows (``fast``, ``moderate``
+    or ``precise``), and the other arguments the settings of the panel. The wavefunction cutoff ``ecutwfc`` (in Ry)
+    defaults to ``ECUTWFC`` of the protocol.
+    """
+    cell = np.asarray(atoms.get_cell())
+    ecutwfc = ecutwfc or ECUTWFC.get(protocol, ECUTWFC['moderate'])
+    num_wann = count_wannier_functions(atoms.get_atomic_numbers(), exclude_semicore)
+    num_bands = int(np.ceil(NSCF_BANDS_FACTOR * num_wann))
+
+    nscf_mesh = kpoint_mesh(cell, NSCF_KPOINTS_DISTANCE.get(protocol, NSCF_KPOINTS_DISTANCE['moderate']))
+    num_kpoints = int(np.prod(nscf_mesh))
+    scf_mesh = kpoint_mesh(cell, SCF_KPOINTS_DISTANCE.get(protocol, SCF_KPOINTS_DISTANCE['moderate']))
+    scf_num_kpoints = int(np.prod(scf_mesh))
+    # the high-symmetry path is about twice as long as the sum of the reciprocal lattice vectors
+    reciprocal_lengths = np.linalg.norm(2 * np.pi * np.linalg.inv(cell).T, axis=1)
+    bands_num_kpoints = int(np.ceil(2 * reciprocal_lengths.sum() / BANDS_KPOINTS_DISTANCE))
+    grid = fft_grid(cell, ecutwfc)
+    num_fft_points = int(np.prod(grid))
+    num_plane_waves = int(abs(np.linalg.det(cell)) / Bohr**3 * ecutwfc**1.5 / (6 * np.pi**2))
+
+    sizes = {
+        'amn': num_kpoints * num_bands * num_wann * AMN_LINE_BYTES,
+        'mmn': num_kpoints * NUM_NEIGHBOURS * num_bands**2 * MMN_LINE_BYTES,
+        # wavefunctions, in the scratch of the NSCF
+        'wavefunctions': num_kpoints * num_bands * num_plane_waves * 16,
+    }
+    if plot_wannier_functions:
+        # periodic parts of the Bloch functions (unformatted complex), and one XSF file per Wannier function
+        sizes['unk'] = num_kpoints * num_bands * num_fft_points * 16
+        sizes['xsf'] = num_wann * num_fft_points * PLOT_SUPERCELL**3 * XSF_VALUE_BYTES
+    if compute_fermi_surface:
+        num_points = max(kpoint_mesh(cell, fermi_surface_kpoint_distance))
+        sizes['bxsf'] = num_wann * (num_points + 1) ** 3 * BXSF_VALUE_BYTES
+
+    # cost of one application of the Hamiltonian to one band at one k-point
+    band_seconds = CORE_SECONDS_PER_FFT_POINT * num_fft_points * np.log2(num_fft_points)
+    core_seconds = {
+        'scf': band_seconds * num_bands * scf_num_kpoints / SCF_SYMMETRY_REDUCTION * SCF_HAMILTONIAN_APPLICATIONS,
+        'bands': band_seconds * num_bands * bands_num_kpoints * NSCF_HAMILTONIAN_APPLICATIONS,
+        'nscf': band_seconds * num_bands * num_kpoints * NSCF_HAMILTONIAN_APPLICATIONS,
+        # one FFT per band for each neighbour, and the overlaps
+        'pw2wannier90': band_seconds * num_bands * num_kpoints * NUM_NEIGHBOURS
+        + 8e-9 * num_kpoints * NUM_NEIGHBOURS * num_bands**2 * num_plane_waves,
+        'wannier90': 1e-9 * num_kpoints * NUM_NEIGHBOURS * num_wann**3 * WANNIER90_ITERATIONS
+        * (1 + (SCAN_NUM_TRIALS if scan_pdwf_parameter else FALLBACK_NUM_TRIALS)),
+    }
+    if plot_wannier_functions:
+        core_seconds['wannier90'] += 1e-8 * num_kpoints * num_wann * num_bands * num_fft_points * PLOT_SUPERCELL**3
+    if compute_fermi_surface and dhva_num_rotation:
+        core_seconds['skeaf'] = SKEAF_CORE_SECONDS_PER_ROTATION * dhva_num_rotation
+
+    return {
+        'num_wann': num_wann,
+        'num_bands': num_bands,
+        'nscf_mesh': nscf_mesh,
+        'num_kpoints': num_kpoints,
+        'fft_grid': grid,
+        'ecutwfc': ecutwfc,
+        'sizes': sizes,
+        'core_hours': {step: float(seconds) / 3600 for step, seconds in core_seconds.items()},
+    }
+
+
+def format_bytes(size):
+    """Format a size in bytes with a binary prefix, e.g. ``1.5 GiB``."""
+    for unit in ('B', 'KiB', 'MiB', 'GiB', 'TiB'):
+        if size < 1024 or unit == 'TiB':
+            return f'{size:.0f} {unit}' if unit == 'B' else f'{size:.1f} {unit}'
+        size /= 1024
@@ -0,0 +1,306 @@
+"""Density of states and Fermi surfaces on dense k-meshes, from the Wannier interpolation of a tight-binding model."""
+
+import itertools
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .utils import XSF_CHUNK_SIZE, _iter_datagrid_text, _parse_floats, compute_isosurface, simplify_mesh
+
+# Number of k-points diagonalized per task of the process pool
+EIGENVALUES_TASK_SIZE = 4096
+# Smaller sets of k-points are diagonalized in the current process, starting the pool takes a few seconds
+POOL_MIN_KPOINTS = 100_000
+# Default Gaussian smearing (in eV) of the density of states
+DOS_SMEARING = 0.05
+# Fermi-surface meshes of each band are decimated to this number of triangles
+FERMI_SURFACE_TARGET_FACES = 60_000
+# The symmetries used to reduce the mesh are checked on this number of k-points, within this tolerance (in eV)
+SYMMETRY_CHECK_KPOINTS = 64
+SYMMETRY_CHECK_TOLERANCE = 1e-3
+
+_BAND_LINE = re.compile(r'BAND:\s*(\d+)[^\n]*')
+
+_worker_interpolator = None
+
+
+def _init_worker(interpolator):
+    global _worker_interpolator
+    _worker_interpolator = interpolator
+
+
+def _worker_eigenvalues(kpoints):
+    # single precision is enough for DOS and Fermi surfaces, and halves the memory of dense meshes
+    return _worker_interpolator.eigenvalues(kpoints).astype(np.float32)
+
+
+def mesh_grid(mesh):
+    """Return the integer coordinates of the points of a Γ-centered ``mesh``, the last index running fastest."""
+    return np.indices(mesh).reshape(3, -1).T
+
+
+def irreducible_kpoints(mesh, structure=None, time_reversal=True, symprec=1e-5):
+    """Reduce a Γ-centered ``mesh`` of k-points by symmetry.
+
+    Without ``structure``, only time-reversal symmetry (``E(k) = E(-k)``) is used, unless ``time_reversal`` is
+    False. With ``structure``, given as a spglib cell ``(lattice, scaled_positions, numbers)`` expressed in the
+    lattice of the tight-binding model, the space-group symmetries found by spglib (if installed) are used as well.
+
+    Returns ``(kpoints, weights, mapping)``: the irreducible k-points in crystal coordinates, their number of
+    equivalent points in the mesh, and, for each point of the mesh (see ``mesh_grid``), the index of its
+    irreducible k-point.
+    """
+    mesh = np.asarray(mesh)
+    grid = mesh_grid(mesh)
+    equivalent = None
+    if structure is not None:
+        try:
+            import spglib
+        except ImportError:
+            spglib = None
+        if spglib is not None:
+            result = spglib.get_ir_reciprocal_mesh(
+                mesh, structure, is_shift=[0, 0, 0], is_time_reversal=time_reversal, symprec=symprec
+            )
+            if result is not None:
+                spglib_mapping, addresses = result
+                # spglib orders the mesh with the first index running fastest
+                spglib_to_grid = np.ravel_multi_index((addresses % mesh).T, mesh)
+                equivalent = np.empty(len(grid), dtype=np.int64)
+                equivalent[spglib_to_grid] = spglib_to_grid[spglib_mapping]
+    if equivalent is None and time_reversal:
+        opposite = np.ravel_multi_index(((-grid) % mesh).T, mesh)
+        equivalent = np.minimum(np.arange(len(grid)), opposite)
+    elif equivalent is None:
+        equivalent = np.arange(len(grid))
+    irreducible, mapping = np.unique(equivalent, return_inverse=True)
+    weights = np.bincount(mapping)
+    return grid[irreducible] / mesh, weights, mapping.ravel()
+
+
+def is_symmetric(
+    interpolator, mesh, kpoints, mapping, num_kpoints=SYMMETRY_CHECK_KPOINTS, tolerance=SYMMETRY_CHECK_TOLERANCE
+):
+    """Return whether the model has the same eigenvalues at points of the ``mesh`` and at their irreducible k-points.
+
+    The reduction of ``irreducible_kpoints`` assumes the symmetries of the crystal structure, which are broken by
+    magnetism or by a Wannier model that does not have them. They are checked on ``num_kpoints`` random points.
+    """
+    mesh = np.asarray(mesh)
+    grid = mesh_grid(mesh)
+    points = np.random.default_rng(0).choice(len(grid), size=min(num_kpoints, len(grid)), replace=False)
+    energies = interpolator.eigenvalues(grid[points] / mesh)
+    irreducible_energies = interpolator.eigenvalues(kpoints[mapping[points]])
+    return np.allclose(energies, irreducible_energies, atol=tolerance)
+
+
+def compute_eigenvalues(interpolator, kpoints, max_workers=None, task_size=EIGENVALUES_TASK_SIZE):
+    """Return the single-precision ``(num_k, num_wann)`` eigenvalues at ``kpoints``, computed by a process pool.
+
+    The interpolator is sent once to each of the ``max_workers`` processes (all the cores by default), which
+    then diagonalize tasks of ``task_size`` k-points, each in memory-bounded chunks.
+    """
+    kpoints = np.asarray(kpoints, dtype=np.float64)
+    max_workers = max_workers or os.cpu_count() or 1
+    if max_workers == 1 or len(kpoints) < POOL_MIN_KPOINTS:
+        return interpolator.eigenvalues(kpoints).astype(np.float32)
+    tasks = [kpoints[start:start + task_size] for start in range(0, len(kpoints), task_size)]
+    # spawn the workers, forking a process with running threads (e.g. a Jupyter kernel) is not safe
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(
+        max_workers=min(max_workers, len(tasks)),
+        mp_context=context,
+        initializer=_init_worker,
+        initargs=(interpolator,),
+    ) as executor:
+        return np.concatenate(list(executor.map(_worker_eigenvalues, tasks)))
+
+
+def compute_dos(energies, weights, energy_grid, smearing=DOS_SMEARING):
+    """Return the Gaussian-smeared density of states (states/eV per cell) on the uniform ``energy_grid``.
+
+    ``energies`` are the ``(num_k, num_bands)`` eigenvalues at k-points of weights ``weights``. The energies
+    are binned on the grid and the histogram is convolved with the Gaussian, so that the cost is linear in
+    the number of eigenvalues.
+    """
+    energy_grid = np.asarray(energy_grid)
+    step = energy_grid[1] - energy_grid[0]
+    edges = np.append(energy_grid - step / 2, energy_grid[-1] + step / 2)
+    histogram, _ = np.histogram(
+        energies.ravel(), bins=edges, weights=np.repeat(weights, energies.shape[1]).astype(np.float64)
+    )
+    histogram /= weights.sum() * step
+    half_width = int(np.ceil(5 * smearing / step))
+    offsets = np.arange(-half_width, half_width + 1) * step
+    kernel = np.exp(-((offsets / smearing) ** 2) / 2)
+    return np.convolve(histogram, kernel / kernel.sum(), mode='same')
+
+
+def crossing_bands(energies, fermi_energy):
+    """Return the indices of the bands crossing the Fermi energy."""
+    return np.flatnonzero((energies.min(axis=0) <= fermi_energy) & (energies.max(axis=0) >= fermi_energy))
+
+
+def compute_fermi_surface(interpolator, mesh, fermi_energy, structure=None, time_reversal=True, max_workers=None):
+    """Compute the bands on a dense Γ-centered ``mesh``, for the density of states and the Fermi surface.
+
+    Only the symmetry-irreducible k-points are diagonalized (see ``irreducible_kpoints``), in a process pool
+    (see ``compute_eigenvalues``). If the model does not have the symmetries of the ``structure`` (see
+    ``is_symmetric``), only time reversal is used, and then no symmetry at all. Returns a dict with the
+    irreducible ``energies`` and their ``weights``, the ``mapping`` of the mesh onto them, the ``mesh``, the
+    ``symmetry`` that was used, the ``fermi_energy`` and the indices of the bands crossing it (``fermi_bands``).
+    """
+    reductions = []
+    if structure is not None:
+        reductions.append(('space group', structure, time_reversal))
+    if time_reversal:
+        reductions.append(('time reversal', None, True))
+    reductions.append(('none', None, False))
+    for symmetry, cell, use_time_reversal in reductions:
+        kpoints, weights, mapping = irreducible_kpoints(mesh, cell, time_reversal=use_time_reversal)
+        if symmetry == 'none' or is_symmetric(interpolator, mesh, kpoints, mapping):
+            break
+    energies = compute_eigenvalues(interpolator, kpoints, max_workers=max_workers)
+    return {
+        'mesh': tuple(int(n) for n in mesh),
+        'energies': energies,
+        'weights': weights,
+        'mapping': mapping,
+        'symmetry': symmetry,
+        'fermi_energy': fermi_energy,
+        'fermi_bands': crossing_bands(energies, fermi_energy),
+    }
+
+
+def band_grid(fermi_surface, band):
+    """Return the energies of ``band`` on the full mesh, with shape ``mesh``."""
+    return fermi_surface['energies'][fermi_surface['mapping'], band].reshape(fermi_surface['mesh'])
+
+
+def write_bxsf(handle, fermi_surface, lattice_vectors, bands=None, values_per_line=6):
+    """Write the bands (by default those crossing the Fermi energy) in the XCrySDen BXSF format.
+
+    ``handle`` is a binary stream. The bands are written on the general grid of the format, i.e. including
+    the periodic images at the end of each direction, the last index running fastest, as done by Wannier90.
+    """
+    bands = fermi_surface['fermi_bands'] if bands is None else bands
+    reciprocal_vectors = 2 * np.pi * np.linalg.inv(np.asarray(lattice_vectors)).T
+    n1, n2, n3 = (n + 1 for n in fermi_surface['mesh'])
+    header = [
+        'BEGIN_INFO',
+        f'  Fermi Energy: {fermi_surface["fermi_energy"]:.8f}',
+        'END_INFO',
+        'BEGIN_BLOCK_BANDGRID_3D',
+        'from_wannier_interpolation',
+        'BEGIN_BANDGRID_3D_fermi',
+        f'{len(bands)}',
+        f'{n1} {n2} {n3}',
+        '0.0 0.0 0.0',
+    ] + [' '.join(f'{x:.8f}' for x in vector) for vector in reciprocal_vectors]
+    handle.write(('\n'.join(header) + '\n').encode())
+    for band in bands:
+        handle.write(f'BAND: {band + 1}\n'.encode())
+        grid = np.pad(band_grid(fermi_surface, band), ((0, 1), (0, 1), (0, 1)), mode='wrap')
+        values = grid.ravel()
+        full, rest = divmod(len(values), values_per_line)
+        np.savetxt(handle, values[:full * values_per_line].reshape(full, values_per_line), fmt='%.6f')
+        if rest:
+            np.savetxt(handle, values[full * values_per_line:][None], fmt='%.6f')
+    handle.write(b'END_BANDGRID_3D\nEND_BLOCK_BANDGRID_3D\n')
+
+
+def parse_bxsf(handle, dtype=np.float32, chunk_size=XSF_CHUNK_SIZE):
+    """Parse the band grids of a BXSF file (as written by Wannier90 or ``write_bxsf``).
+
+    The header is read line by line, the band energies are then parsed in chunks of ``chunk_size``
+    characters (see ``_iter_datagrid_text``), each chunk being cut at a line break so that the ``BAND: i``
+    lines can be removed before a single ``np.fromstring`` call. Returns a dict with the ``fermi_energy``, the ``reciprocal_vectors``
+    (as rows, in Å⁻¹), the 0-based indices of the ``bands`` and their ``energies`` with shape
+    ``(num_bands, n1, n2, n3)`` on the periodic mesh (the periodic images of the general grid are dropped).
+    """
+    fermi_energy = None
+    for line in handle:
+        if 'Fermi Energy' in line:
+            fermi_energy = float(line.split(':')[1])
+        elif line.strip().startswith('BEGIN_BANDGRID_3D'):
+            break
+    else:
+        raise ValueError('No BEGIN_BANDGRID_3D block found in the BXSF file')
+    num_bands = int(handle.readline())
+    shape = tuple(int(x) for x in handle.readline().split())
+    handle.readline()  # origin, always Γ
+    reciprocal_vectors = np.array([[float(x) for x in handle.readline().split()] for _ in range(3)])
+    size = num_bands * int(np.prod(shape))
+    data = np.empty(size, dtype=dtype)
+    bands = []
+    filled = 0
+    for text in _iter_datagrid_text(handle, chunk_size, cut_at_line_break=True):
+        bands.extend(int(band) - 1 for band in _BAND_LINE.findall(text))
+        values = _parse_floats(_BAND_LINE.sub(' ', text), dtype)
+        if filled + values.size > size:
+            raise ValueError(f'Mismatch in data size: expected {size}, got more')
+        data[filled:filled + values.size] = values
+        filled += values.size
+    if filled != size:
+        raise ValueError(f'Mismatch in data size: expected {size}, got {filled}')
+    energies = data.reshape((num_bands, *shape))[:, :-1, :-1, :-1]
+    return {
+        'fermi_energy': fermi_energy,
+        'reciprocal_vectors': reciprocal_vectors,
+        'bands': np.array(bands or range(num_bands)),
+        'energies': energies,
+    }
+
+
+def brillouin_zone_mask(points, reciprocal_vectors, tolerance=1e-6):
+    """Return whether each of the Cartesian ``points`` lies in the first Brillouin zone.
+
+    A point is in the Wigner-Seitz cell of the reciprocal lattice if it is closer to Γ than to any of the
+    neighbouring reciprocal lattice vectors G, i.e. if ``k.G <= |G|^2 / 2``.
+    """
+    neighbours = np.array([n for n in itertools.product((-1, 0, 1), repeat=3) if any(n)]) @ reciprocal_vectors
+    return np.all(points @ neighbours.T <= (neighbours**2).sum(axis=1) / 2 + tolerance, axis=1)
+
+
+def compute_fermi_surface_mesh(
+    energies,
+    energy,
+    reciprocal_vectors,
+    clip_to_brillouin_zone=True,
+    step_size=1,
+    target_faces=FERMI_SURFACE_TARGET_FACES,
+):
+    """Extract the isosurface ``E(k) = energy`` of a band given on a periodic mesh, see ``compute_isosurface``.
+
+    Without clipping, the surface is extracted in the reciprocal unit cell. With clipping, the mesh is tiled
+    to cover the fractional coordinates [-1, 1] and only the triangles whose centroid lies in the first
+    Brillouin zone are kept, so that the Fermi surface sheets are shown whole around Γ.
+    Returns the flattened float32 vertices (in Å⁻¹) and int32 faces, empty if the band does not cross ``energy``.
+    """
+    reciprocal_vectors = np.asarray(reciprocal_vectors)
+    if not energies.min() <= energy <= energies.max():
+        return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int32)
+    if clip_to_brillouin_zone:
+        grid = np.pad(np.tile(energies, (2, 2, 2)), ((0, 1), (0, 1), (0, 1)), mode='wrap')
+        origin = -reciprocal_vectors.sum(axis=0)
+        spanning_vectors = 2 * reciprocal_vectors
+    else:
+        grid = np.pad(energies, ((0, 1), (0, 1), (0, 1)), mode='wrap')
+        origin = np.zeros(3)
+        spanning_vectors = reciprocal_vectors
+    # `compute_isosurface` maps the index i of an axis of n points to i / n, the last point is at 1 here
+    shape = np.array(grid.shape)
+    spanning_vectors = spanning_vectors * (shape / (shape - 1))[:, None]
+    vertices, faces = compute_isosurface(grid, energy, origin, spanning_vectors, step_size=step_size)
+    if clip_to_brillouin_zone:
+        vertices = vertices.reshape(-1, 3)
+        faces = faces.reshape(-1, 3)
+        faces = faces[brillouin_zone_mask(vertices[faces].mean(axis=1), reciprocal_vectors)]
+        # drop the vertices that are not used anymore
+        used, faces = np.unique(faces, return_inverse=True)
+        vertices = vertices[used].ravel()
+        faces = faces.reshape(-1).astype(np.int32)
+    return simplify_mesh(vertices, faces, target_faces=target_faces)
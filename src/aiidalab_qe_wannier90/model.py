@@ -2,6 +2,8 @@ import traitlets as tl
 from aiidalab_qe.common.mixins import HasInputStructure
 from aiidalab_qe.common.panel import PanelModel
 
+from .estimate import estimate_cost
+
 
 class Wannier90ConfigurationSettingsModel(PanelModel, HasInputStructure):
     title = 'Wannier functions'
@@ -16,11 +18,19 @@ class Wannier90ConfigurationSettingsModel(PanelModel, HasInputStructure):
     # to almost flat bands and do not play any role in the chemistry of the materials
     exclude_semicore = tl.Bool(allow_none=True, default_value=True)
     scan_pdwf_parameter = tl.Bool(allow_none=True, default_value=False)
+    # number of Wannier90 workchains scanning consecutive ranges of the PDWF thresholds concurrently
+    pdwf_num_jobs = tl.Int(allow_none=True, default_value=1)
     plot_wannier_functions = tl.Bool(allow_none=True, default_value=False)
+    # isosurfaces of the Wannier functions computed by the workchain, in a pool of processes on the daemon host
+    precompute_isosurfaces = tl.Bool(allow_none=True, default_value=False)
+    isosurface_max_workers = tl.Int(allow_none=True, default_value=1)
     number_of_disproj_max = tl.Int(allow_none=True, default_value=15)
     number_of_disproj_min = tl.Int(allow_none=True, default_value=2)
     retrieve_hamiltonian = tl.Bool(allow_none=True, default_value=True)
     retrieve_matrices = tl.Bool(allow_none=True, default_value=False)
+    # storage of the retrieved tight-binding model: complex64 matrix elements, and hoppings dropped below (in eV)
+    tight_binding_single_precision = tl.Bool(allow_none=True, default_value=False)
+    tight_binding_threshold = tl.Float(allow_none=True, default_value=0.0)
     projection_type = tl.Unicode(allow_none=True, default_value='atomic_projectors_qe')
     frozen_type = tl.Unicode(allow_none=True, default_value='fixed_plus_projectability')
     energy_window_input = tl.Float(allow_none=True, default_value=2.0)
@@ -33,6 +43,8 @@ class Wannier90ConfigurationSettingsModel(PanelModel, HasInputStructure):
     dhva_ending_phi = tl.Float(allow_none=True, default_value=90.0)
     dhva_ending_theta = tl.Float(allow_none=True, default_value=90.0)
     dhva_num_rotation = tl.Int(allow_none=True, default_value=90)
+    # number of SKEAF workchains computing consecutive ranges of the rotation concurrently
+    dhva_num_jobs = tl.Int(allow_none=True, default_value=1)
 
     protocol = tl.Unicode(allow_none=True)
     electronic_type = tl.Unicode(allow_none=True)
@@ -48,6 +60,22 @@ class Wannier90ConfigurationSettingsModel(PanelModel, HasInputStructure):
             ]
         return []
 
+    def get_cost_estimate(self):
+        """Return the estimated file sizes and cost of the workchain (see ``estimate_cost``), None without structure."""
+        if self.input_structure is None:
+            return None
+        protocol = {'balanced': 'moderate', 'stringent': 'precise'}.get(self.protocol, self.protocol)
+        return estimate_cost(
+            self.input_structure.get_ase(),
+            protocol=protocol,
+            exclude_semicore=self.exclude_semicore,
+            plot_wannier_functions=self.plot_wannier_functions,
+            scan_pdwf_parameter=self.scan_pdwf_parameter,
+            compute_fermi_surface=self.compute_fermi_surface,
+            fermi_surface_kpoint_distance=self.fermi_surface_kpoint_distance,
+            dhva_num_rotation=self.dhva_num_rotation if self.compute_dhva_frequencies else 0,
+        )
+
     def get_model_state(self):
         state = {
             'exclude_semicore': self.exclude_semicore,
@@ -61,7 +89,20 @@ class Wannier90ConfigurationSettingsModel(PanelModel, HasInputStructure):
             'energy_window_input': self.energy_window_input,
             'compute_fermi_surface': self.compute_fermi_surface,
             'scan_pdwf_parameter': self.scan_pdwf_parameter,
+            'pdwf_num_jobs': self.pdwf_num_jobs,
         }
+        if self.plot_wannier_functions:
+            state |= {
+                'precompute_isosurfaces': self.precompute_isosurfaces,
+                'isosurface_max_workers': self.isosurface_max_workers,
+            }
+        if self.retrieve_hamiltonian:
+            state |= {
+                'tight_binding_parameters': {
+                    'single_precision': self.tight_binding_single_precision,
+                    'threshold': self.tight_binding_threshold,
+                },
+            }
         if self.compute_fermi_surface:
             state |= {
                 'fermi_surface_kpoint_distance': self.fermi_surface_kpoint_distance,
@@ -76,12 +117,15 @@ class Wannier90ConfigurationSettingsModel(PanelModel, HasInputStructure):
                         'ending_theta': self.dhva_ending_theta,
                         'num_rotation': self.dhva_num_rotation,
                     },
+                    'dhva_num_jobs': self.dhva_num_jobs,
                 }
         return state
 
     def set_model_state(self, parameters: dict):
         self.exclude_semicore = parameters.get('exclude_semicore', True)
         self.plot_wannier_functions = parameters.get('plot_wannier_functions', False)
+        self.precompute_isosurfaces = parameters.get('precompute_isosurfaces', False)
+        self.isosurface_max_workers = parameters.get('isosurface_max_workers', 1)
         self.number_of_disproj_max = parameters.get('number_of_disproj_max', 15)
         self.number_of_disproj_min = parameters.get('number_of_disproj_min', 2)
         self.compute_fermi_surface = parameters.get('compute_fermi_surface', False)
@@ -91,4 +135,10 @@ class Wannier90ConfigurationSettingsModel(PanelModel, HasInputStructure):
         self.dhva_starting_phi = parameters.get('dHvA_frequencies_parameters', {}).get('starting_phi', 0.0)
         self.dhva_starting_theta = parameters.get('dHvA_frequencies_parameters', {}).get('starting_theta', 90.0)
         self.dhva_num_rotation = parameters.get('dHvA_frequencies_parameters', {}).get('num_rotation', 90)
+        self.dhva_num_jobs = parameters.get('dhva_num_jobs', 1)
         self.scan_pdwf_parameter = parameters.get('scan_pdwf_parameter', False)
+        self.pdwf_num_jobs = parameters.get('pdwf_num_jobs', 1)
+        self.tight_binding_single_precision = parameters.get('tight_binding_parameters', {}).get(
+            'single_precision', False
+        )
+        self.tight_binding_threshold = parameters.get('tight_binding_parameters', {}).get('threshold', 0.0)
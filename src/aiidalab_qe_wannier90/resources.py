@@ -27,12 +27,20 @@ class Wannier90ResourceSettingsModel(PluginResourceSettingsModel):
                     description='pw.x',
                     default_calc_job_plugin='quantumespresso.pw',
                 ),
-                'projwfc': CodeModel(
+                # the NSCF on the full k-point grid of the Wannierization, scaled independently of the SCF
+                'nscf': PwCodeModel(
+                    name='pw.x (Wannier NSCF)',
+                    description='pw.x (Wannier NSCF)',
+                    default_calc_job_plugin='quantumespresso.pw',
+                ),
+                # the `npool` of the `PwCodeModel` is passed to projwfc.x as `-nk`, by default set from the k-points
+                'projwfc': PwCodeModel(
                     name='projwfc.x',
                     description='projwfc.x',
                     default_calc_job_plugin='quantumespresso.projwfc',
                 ),
-                'pw2wannier90': CodeModel(
+                # the `npool` is passed to pw2wannier90.x as `-nk`, only if set: older versions do not support pools
+                'pw2wannier90': PwCodeModel(
                     name='pw2wannier90.x',
                     description='pw2wannier90.x',
                     default_calc_job_plugin='quantumespresso.pw2wannier90',
@@ -1,23 +1,47 @@
 from aiidalab_qe.common.panel import ResultsModel
 from aiida.common.extendeddicts import AttributeDict
+from contextlib import contextmanager
+import logging
+import time
+import numpy as np
 import traitlets as tl
 from aiida import orm
+from ..tight_binding import WannierInterpolator, get_tight_binding_folder, load_tight_binding, read_tight_binding
+from ..utils import load_wout
+
+LOGGER = logging.getLogger(__name__)
 
 class Wannier90ResultsModel(ResultsModel):
     title = 'Wannier functions'
     identifier = 'wannier90'
     structure = tl.Instance(orm.StructureData, allow_none=True)
     bands_distance = tl.Float(allow_none=True)
-    wannier_centers_spreads = tl.Dict(allow_none=True)
-    omega_is = tl.List(allow_none=True)
-    omega_tots = tl.List(allow_none=True)
+    wannier_centers_spreads = tl.Dict(allow_none=True, default_value=None)
+    omega_is = tl.Instance(np.ndarray, allow_none=True)
+    omega_tots = tl.Instance(np.ndarray, allow_none=True)
     im_re_ratio = tl.List(allow_none=True)
     wannier90_outputs = tl.Dict(allow_none=True)
     retrieved = tl.Instance(orm.FolderData, allow_none=True)
+    isosurfaces = tl.Dict(allow_none=True)
+    # wall time (in seconds) spent in each stage of the rendering of the panel
+    stage_timings = tl.Dict(default_value={})
 
     _this_process_label = 'QeAppWannier90BandsWorkChain'
+    _interpolator = None
+
+    @contextmanager
+    def timed(self, stage):
+        """Record the wall time spent in the ``with`` block as the timing of ``stage``."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.stage_timings = {**self.stage_timings, stage: elapsed}
+            LOGGER.info('Wannier90 results panel: %s rendered in %.3f s', stage, elapsed)
 
     def fetch_result(self):
+        """Fetch the results needed by the summary, the other results are fetched on demand."""
         root = self.process
         self.structure = root.outputs.wannier90.pw_bands.primitive_structure
         bands_outputs = root.outputs.wannier90.wannier90_bands
@@ -27,34 +51,40 @@ class Wannier90ResultsModel(ResultsModel):
         else:
             data = bands_outputs.wannier90.output_parameters.get_dict()
         self.wannier90_outputs = {key: data[key] for key in ['number_wfs', 'Omega_D', 'Omega_I', 'Omega_OD']}
-        # Wannier centers/spreads
-        self.wannier_centers_spreads = self.get_wannier_centers_spreads(root)
-        self.omega_is, self.omega_tots = self.get_omega(root)
         if 'wannier90_plot' in bands_outputs:
             self.retrieved = bands_outputs.wannier90_plot.retrieved
         elif 'wannier90_optimal' in bands_outputs:
             self.retrieved = bands_outputs.wannier90_optimal.retrieved
         else:
             self.retrieved = bands_outputs.wannier90.retrieved
+        if 'generate_isosurface' in root.outputs.wannier90:
+            self.isosurfaces = dict(root.outputs.wannier90.generate_isosurface)
+        else:
+            self.isosurfaces = {}
+
+    def fetch_omega(self):
+        """Parse the convergence of the spreads from the Wannier90 output file, if not done yet."""
+        if self.omega_is is None:
+            self.omega_is, self.omega_tots = self.get_omega(self.process)
+
+    def fetch_wannier_centers_spreads(self):
+        """Build the table of the Wannier centers and spreads, if not done yet."""
+        if self.wannier_centers_spreads is None:
+            self.wannier_centers_spreads = self.get_wannier_centers_spreads(self.process)
 
     def get_omega(self, root):
-        omega_is = []
-        omega_tots = []
+        """Return the arrays of Omega_I (disentanglement) and Omega_tot (wannierisation) at each iteration."""
+        wout = self.get_wout(root)
+        return wout['omega_i'], wout['omega_tot']
+
+    def get_wout(self, root):
+        """Return the parsed ``aiida.wout`` of the Wannier90 calculation, see ``load_wout``."""
         bands_outputs = root.outputs.wannier90.wannier90_bands
         if 'wannier90_optimal' in bands_outputs:
             retrieved = bands_outputs.wannier90_optimal.retrieved
         else:
             retrieved = bands_outputs.wannier90.retrieved
-        with retrieved.open('aiida.wout') as f:
-            lines = f.readlines()
-            for line in lines:
-                if '  <-- DIS' in line:
-                    omega_i = float(line.split()[2])
-                    omega_is.append(omega_i)
-                if '<-- SPRD' in line:
-                    omega_tot = float(line.split('O_TOT=')[1].split('<-- SPRD')[0])
-                    omega_tots.append(omega_tot)
-        return omega_is, omega_tots
+        return load_wout(retrieved)
 
     def get_wannier_centers_spreads(self, node):
         bands_outputs = node.outputs.wannier90.wannier90_bands
@@ -100,6 +130,58 @@ class Wannier90ResultsModel(ResultsModel):
         wannier90_bands['band_structure'] = outputs.wannier90_bands.band_structure
         return pw_bands, wannier90_bands
 
+    def has_tight_binding(self) -> bool:
+        outputs = self._get_child_outputs()
+        return 'tight_binding' in outputs or get_tight_binding_folder(outputs.wannier90_bands) is not None
+
+    def get_interpolator(self) -> WannierInterpolator:
+        """Return the Wannier interpolator of the tight-binding model, built on first access.
+
+        The binary ``tight_binding`` output is used when available, otherwise the retrieved ``_tb.dat``
+        (and ``_wsvec.dat``) files are parsed.
+        """
+        if self._interpolator is None:
+            outputs = self._get_child_outputs()
+            if 'tight_binding' in outputs:
+                model = load_tight_binding(outputs.tight_binding)
+            else:
+                model = read_tight_binding(get_tight_binding_folder(outputs.wannier90_bands))
+            self._interpolator = WannierInterpolator(model)
+        return self._interpolator
+
+    def get_number_of_spin_components(self) -> int:
+        """Return the number of spin components of the SCF: 1 without spin, 2 if collinear and 4 if non-collinear."""
+        scf_parameters = self._get_child_outputs().pw_bands.scf_parameters.get_dict()
+        return int(scf_parameters.get('number_of_spin_components', 1))
+
+    def get_spglib_cell(self):
+        """Return the structure as a spglib cell in the lattice of the tight-binding model.
+
+        Returns None if the lattices differ, or for spin-polarized calculations: the magnetic moments can break
+        the symmetries of the atomic structure.
+        """
+        if self.get_number_of_spin_components() > 1:
+            return None
+        atoms = self.structure.get_ase()
+        lattice_vectors = self.get_interpolator().lattice_vectors
+        if not np.allclose(atoms.get_cell(), lattice_vectors, atol=1e-4):
+            return None
+        return lattice_vectors, atoms.get_scaled_positions(), atoms.get_atomic_numbers()
+
+    def get_fermi_energy(self) -> float:
+        """Return the Fermi energy (in eV) of the SCF calculation."""
+        return self._get_child_outputs().pw_bands.scf_parameters.get_dict().get('fermi_energy', 0.0)
+
+    def get_timings(self) -> dict:
+        """Return the timings of the calculations (see ``collect_timings``), or None for older workchains."""
+        outputs = self._get_child_outputs()
+        if 'timings' not in outputs:
+            return None
+        return outputs.timings.get_dict()
+
+    def has_skeaf(self) -> bool:
+        return 'skeaf' in self._get_child_outputs()
+
     def get_skeaf(self) -> dict:
         outputs = self._get_child_outputs()
         if 'skeaf' not in outputs:
@@ -4,14 +4,45 @@ from aiidalab_qe.common.bands_pdos import BandsPdosModel, BandsPdosWidget
 from aiidalab_qe.common.panel import ResultsPanel
 import ipywidgets as ipw
 from .model import Wannier90ResultsModel
-from .utils import create_download_link, plot_skeaf
+from .utils import (
+    BrowserDownload,
+    create_download_link,
+    debounce,
+    downsample_trace,
+    encode_mesh,
+    format_duration,
+    plot_skeaf,
+)
 from table_widget import TableWidget
 import plotly.graph_objs as go
 import plotly.express as px
 from weas_widget import WeasWidget
+from ase import Atoms
 import ast
+import asyncio
+import functools
+import time
 import numpy as np
-from ..utils import process_xsf_file
+from ..cache import LRUCache
+from ..fermi_surface import (
+    band_grid,
+    compute_dos,
+    compute_fermi_surface,
+    compute_fermi_surface_mesh,
+    parse_bxsf,
+    write_bxsf,
+)
+from ..tight_binding import INTERPOLATION_PATH_DENSITY
+from ..utils import (
+    PRECOMPUTED_TARGET_FACES,
+    compute_mesh_data,
+    count_mesh_faces,
+    estimate_step_size,
+    list_archive_files,
+    load_wannier_grid,
+    simplify_mesh_data,
+    write_archive,
+)
 
 from aiidalab_qe.common.infobox import InAppGuide
 
@@ -23,27 +54,60 @@ ISOSURFACE_COLOR = {
     'positive': [1.0, 1.0, 0.0, 0.8],
     'negative': [0.0, 1.0, 1.0, 0.8],
 }
+# Delay (in seconds) after the last isovalue change before the isosurfaces are recomputed
+ISOVALUE_DEBOUNCE_SECONDS = 0.25
+# Level of detail: meshes are kept below this number of triangles. Grids larger than
+# ISOSURFACE_PREVIEW_MIN_POINTS are first shown with a coarse preview (marching cubes with
+# ISOSURFACE_PREVIEW_STEP_SIZE), which is replaced by the refined mesh computed in the background.
+ISOSURFACE_TRIANGLE_BUDGET = 200_000
+ISOSURFACE_PREVIEW_STEP_SIZE = 3
+ISOSURFACE_PREVIEW_MIN_POINTS = 64**3
+# Mesh quality options: (label, target number of triangles, smoothing iterations)
+MESH_QUALITY = {
+    'full': ('Full (marching cubes output)', None, 0),
+    'high': ('High', PRECOMPUTED_TARGET_FACES, 0),
+    'medium': ('Medium', 30_000, 1),
+    'low': ('Low', 10_000, 3),
+}
+# The isosurfaces precomputed by the workchain match this quality
+PRECOMPUTED_MESH_QUALITY = 'high'
+# Vertex coordinates (in Å) sent to the viewer are rounded to this number of decimals
+MESH_VERTEX_DECIMALS = 3
+# Default number of k-points per direction of the mesh of the local Fermi surface, and energy step of its DOS
+FERMI_SURFACE_MESH = 60
+DOS_ENERGY_STEP = 0.01
+# Range (in eV) around the Fermi energy of the energy slider of the Fermi surface viewer, and colors of the bands
+FERMI_SURFACE_ENERGY_RANGE = 2.0
+FERMI_SURFACE_COLORS = [
+    [0.12, 0.47, 0.71, 0.8],
+    [1.0, 0.5, 0.05, 0.8],
+    [0.17, 0.63, 0.17, 0.8],
+    [0.84, 0.15, 0.16, 0.8],
+    [0.58, 0.4, 0.74, 0.8],
+    [0.55, 0.34, 0.29, 0.8],
+]
+# Convergence traces with more iterations are downsampled to this number of points
+CONVERGENCE_PLOT_MAX_POINTS = 2000
+# Memory budget for the parsed grids and isosurface meshes kept by the panel
+ISOSURFACE_CACHE_MAX_BYTES = 1024**3
 
 class Wannier90ResultsPanel(ResultsPanel[Wannier90ResultsModel]):
 
     def _render(self):
-        """Render the Wannier90 results panel."""
-        self._model.fetch_result()
-
-        # Retrieve band structures
-        pw_bands, wannier90_bands = self._model.get_bands_node()
-        wannier90_bands['trace_settings'] = {'dash': 'dash',
-                                             'shape': 'linear',
-                                             'color': 'red'}
-        model = BandsPdosModel(
-            bands=pw_bands,
-            external_bands={'Wannier-interpolated bands': wannier90_bands},
-            plot_settings={'bands_trace_settings': {'name': 'DFT bands'}},
-        )
+        """Render the Wannier90 results panel.
 
-        # Create and render the bands/PDOS widget
-        bands_widget = BandsPdosWidget(model=model)
-        bands_widget.render()
+        The band structure and the summary of the Wannierization are rendered first, the heavier sections
+        are built the first time they are expanded. The time spent in each stage is recorded by the model.
+        """
+        with self._model.timed('summary'):
+            self._model.fetch_result()
+        with self._model.timed('bands'):
+            bands_widget = self._render_bands()
+        self.download_xsf = ipw.VBox([ipw.HTML('No Wannier function selected for download.')])
+        self.isosurface_cache = LRUCache(max_bytes=ISOSURFACE_CACHE_MAX_BYTES)
+        self._displayed_wannier_function = None
+        self._fermi_surface = None
+        self.fermi_surface_source = None
 
         # Wannier90 outputs summary (merged with bands distance)
         wannier90_outputs = self._model.wannier90_outputs
@@ -109,26 +173,438 @@ class Wannier90ResultsPanel(ResultsPanel[Wannier90ResultsModel]):
             </div>
             """
 
-        # Omega convergence plots
-        omega_is = self._model.omega_is
+        # Arrange components in the panel, the heavy sections are built when first expanded
+        self.children = [
+            ipw.VBox([
+                ipw.HTML('<h2>DFT and Wannier-interpolated electronic band structure</h2>'),
+                InAppGuide(identifier='wannier90-band-results'),
+                bands_widget,
+            ] + ([
+                self._lazy_section(
+                    'Wannier-interpolated bands on a custom path',
+                    'custom_bands',
+                    self._render_custom_bands,
+                ),
+            ] if self._model.has_tight_binding() else [])),
+            ipw.VBox([
+                ipw.HTML('<h2>Wannierization details</h2>'),
+                InAppGuide(identifier='wannierization-details'),
+                wannier90_outputs_parameters,
+                bands_distance_warning_widget if show_bands_distance_warning else ipw.HTML(''),
+                self._lazy_section('Convergence of the spreads', 'omega', self._render_omega),
+                InAppGuide(identifier='wannier90-centers-spreads'),
+                self._lazy_section(
+                    'Wannier centers, spreads and real-space Wannier functions',
+                    'wannier_functions',
+                    self._render_wannier_functions,
+                ),
+            ]),
+        ]
+        fermi_surface_sections = []
+        if self._model.has_tight_binding():
+            fermi_surface_sections.append(self._lazy_section(
+                'Density of states and Fermi surface on a dense k-mesh',
+                'fermi_surface',
+                self._render_fermi_surface,
+            ))
+        if self._model.has_tight_binding() or self._fermi_surface_files():
+            fermi_surface_sections.append(self._lazy_section(
+                'Fermi surface viewer',
+                'fermi_surface_viewer',
+                self._render_fermi_surface_viewer,
+            ))
+        if self._model.has_skeaf():
+            fermi_surface_sections.append(
+                self._lazy_section('de Haas van Alphen (dHvA) frequencies', 'skeaf', self._render_skeaf)
+            )
+        if fermi_surface_sections:
+            self.children += (ipw.HTML('<h2>Fermi surface</h2>'), *fermi_surface_sections)
+        if self._model.get_timings() is not None:
+            self.children += (
+                self._lazy_section('Timings and computational cost', 'timings', self._render_timings),
+            )
+        self.children += (
+            InAppGuide(identifier='wannier90-download'),
+            self._lazy_section('Download files', 'downloads', self._render_downloads),
+        )
+
+    def _lazy_section(self, title, stage, render):
+        """Return a collapsed accordion whose content is built by ``render`` the first time it is expanded.
+
+        If ``render`` fails, the error is shown in the section and it is built again the next time it is expanded.
+        """
+        accordion = ipw.Accordion(children=[ipw.VBox()], selected_index=None)
+        accordion.set_title(0, title)
+
+        def on_expand(change):
+            if change['new'] is None:
+                return
+            accordion.unobserve(on_expand, 'selected_index')
+            accordion.children[0].children = [ipw.HTML(f'Loading {title.lower()}...')]
+            try:
+                with self._model.timed(stage):
+                    accordion.children[0].children = render()
+            except Exception as exception:
+                accordion.children[0].children = [ipw.HTML(
+                    f'<span style="color: red;">Failed to load the {title.lower()}: {exception}</span> '
+                    'Collapse and expand the section to try again.'
+                )]
+                accordion.observe(on_expand, 'selected_index')
+
+        accordion.observe(on_expand, 'selected_index')
+        return accordion
+
+    def _render_bands(self):
+        """Return the widget comparing the DFT and Wannier-interpolated band structures."""
+        pw_bands, wannier90_bands = self._model.get_bands_node()
+        wannier90_bands['trace_settings'] = {'dash': 'dash',
+                                             'shape': 'linear',
+                                             'color': 'red'}
+        model = BandsPdosModel(
+            bands=pw_bands,
+            external_bands={'Wannier-interpolated bands': wannier90_bands},
+            plot_settings={'bands_trace_settings': {'name': 'DFT bands'}},
+        )
+
+        # Create and render the bands/PDOS widget
+        bands_widget = BandsPdosWidget(model=model)
+        bands_widget.render()
+        return bands_widget
+
+    def _render_custom_bands(self):
+        """Return the widgets to interpolate the bands locally, from the tight-binding model, on any path."""
+        interpolator = self._model.get_interpolator()
+        self.custom_path = ipw.Text(
+            value=interpolator.bandpath(None).path or '',
+            description='Path:',
+            placeholder='e.g. GXWKGLUWLK,UX',
+            style={'description_width': 'initial'},
+        )
+        self.custom_path_density = ipw.BoundedFloatText(
+            value=INTERPOLATION_PATH_DENSITY,
+            min=1,
+            max=10_000,
+            description='k-points per Å⁻¹:',
+            style={'description_width': 'initial'},
+        )
+        special_points = ', '.join(sorted(interpolator.bandpath(None).special_points))
+        compute_button = ipw.Button(description='Interpolate', button_style='primary', icon='play')
+        self.custom_bands_status = ipw.HTML()
+        self.custom_bands_plot = go.FigureWidget(layout={
+            'xaxis': {'title': 'k-points'},
+            'yaxis': {'title': 'E - E<sub>F</sub> (eV)'},
+            'showlegend': False,
+            'height': 500,
+        })
+        compute_button.on_click(self._on_custom_bands)
+        return [
+            ipw.HTML(
+                '<div style="font-size: 13px; color: #555; margin: 6px 0;">'
+                'The bands are interpolated locally from the Wannier tight-binding model, along the path given '
+                'by the labels of the special points (a comma separates disconnected segments). '
+                f'Special points of this lattice: {special_points}.'
+                '</div>'
+            ),
+            ipw.HBox([self.custom_path, self.custom_path_density, compute_button]),
+            self.custom_bands_status,
+            self.custom_bands_plot,
+        ]
+
+    def _on_custom_bands(self, _=None):
+        """Interpolate the bands along the custom path and update the plot."""
+        interpolator = self._model.get_interpolator()
+        try:
+            path = interpolator.bandpath(self.custom_path.value.strip(), density=self.custom_path_density.value)
+        except Exception as exception:
+            self.custom_bands_status.value = f'<span style="color: red;">Invalid path: {exception}</span>'
+            return
+        start = time.perf_counter()
+        energies = interpolator.eigenvalues(path.kpts) - self._model.get_fermi_energy()
+        elapsed = time.perf_counter() - start
+        x, positions, names = path.get_linear_kpoint_axis()
+        # the two ends of a break in the path share the same position
+        label_positions, labels = [], []
+        for position, name in zip(positions, names):
+            name = name.replace('G', 'Γ')
+            if label_positions and np.isclose(position, label_positions[-1]):
+                labels[-1] = f'{labels[-1]}|{name}'
+            else:
+                label_positions.append(position)
+                labels.append(name)
+        # one trace for all the bands, separated by gaps, is much faster to render than one trace per band
+        num_k = len(x)
+        xs = np.concatenate([np.append(x, np.nan)] * interpolator.num_wann)
+        ys = np.concatenate([np.append(band, np.nan) for band in energies.T])
+        with self.custom_bands_plot.batch_update():
+            self.custom_bands_plot.data = []
+            self.custom_bands_plot.add_trace(go.Scattergl(x=xs, y=ys, mode='lines', line={'color': 'red'}))
+            self.custom_bands_plot.layout.xaxis.tickvals = label_positions
+            self.custom_bands_plot.layout.xaxis.ticktext = labels
+            self.custom_bands_plot.layout.xaxis.range = [x[0], x[-1]]
+            self.custom_bands_plot.layout.shapes = [
+                {'type': 'line', 'x0': position, 'x1': position, 'y0': 0, 'y1': 1, 'yref': 'paper',
+                 'line': {'color': 'gray', 'width': 1}}
+                for position in label_positions
+            ]
+        self.custom_bands_status.value = (
+            f'Interpolated {interpolator.num_wann} bands at {num_k} k-points in {elapsed:.2f} s.'
+        )
+
+    def _render_fermi_surface(self):
+        """Return the widgets to compute the density of states and the Fermi surface locally on a dense k-mesh."""
+        self.fermi_surface_mesh = ipw.BoundedIntText(
+            value=FERMI_SURFACE_MESH,
+            min=4,
+            max=400,
+            description='k-mesh (points per direction):',
+            style={'description_width': 'initial'},
+        )
+        compute_button = ipw.Button(description='Compute', button_style='primary', icon='play')
+        compute_button.on_click(self._on_compute_fermi_surface)
+        self.fermi_surface_status = ipw.HTML()
+        self.dos_plot = go.FigureWidget(layout={
+            'xaxis': {'title': 'E - E<sub>F</sub> (eV)'},
+            'yaxis': {'title': 'DOS (states/eV/cell)'},
+            'showlegend': False,
+            'height': 400,
+        })
+        self.bxsf_output = ipw.Output(layout=ipw.Layout(display='none'))
+        self.download_bxsf = ipw.Button(
+            description='Download Fermi surface (.bxsf)',
+            icon='download',
+            disabled=True,
+            layout=ipw.Layout(width='auto'),
+        )
+        self.download_bxsf.on_click(self._on_download_bxsf)
+        return [
+            ipw.HTML(
+                '<div style="font-size: 13px; color: #555; margin: 6px 0;">'
+                'The bands are interpolated locally from the Wannier tight-binding model on a Γ-centered mesh, '
+                'only the k-points irreducible by symmetry are diagonalized. '
+                'The Fermi surface of the bands crossing the Fermi energy can be downloaded in the BXSF format.'
+                '</div>'
+            ),
+            ipw.HBox([self.fermi_surface_mesh, compute_button]),
+            self.fermi_surface_status,
+            self.dos_plot,
+            self.download_bxsf,
+            self.bxsf_output,
+        ]
+
+    def _on_compute_fermi_surface(self, _=None):
+        """Compute the bands on the mesh, then plot the density of states."""
+        interpolator = self._model.get_interpolator()
+        mesh = (self.fermi_surface_mesh.value,) * 3
+        fermi_energy = self._model.get_fermi_energy()
+        self.fermi_surface_status.value = f'Computing the bands on the {mesh[0]}³ mesh...'
+        start = time.perf_counter()
+        self._fermi_surface = compute_fermi_surface(
+            interpolator,
+            mesh,
+            fermi_energy,
+            structure=self._model.get_spglib_cell(),
+            # a non-collinear magnetization breaks time reversal
+            time_reversal=self._model.get_number_of_spin_components() != 4,
+        )
+        elapsed = time.perf_counter() - start
+        energies = self._fermi_surface['energies']
+        energy_grid = np.arange(energies.min() - 1, energies.max() + 1, DOS_ENERGY_STEP)
+        dos = compute_dos(energies, self._fermi_surface['weights'], energy_grid)
+        with self.dos_plot.batch_update():
+            self.dos_plot.data = []
+            self.dos_plot.add_trace(go.Scatter(x=energy_grid - fermi_energy, y=dos, mode='lines'))
+        fermi_bands = self._fermi_surface['fermi_bands']
+        self.download_bxsf.disabled = not len(fermi_bands)
+        self.fermi_surface_status.value = (
+            f'{len(self._fermi_surface["weights"])} irreducible k-points of the {mesh[0]}³ mesh computed '
+            f'in {elapsed:.1f} s (symmetry: {self._fermi_surface["symmetry"]}). Bands crossing the Fermi energy: '
+            f'{", ".join(str(band + 1) for band in fermi_bands) or "none"}.'
+        )
+        if self.fermi_surface_source is not None:
+            # make the new mesh available in the Fermi surface viewer
+            self.fermi_surface_source.options = self._fermi_surface_sources()
+
+    def _on_download_bxsf(self, _=None):
+        if self._fermi_surface is None:
+            return
+        mesh = self._fermi_surface['mesh'][0]
+        with BrowserDownload(f'wannier_fermi_surface_{mesh}.bxsf', self.bxsf_output) as target:
+            write_bxsf(target, self._fermi_surface, self._model.get_interpolator().lattice_vectors)
+
+    def _fermi_surface_files(self):
+        if self._model.retrieved is None:
+            return []
+        return [name for name in self._model.retrieved.list_object_names() if name.endswith('.bxsf')]
+
+    def _fermi_surface_sources(self):
+        """Return the options of the band grids that can be shown in the Fermi surface viewer."""
+        options = [(filename, ('bxsf', filename)) for filename in self._fermi_surface_files()]
+        if self._fermi_surface is not None:
+            mesh = self._fermi_surface['mesh']
+            options.append((f'Local Wannier interpolation ({mesh[0]}³ mesh)', ('local', mesh)))
+        return options
+
+    def _get_band_grids(self, source):
+        """Return the band grids of ``source`` (see ``parse_bxsf``), cached with the isosurfaces."""
+        grids = self.isosurface_cache.get(('bands', source))
+        if grids is not None:
+            return grids
+        kind, name = source
+        if kind == 'bxsf':
+            with self._model.retrieved.open(name, 'r') as handle:
+                grids = parse_bxsf(handle)
+        else:
+            num_bands = self._fermi_surface['energies'].shape[1]
+            grids = {
+                'fermi_energy': self._fermi_surface['fermi_energy'],
+                'reciprocal_vectors': 2 * np.pi * np.linalg.inv(self._model.get_interpolator().lattice_vectors).T,
+                'bands': np.arange(num_bands),
+                'energies': np.stack([band_grid(self._fermi_surface, band) for band in range(num_bands)]),
+            }
+        self.isosurface_cache.put(('bands', source), grids)
+        return grids
+
+    def _render_fermi_surface_viewer(self):
+        """Return the viewer of the Fermi surface sheets of the bands of a BXSF file or of the local mesh."""
+        self.fermi_surface_viewer = WeasWidget()
+        self.fermi_surface_source = ipw.Dropdown(
+            options=self._fermi_surface_sources(),
+            description='Bands from:',
+            style={'description_width': 'initial'},
+            layout=ipw.Layout(width='420px'),
+        )
+        self.fermi_surface_bands = ipw.SelectMultiple(
+            description='Bands:',
+            rows=6,
+            style={'description_width': 'initial'},
+            layout=ipw.Layout(width='320px'),
+        )
+        self.fermi_surface_energy = ipw.FloatSlider(
+            description='Energy (eV):',
+            step=0.01,
+            readout_format='.3f',
+            continuous_update=True,
+            style={'description_width': 'initial'},
+            layout=ipw.Layout(width='420px'),
+        )
+        self.clip_to_brillouin_zone = ipw.Checkbox(
+            value=True,
+            description='Clip to the first Brillouin zone',
+            style={'description_width': 'initial'},
+        )
+        self.fermi_surface_viewer_status = ipw.HTML()
+        self.fermi_surface_source.observe(self._on_fermi_surface_source_change, names='value')
+        self.fermi_surface_bands.observe(self._update_fermi_surface, names='value')
+        self.fermi_surface_energy.observe(self._on_fermi_surface_energy_change, names='value')
+        self.clip_to_brillouin_zone.observe(self._update_fermi_surface, names='value')
+        self._on_fermi_surface_source_change()
+        return [
+            ipw.HBox([
+                ipw.VBox([
+                    self.fermi_surface_source,
+                    self.fermi_surface_energy,
+                    self.fermi_surface_bands,
+                    self.clip_to_brillouin_zone,
+                    self.fermi_surface_viewer_status,
+                ]),
+                self.fermi_surface_viewer,
+            ]),
+        ]
+
+    def _on_fermi_surface_source_change(self, _=None):
+        """Show the reciprocal cell of the new source and select the bands crossing its Fermi energy."""
+        if self.fermi_surface_source.value is None:
+            self.fermi_surface_viewer_status.value = 'Compute the bands on a k-mesh above to show their Fermi surface.'
+            return
+        grids = self._get_band_grids(self.fermi_surface_source.value)
+        energies = grids['energies']
+        fermi_energy = grids['fermi_energy'] if grids['fermi_energy'] is not None else float(np.median(energies))
+        band_min = energies.min(axis=(1, 2, 3))
+        band_max = energies.max(axis=(1, 2, 3))
+        self.fermi_surface_viewer.from_ase(Atoms(cell=grids['reciprocal_vectors'], pbc=True))
+        # update the controls without extracting the isosurfaces for each intermediate state
+        self.fermi_surface_bands.unobserve(self._update_fermi_surface, names='value')
+        self.fermi_surface_energy.unobserve(self._on_fermi_surface_energy_change, names='value')
+        self.fermi_surface_bands.options = [(f'Band {band + 1}', index) for index, band in enumerate(grids['bands'])]
+        self.fermi_surface_bands.value = tuple(np.flatnonzero((band_min <= fermi_energy) & (band_max >= fermi_energy)))
+        self.fermi_surface_energy.min = -1e6  # avoid clipping the value while changing the range
+        self.fermi_surface_energy.max = float(min(band_max.max(), fermi_energy + FERMI_SURFACE_ENERGY_RANGE))
+        self.fermi_surface_energy.min = float(max(band_min.min(), fermi_energy - FERMI_SURFACE_ENERGY_RANGE))
+        self.fermi_surface_energy.value = fermi_energy
+        self.fermi_surface_bands.observe(self._update_fermi_surface, names='value')
+        self.fermi_surface_energy.observe(self._on_fermi_surface_energy_change, names='value')
+        self._update_fermi_surface()
+
+    @debounce(ISOVALUE_DEBOUNCE_SECONDS)
+    def _on_fermi_surface_energy_change(self, _):
+        """Handle energy change event, debounced so that dragging the slider extracts the isosurfaces once."""
+        self._update_fermi_surface()
+
+    def _update_fermi_surface(self, _=None):
+        """Show the Fermi surface sheets of the selected bands at the selected energy.
+
+        The meshes are cached per band, energy and clipping, so only the bands crossing a new energy are extracted.
+        """
+        source = self.fermi_surface_source.value
+        if source is None:
+            return
+        grids = self._get_band_grids(source)
+        energy = round(self.fermi_surface_energy.value, 4)
+        clip = self.clip_to_brillouin_zone.value
+        data = []
+        num_faces = 0
+        start = time.perf_counter()
+        for index in self.fermi_surface_bands.value:
+            cache_key = ('fermi_surface', source, index, energy, clip)
+            mesh = self.isosurface_cache.get(cache_key)
+            if mesh is None:
+                mesh = compute_fermi_surface_mesh(
+                    grids['energies'][index], energy, grids['reciprocal_vectors'], clip_to_brillouin_zone=clip
+                )
+                self.isosurface_cache.put(cache_key, mesh)
+            vertices, faces = mesh
+            if not faces.size:
+                continue
+            num_faces += faces.size // 3
+            vertices, faces = encode_mesh(vertices, faces, decimals=MESH_VERTEX_DECIMALS)
+            data.append({
+                'name': f'band_{grids["bands"][index] + 1}',
+                'color': FERMI_SURFACE_COLORS[index % len(FERMI_SURFACE_COLORS)],
+                'material': 'Standard',
+                'position': [0.0, 0.0, 0.0],
+                'vertices': vertices,
+                'faces': faces,
+            })
+        self.fermi_surface_viewer.any_mesh.settings = data
+        self.fermi_surface_viewer_status.value = (
+            f'{len(data)} of the selected bands cross {energy:.3f} eV ({num_faces} triangles, '
+            f'{time.perf_counter() - start:.2f} s).'
+        )
+
+    def _render_omega(self):
+        """Return the convergence plots of the spreads."""
+        self._model.fetch_omega()
+        x, y = downsample_trace(self._model.omega_is, CONVERGENCE_PLOT_MAX_POINTS)
         fig = px.line(
-            x=range(len(omega_is)), y=omega_is,
+            x=x, y=y,
             title='Convergence of Ωᵢ'
         )
         fig.update_yaxes(title='Ωᵢ')
         fig.update_xaxes(title='Number of iterations')
         self.plot_omega_is = go.FigureWidget(fig)
 
-        omega_tots = self._model.omega_tots
+        x, y = downsample_trace(self._model.omega_tots, CONVERGENCE_PLOT_MAX_POINTS)
         fig = px.line(
-            x=range(len(omega_tots)), y=omega_tots,
+            x=x, y=y,
             title='Convergence of Ωₜₒₜ'
         )
         fig.update_yaxes(title='Ωₜₒₜ')
         fig.update_xaxes(title='Number of iterations')
         self.plot_omega_tots = go.FigureWidget(fig)
+        return [ipw.HBox([self.plot_omega_is, self.plot_omega_tots])]
 
-        # Structure
+    def _render_wannier_functions(self):
+        """Return the table of Wannier centers and spreads and the real-space Wannier function viewer."""
         self.structure_viewer = WeasWidget()
         atoms = self._model.structure.get_ase()
         self.structure_viewer.from_ase(atoms)
@@ -142,10 +618,18 @@ class Wannier90ResultsPanel(ResultsPanel[Wannier90ResultsModel]):
             step=0.01,
             description='Isovalue:',
             style={'description_width': 'initial'},
-            continuous_update=False,
+            continuous_update=True,
             layout=ipw.Layout(width='320px'),
         )
         self.isovalue.observe(self._on_isovalue_change, names='value')
+        self.mesh_quality = ipw.Dropdown(
+            options=[(label, quality) for quality, (label, _, _) in MESH_QUALITY.items()],
+            value='high',
+            description='Mesh quality:',
+            style={'description_width': 'initial'},
+            layout=ipw.Layout(width='320px'),
+        )
+        self.mesh_quality.observe(self._on_mesh_quality_change, names='value')
         self.supercell_label = ipw.HTML('Supercell:')
         self.supercell_a = ipw.BoundedIntText(
             value=1,
@@ -173,21 +657,10 @@ class Wannier90ResultsPanel(ResultsPanel[Wannier90ResultsModel]):
         self.supercell_a.observe(self._on_supercell_size_change, names='value')
         self.supercell_b.observe(self._on_supercell_size_change, names='value')
         self.supercell_c.observe(self._on_supercell_size_change, names='value')
-        self.root_process_node = self._model.process
-        try:
-            self.wannier90_plot_retrieved = self.root_process_node.outputs.wannier90.wannier90_bands.wannier90_plot.retrieved
-        except AttributeError:
-            if 'wannier90_optimal' in self.root_process_node.outputs.wannier90.wannier90_bands:
-                self.wannier90_plot_retrieved = self.root_process_node.outputs.wannier90.wannier90_bands.wannier90_optimal.retrieved
-            else:
-                self.wannier90_plot_retrieved = self.root_process_node.outputs.wannier90.wannier90_bands.wannier90.retrieved
-        filename = f'aiida_{int(1):05d}.xsf'
-        self.download_xsf = ipw.HTML('No Wannier function selected for download.')
-        # Isosurface
-        self.isosurface_data = {}
+        self.wannier90_plot_retrieved = self._model.retrieved
         structure_viewer_section = ipw.VBox([
             ipw.HTML('<h3>Wannier functions in real space</h3>'),
-            self.isovalue,
+            ipw.HBox([self.isovalue, self.mesh_quality]),
             ipw.HBox([self.supercell_label, self.supercell_a, self.supercell_b, self.supercell_c]),
             ipw.HTML(
                 '<div style="font-size: 12px; color: #0b4f6c; background: #e8f4fb; '
@@ -201,6 +674,7 @@ class Wannier90ResultsPanel(ResultsPanel[Wannier90ResultsModel]):
         )
 
         # Wannier centers and spreads table
+        self._model.fetch_wannier_centers_spreads()
         self.table = TableWidget(style={'margin-top': '10px'})
         self.table.from_data(
             self._model.wannier_centers_spreads['data'],
@@ -215,23 +689,66 @@ class Wannier90ResultsPanel(ResultsPanel[Wannier90ResultsModel]):
             self.table_description,
             self.table
         ])
+        return [table_section, structure_viewer_section]
 
+    def _render_skeaf(self):
+        """Return the plot of the de Haas van Alphen frequencies."""
+        skeaf_data = self._model.get_skeaf()  # dictionary {band: frequency_array}
+        self.plot_skeaf = plot_skeaf(skeaf_data)
         self.skeaf_container = ipw.VBox([
-            ipw.HTML('<h2>Fermi surface</h2>'),
-            ipw.HTML('<h3>de Haas van Alphen (dHva) frequencies</h3>'),
             InAppGuide(identifier='dHvA-results'),
+            self.plot_skeaf,
         ])
+        return [self.skeaf_container]
 
-        # de Haas van Alphen (dHvA) frequencies
-        skeaf_data = self._model.get_skeaf()  # dictionary {band: frequency_array}
-        if skeaf_data is not None:
-            self.plot_skeaf = plot_skeaf(skeaf_data)
-            self.skeaf_container.children += (self.plot_skeaf,)
-        else:
-            # hide the skeaf container if no data is available
-            self.skeaf_container.layout.display = 'none'
+    def _render_timings(self):
+        """Return the tables of the wall time and core-hours of the calculations, by step and by calculation."""
+        timings = self._model.get_timings()
+        cell = 'style="padding:2px 10px;"'
+        totals_rows = ''.join(
+            f'<tr><td {cell}>{name}</td><td {cell}>{total["count"]}</td>'
+            f'<td {cell}>{format_duration(total["wall_time"])}</td><td {cell}>{total["core_hours"]:.2f}</td></tr>'
+            for name, total in timings['totals'].items()
+        )
+        steps_rows = ''.join(
+            f'<tr style="{"background:#fff3cd; font-weight:600;" if step["critical"] else ""}">'
+            f'<td {cell}>{step["step"]}</td><td {cell}>{step["workflow"]}</td><td {cell}>{step["pk"]}</td>'
+            f'<td {cell}>{step["num_machines"]} × {step["num_mpiprocs"] // max(step["num_machines"], 1)}</td>'
+            f'<td {cell}>{format_duration(step["queue_time"])}</td><td {cell}>{format_duration(step["wall_time"])}</td>'
+            f'<td {cell}>{step["core_hours"]:.2f}</td></tr>'
+            for step in timings['steps']
+        )
+        num_cached = timings.get('num_cached', 0)
+        cached = f'{num_cached} calculations reused from the cache are not counted.' if num_cached else ''
+        summary = ipw.HTML(
+            f"""
+            <p>
+                Elapsed time: <b>{format_duration(timings['elapsed'])}</b>,
+                of which {format_duration(timings['critical_path_wall_time'])} running on the critical path.
+                Total cost: <b>{timings['core_hours']:.2f} core-hours</b>.
+                {cached}
+            </p>
+            <table style="border-collapse:collapse; text-align:left; font-size:14px; margin-bottom:15px;">
+                <tr><th {cell}>Step</th><th {cell}>Calculations</th><th {cell}>Wall time</th>
+                    <th {cell}>Core-hours</th></tr>
+                {totals_rows}
+            </table>
+            """
+        )
+        steps_table = ipw.HTML(
+            f"""
+            <p>Calculations on the critical path, which determined the elapsed time, are highlighted.</p>
+            <table style="border-collapse:collapse; text-align:left; font-size:14px;">
+                <tr><th {cell}>Step</th><th {cell}>Workflow</th><th {cell}>PK</th><th {cell}>Nodes × MPI</th>
+                    <th {cell}>Queue</th><th {cell}>Wall time</th><th {cell}>Core-hours</th></tr>
+                {steps_rows}
+            </table>
+            """
+        )
+        return [summary, steps_table]
 
-        # Downloads section
+    def _render_downloads(self):
+        """Return the download links of the retrieved files."""
         tb_links = []
         wsvec_links = []
         fermi_links = []
@@ -256,14 +773,12 @@ class Wannier90ResultsPanel(ResultsPanel[Wannier90ResultsModel]):
                 ))
 
         download_section_items = [
-            ipw.HTML('<h2>Download files</h2>'),
             ipw.HTML('<h3>Real-space Wannier functions</h3>'),
             self.download_xsf,
             ipw.HTML(
                 '<div style="font-size: 13px; color: #555; margin: 6px 0 14px;">'
-                'Select a Wannier function in the table above to enable its download.'
-                '<br>If you want to download all WFs together, go to the main results section, '
-                'open the "Summary" tab, and use "Download the data".'
+                'Select a Wannier function in the table above to enable its download, '
+                'or download all the files below as a single archive.'
                 '</div>'
             ),
         ]
@@ -286,29 +801,71 @@ class Wannier90ResultsPanel(ResultsPanel[Wannier90ResultsModel]):
                 ipw.HTML('<h3>Fermi surface</h3>'),
                 ipw.VBox(fermi_links),
             ]
+        download_section_items += self._render_archive()
+        return download_section_items
 
-        # Arrange components in the panel
-        self.children = [
-            ipw.VBox([
-                ipw.HTML('<h2>DFT and Wannier-interpolated electronic band structure</h2>'),
-                InAppGuide(identifier='wannier90-band-results'),
-                bands_widget,
-            ]),
-            ipw.VBox([
-                ipw.HTML('<h2>Wannierization details</h2>'),
-                InAppGuide(identifier='wannierization-details'),
-                wannier90_outputs_parameters,
-                bands_distance_warning_widget if show_bands_distance_warning else ipw.HTML(''),
-                ipw.HBox([self.plot_omega_is, self.plot_omega_tots]),
-                InAppGuide(identifier='wannier90-centers-spreads'),
-                table_section,
-                structure_viewer_section,
-            ]),
-            self.skeaf_container,
-            InAppGuide(identifier='wannier90-download'),
-            ipw.VBox(download_section_items)
-        ]
+    def _render_archive(self):
+        """Return the widgets to download all the Wannier90 files as a zip archive."""
+        filenames = list_archive_files(self._model.retrieved)
+        if not filenames:
+            return []
+        convert_xsf = ipw.Checkbox(
+            value=False,
+            description='Convert the real-space WFs to compressed NumPy files (.npz)',
+            style={'description_width': 'initial'},
+            layout=ipw.Layout(width='auto'),
+        )
+        single_precision = ipw.Checkbox(
+            value=False,
+            description='Single precision (halves the size of the converted WFs)',
+            style={'description_width': 'initial'},
+            layout=ipw.Layout(width='auto'),
+        )
+        ipw.dlink((convert_xsf, 'value'), (single_precision, 'disabled'), transform=lambda value: not value)
+        button = ipw.Button(
+            description=f'Download all ({len(filenames)} files, zip)',
+            icon='download',
+            button_style='primary',
+            layout=ipw.Layout(width='auto'),
+        )
+        progress = ipw.IntProgress(value=0, min=0, max=len(filenames), layout=ipw.Layout(display='none'))
+        status = ipw.HTML()
+        output = ipw.Output(layout=ipw.Layout(display='none'))
+
+        def on_progress(index, total, filename):
+            progress.value = index
+            status.value = f'{index}/{total}: {filename}'
 
+        def on_click(_):
+            button.disabled = True
+            progress.value = 0
+            progress.layout.display = 'flex'
+            try:
+                with BrowserDownload(f'{self._model.retrieved.uuid}_wannier90.zip', output) as target:
+                    write_archive(
+                        self._model.retrieved,
+                        target,
+                        filenames,
+                        convert_xsf=convert_xsf.value,
+                        dtype=np.float32 if single_precision.value else np.float64,
+                        progress=on_progress,
+                    )
+                status.value = 'Archive sent to the browser.'
+            except Exception as exception:
+                status.value = f'<span style="color: red;">Failed to build the archive: {exception}</span>'
+            finally:
+                progress.layout.display = 'none'
+                button.disabled = False
+
+        button.on_click(on_click)
+        return [
+            ipw.HTML('<h3>All files</h3>'),
+            convert_xsf,
+            single_precision,
+            ipw.HBox([button, progress]),
+            status,
+            output,
+        ]
 
     def on_single_row_select(self, change):
         id = change.get('new')
@@ -316,10 +873,10 @@ class Wannier90ResultsPanel(ResultsPanel[Wannier90ResultsModel]):
             return
 
         self._plot_wannier_function()
-        self.download_xsf.value = create_download_link(
+        self.download_xsf.children = [create_download_link(
             self.wannier90_plot_retrieved, f'aiida_{int(id):05d}.xsf',
             description=f'Download real-space WF #{id} (XSF format)',
-        ).value
+        )]
 
     def _plot_wannier_function(self, isovalue=None):
         """Plot the Wannier function corresponding to the selected row in the table."""
@@ -349,45 +906,133 @@ class Wannier90ResultsPanel(ResultsPanel[Wannier90ResultsModel]):
         if f'{key}.xsf' not in self.wannier90_plot_retrieved.list_object_names():
             return
 
-        if key not in self.isosurface_data:
-            data = process_xsf_file(folder=self.wannier90_plot_retrieved, prefix=key)
-            if data is None:
-                return
-            self.isosurface_data[key] = data
-            self.isovalue.value = self.isosurface_data[key].get('isovalue', 0.1)
+        precomputed = self._model.isosurfaces.get(key) if self._model.isosurfaces else None
+        if not isovalue:
+            if precomputed is not None:
+                isovalue = precomputed.base.attributes.get('isovalue')
+            else:
+                grid = self._get_wannier_grid(key)
+                if grid is None:
+                    return
+                isovalue = grid['isovalue']
+            # show the default isovalue on the slider without triggering a second plot
+            self.isovalue.unobserve(self._on_isovalue_change, names='value')
+            self.isovalue.value = isovalue
+            self.isovalue.observe(self._on_isovalue_change, names='value')
 
-        if isovalue and isovalue != self.isosurface_data[key].get('isovalue', None):
-            data = process_xsf_file(folder=self.wannier90_plot_retrieved, prefix=key, isovalue=isovalue)
-            if data is None:
+        quality = self.mesh_quality.value
+        self._displayed_wannier_function = (key, isovalue, quality)
+        mesh = self.isosurface_cache.get(('mesh', key, isovalue, quality))
+        if (
+            mesh is None
+            and precomputed is not None
+            and quality == PRECOMPUTED_MESH_QUALITY
+            and isovalue == precomputed.base.attributes.get('isovalue')
+        ):
+            # isosurfaces precomputed by the workchain, no need to read the XSF file
+            mesh = {f'{key}_{name}': precomputed.get_array(name) for name in precomputed.get_arraynames()}
+            self.isosurface_cache.put(('mesh', key, isovalue, quality), mesh)
+        if mesh is None:
+            grid = self._get_wannier_grid(key)
+            if grid is None:
+                return
+            mesh = self._compute_mesh(key, grid, isovalue, quality)
+            if mesh is None:
                 return
-            self.isosurface_data[key] = data
-
-        if key in self.isosurface_data:
-            mesh = self.isosurface_data[key].get('mesh_data', {})
-            data = []
-            for item in ['positive', 'negative']:
-                try:
-                    vertices = mesh[f'{key}_{item}_vertices'].tolist()
-                    faces = mesh[f'{key}_{item}_faces'].tolist()
-                except KeyError:
-                    continue
-                data.append({
-                    'name': item,
-                    'color': ISOSURFACE_COLOR[item],
-                    'material': 'Standard',
-                    'position': [0, 0.0, 0.0],
-                    'vertices': vertices,
-                    'faces': faces,
-                })
+        self._show_mesh(key, mesh)
+
+    def _show_mesh(self, key, mesh):
+        """Send the positive and negative isosurfaces of the Wannier function ``key`` to the viewer."""
+        data = []
+        for item in ['positive', 'negative']:
+            try:
+                vertices, faces = encode_mesh(
+                    mesh[f'{key}_{item}_vertices'],
+                    mesh[f'{key}_{item}_faces'],
+                    decimals=MESH_VERTEX_DECIMALS,
+                )
+            except KeyError:
+                continue
+            data.append({
+                'name': item,
+                'color': ISOSURFACE_COLOR[item],
+                'material': 'Standard',
+                'position': [0, 0.0, 0.0],
+                'vertices': vertices,
+                'faces': faces,
+            })
 
         self.structure_viewer.any_mesh.settings = data
 
+    def _compute_mesh(self, key, grid, isovalue, quality):
+        """Compute the isosurfaces of a Wannier function within the triangle budget and at the given quality.
+
+        For large grids, a coarse preview is returned and the refined mesh is computed in a background
+        thread, replacing the preview when ready if the same Wannier function and settings are still shown.
+        """
+        _, target_faces, smoothing_iterations = MESH_QUALITY[quality]
+        compute = functools.partial(
+            compute_mesh_data,
+            key,
+            grid,
+            isovalue,
+            target_faces=target_faces,
+            smoothing_iterations=smoothing_iterations,
+        )
+        cache_key = ('mesh', key, isovalue, quality)
+        preview_step = ISOSURFACE_PREVIEW_STEP_SIZE if grid['density_array'].size > ISOSURFACE_PREVIEW_MIN_POINTS else 1
+        try:
+            mesh = compute_mesh_data(key, grid, isovalue, step_size=preview_step)
+            step_size = estimate_step_size(count_mesh_faces(mesh), preview_step, ISOSURFACE_TRIANGLE_BUDGET)
+            if step_size == preview_step:
+                mesh = simplify_mesh_data(key, mesh, target_faces, smoothing_iterations)
+                self.isosurface_cache.put(cache_key, mesh)
+                return mesh
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                loop = None
+            if loop is None or step_size > preview_step:
+                mesh = compute(step_size=step_size)
+                self.isosurface_cache.put(cache_key, mesh)
+                return mesh
+            mesh = simplify_mesh_data(key, mesh, target_faces, smoothing_iterations)
+        except Exception as e:
+            print(f'Error computing the isosurface of {key}.xsf: {e}')
+            return None
+        future = loop.run_in_executor(None, functools.partial(compute, step_size=step_size))
+        future.add_done_callback(functools.partial(self._on_refined_mesh, key, isovalue, quality))
+        return mesh
+
+    def _on_refined_mesh(self, key, isovalue, quality, future):
+        """Cache the refined mesh and replace the coarse preview if it is still displayed."""
+        if future.cancelled() or future.exception() is not None:
+            return
+        mesh = future.result()
+        self.isosurface_cache.put(('mesh', key, isovalue, quality), mesh)
+        if self._displayed_wannier_function == (key, isovalue, quality):
+            self._show_mesh(key, mesh)
+
+    def _get_wannier_grid(self, key):
+        """Return the parsed grid of the Wannier function ``key``, reading the XSF file only on a cache miss."""
+        grid = self.isosurface_cache.get(('grid', key))
+        if grid is None:
+            grid = load_wannier_grid(self.wannier90_plot_retrieved, key)
+            if grid is not None:
+                self.isosurface_cache.put(('grid', key), grid)
+        return grid
+
+    @debounce(ISOVALUE_DEBOUNCE_SECONDS)
     def _on_isovalue_change(self, change):
-        """Handle isovalue change event."""
+        """Handle isovalue change event, debounced so that dragging the slider extracts the isosurfaces once."""
         self._plot_wannier_function(
             isovalue=change['new']
         )
 
+    def _on_mesh_quality_change(self, _):
+        """Replot the selected Wannier function with the new mesh quality."""
+        self._plot_wannier_function(isovalue=self.isovalue.value)
+
     def _on_supercell_size_change(self, change):
         """Handle supercell size change event."""
         self._update_supercell_boundary()
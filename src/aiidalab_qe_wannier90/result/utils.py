@@ -1,89 +1,309 @@
-def create_download_link(
-    obj,
-    filename,
-    description='Download',
-    as_button=True,
-    icon='⬇️',
-    button_style='',
-):
-    """Create a download link for a file in the AiiDA repository using a temporary directory."""
-    import base64
+# Multiple of 3 bytes, so that the base64-encoded chunks can be decoded independently
+DOWNLOAD_CHUNK_SIZE = 3 * 1024**2
+
+# Collect the base64 chunks of a download and, once complete, save them in the browser as a Blob
+_DOWNLOAD_JS = {
+    'start': 'window._qeWannier90Downloads = window._qeWannier90Downloads || {{}};'
+             'window._qeWannier90Downloads["{token}"] = [];',
+    'chunk': 'window._qeWannier90Downloads["{token}"].push(Uint8Array.from(atob("{data}"), (c) => c.charCodeAt(0)));',
+    'abort': 'delete window._qeWannier90Downloads["{token}"];',
+    'end': """
+        const parts = window._qeWannier90Downloads["{token}"];
+        delete window._qeWannier90Downloads["{token}"];
+        const url = URL.createObjectURL(new Blob(parts, {{type: "application/octet-stream"}}));
+        const link = document.createElement("a");
+        link.href = url;
+        link.download = "{filename}";
+        document.body.appendChild(link);
+        link.click();
+        document.body.removeChild(link);
+        setTimeout(() => URL.revokeObjectURL(url), 1000);
+    """,
+}
+
+
+class BrowserDownload:
+    """Writable binary stream whose content is sent to the browser in chunks and saved as ``filename``.
+
+    Each chunk of ``chunk_size`` bytes is sent as a small script through the ``output`` widget, so that
+    the kernel never holds more than one encoded chunk in memory. The download is triggered on ``close``,
+    or discarded on ``abort`` (called when leaving a ``with`` block with an exception).
+    """
+
+    def __init__(self, filename, output, chunk_size=DOWNLOAD_CHUNK_SIZE):
+        import uuid
+
+        self.filename = filename
+        self.output = output
+        self.chunk_size = chunk_size
+        self.closed = False
+        self._token = uuid.uuid4().hex
+        self._buffer = bytearray()
+        self._send(_DOWNLOAD_JS['start'].format(token=self._token))
+
+    def _send(self, script):
+        from IPython.display import Javascript, clear_output, display
+
+        with self.output:
+            # the scripts have already been executed, there is no need to keep them in the page
+            clear_output(wait=True)
+            display(Javascript(script))
+
+    def _send_chunk(self, chunk):
+        import base64
+
+        self._send(_DOWNLOAD_JS['chunk'].format(token=self._token, data=base64.b64encode(chunk).decode()))
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def write(self, data):
+        self._buffer.extend(data)
+        while len(self._buffer) >= self.chunk_size:
+            self._send_chunk(bytes(self._buffer[:self.chunk_size]))
+            del self._buffer[:self.chunk_size]
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self.closed:
+            return
+        if self._buffer:
+            self._send_chunk(bytes(self._buffer))
+            self._buffer.clear()
+        self._send(_DOWNLOAD_JS['end'].format(token=self._token, filename=self.filename))
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def abort(self):
+        """Discard the chunks already sent, without triggering the download."""
+        if not self.closed:
+            self._send(_DOWNLOAD_JS['abort'].format(token=self._token))
+            self._buffer.clear()
+            self.closed = True
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def stream_download(obj, filename, output, chunk_size=DOWNLOAD_CHUNK_SIZE):
+    """Send a file of the repository of ``obj`` to the browser in chunks and trigger its download."""
     import shutil
-    import tempfile
+
+    with obj.open(filename, 'rb') as handle, BrowserDownload(filename, output, chunk_size) as target:
+        shutil.copyfileobj(handle, target, chunk_size)
+
+
+def create_download_link(obj, filename, description='Download', icon='download', chunk_size=DOWNLOAD_CHUNK_SIZE):
+    """Create a button downloading a file of the AiiDA repository when clicked.
+
+    Nothing is read when the button is created, the file is streamed to the browser on click,
+    see ``stream_download``.
+    """
     import ipywidgets as ipw
-    from pathlib import Path
-    # Create a temporary directory to store the file
-    # Copy the file from the AiiDA repository to the temporary directory
-    with obj.as_path(filename) as source_path:
-        with tempfile.TemporaryDirectory() as tmpdir:
-            tmp_path = Path(tmpdir) / filename
-            shutil.copy(source_path, tmp_path)
-
-            with open(tmp_path, 'rb') as f:
-                b64 = base64.b64encode(f.read()).decode()
-
-    # At this point, we no longer need the file; it's encoded.
-    payload = f'data:application/octet-stream;base64,{b64}'
-    label = f'{icon} {description}' if icon else description
-    if as_button:
-        style = (
-            'display:inline-block; padding:3px 6px; background:#2f80ed; color:#fff; '
-            'border-radius:2px; text-decoration:none; font-weight:400; font-size:13px; '
-            'border:1px solid #2f80ed;'
-        )
-        if button_style:
-            style = f'{style} {button_style}'
-        html = f'<a download="{filename}" href="{payload}" target="_blank" style="{style}">{label}</a>'
-    else:
-        html = f'<a download="{filename}" href="{payload}" target="_blank">{label}</a>'
-    return ipw.HTML(html)
+
+    button = ipw.Button(description=description, icon=icon, button_style='primary',
+                        tooltip=filename, layout=ipw.Layout(width='auto'))
+    output = ipw.Output(layout=ipw.Layout(display='none'))
+
+    def on_click(_):
+        button.disabled = True
+        description = button.description
+        button.description = 'Preparing the download...'
+        try:
+            stream_download(obj, filename, output, chunk_size)
+        finally:
+            button.description = description
+            button.disabled = False
+
+    button.on_click(on_click)
+    return ipw.VBox([button, output])
+
+def encode_mesh(vertices, faces, decimals=3):
+    """Encode flattened mesh arrays as the JSON lists expected by the WeasWidget ``any_mesh`` plugin.
+
+    The WeasWidget frontend builds its typed arrays from plain JSON arrays, so the mesh cannot be sent
+    as binary buffers. To keep the payload small, the vertices (in Å) are rounded to ``decimals``
+    digits, which makes their JSON representation a few characters long instead of the 17 significant
+    digits of a double. Use ``decimals=None`` to disable the quantization.
+    """
+    import numpy as np
+
+    # round in double precision, the shortest repr of a float32 value converted to float is not short
+    vertices = np.asarray(vertices, dtype=np.float64)
+    if decimals is not None:
+        vertices = np.round(vertices, decimals)
+    return vertices.tolist(), np.asarray(faces, dtype=np.int32).tolist()
+
+def downsample_trace(values, max_points=2000):
+    """Return ``(x, y)`` with at most about ``max_points`` points to plot the series ``values``.
+
+    The series is split into ``max_points // 2`` buckets and the minimum and maximum of each bucket
+    are kept (in their original order), so that spikes in the convergence remain visible.
+    """
+    import numpy as np
+
+    values = np.asarray(values)
+    if len(values) <= max_points:
+        return np.arange(len(values)), values
+    edges = np.linspace(0, len(values), max_points // 2 + 1).astype(int)
+    # keep the last point, so that the final value of the convergence is always shown
+    x = [len(values) - 1]
+    for start, stop in zip(edges[:-1], edges[1:]):
+        bucket = values[start:stop]
+        x += [start + np.argmin(bucket), start + np.argmax(bucket)]
+    x = np.unique(x)
+    return x, values[x]
+
+SKEAF_ARRAYS = ('phi', 'theta', 'freq')
+
+
+def _get_skeaf_array(data, name):
+    """Return the array ``name`` of an ``ArrayData`` node or of a mapping of arrays."""
+    import numpy as np
+
+    if hasattr(data, 'get_array'):
+        return np.asarray(data.get_array(name))
+    return np.asarray(data[name])
+
+
+def skeaf_columns(skeaf_data):
+    """Return the dHvA frequencies of ``skeaf_data`` as columnar arrays.
+
+    ``skeaf_data`` maps the band names to the SKEAF results (``ArrayData`` nodes or mappings with the ``phi``,
+    ``theta`` and ``freq`` arrays), or to lists of results. It can also be a list of such mappings, e.g. from
+    several SKEAF runs on different ranges of angles, which are concatenated band by band.
+
+    Returns a dict with the ``band_names`` and, one entry per frequency, the ``band`` index in ``band_names``
+    and the ``phi``, ``theta`` and ``freq`` values.
+    """
+    import numpy as np
+
+    if isinstance(skeaf_data, dict):
+        skeaf_data = [skeaf_data]
+    results = {}
+    for run in skeaf_data:
+        for band, data in run.items():
+            results.setdefault(band, []).extend(data if isinstance(data, (list, tuple)) else [data])
+
+    band_names = list(results)
+    columns = {name: [] for name in SKEAF_ARRAYS}
+    bands = []
+    for index, band in enumerate(band_names):
+        for data in results[band]:
+            arrays = [_get_skeaf_array(data, name).ravel() for name in SKEAF_ARRAYS]
+            for name, array in zip(SKEAF_ARRAYS, arrays):
+                columns[name].append(array)
+            bands.append(np.full(len(arrays[-1]), index, dtype=np.int32))
+
+    columns = {name: np.concatenate(arrays) if arrays else np.empty(0) for name, arrays in columns.items()}
+    columns['band'] = np.concatenate(bands) if bands else np.empty(0, dtype=np.int32)
+    columns['band_names'] = band_names
+    return columns
+
+
+def skeaf_axis(phi, theta):
+    """Return ``(x, xlabel)`` to plot the frequencies against the varying angle.
+
+    If both angles vary, the frequencies are plotted against the index of the unique ``(phi, theta)`` rotation.
+    """
+    import numpy as np
+
+    vary_phi = len(phi) > 0 and np.ptp(phi) > 0
+    vary_theta = len(theta) > 0 and np.ptp(theta) > 0
+    if vary_theta and not vary_phi:
+        return theta, '\u03B8, degrees'  # Greek letter theta
+    if vary_phi and not vary_theta:
+        return phi, '\u03C6, degrees'  # Greek letter phi
+    _, rotation_indices = np.unique(np.column_stack((phi, theta)), axis=0, return_inverse=True)
+    return rotation_indices.ravel(), 'Rotation step'
+
 
 def plot_skeaf(skeaf_data):
-    """Plot the de Haas van Alphen (dHvA) frequencies from a Wannier90 workchain."""
+    """Plot the de Haas van Alphen (dHvA) frequencies from a Wannier90 workchain.
+
+    The frequencies are drawn with WebGL, one trace per band: clicking on a band in the legend toggles it
+    without rebuilding the figure. ``skeaf_data`` is anything accepted by ``skeaf_columns``.
+    """
     import numpy as np
-    import plotly.express as px
+    import plotly.colors
     import plotly.graph_objects as go
 
-    x = []         # angle values
-    y = []         # freq values
-    labels = []    # band names for color grouping
-    xlabel = 'Rotation step'
-
-    for band, array_node in skeaf_data.items():
-
-        phi = array_node.get_array('phi')
-        theta = array_node.get_array('theta')
-        freq = array_node.get_array('freq')
-
-        if len(np.unique(phi)) == 1:
-            if len(np.unique(theta)) > 1:
-                x.extend(theta)
-                y.extend(freq)
-                xlabel = '\u03B8, degrees'  # Greek letter theta
-        elif len(np.unique(theta)) == 1:
-            if len(np.unique(phi)) > 1:
-                x.extend(phi)
-                y.extend(freq)
-                xlabel = '\u03C6, degrees'  # Greek letter phi
-        elif len(np.unique(phi)) > 1 and len(np.unique(theta)) > 1:
-            # Combine phi and theta into a (N, 2) array of pairs
-            rotations = np.column_stack((phi, theta))
-
-            # Get unique rotations and the inverse indices
-            unique_rotations, rotation_indices = np.unique(rotations, axis=0, return_inverse=True)
-            x.extend(rotation_indices)  # Use indices as x values
-            y.extend(freq)
-        else:
-            # If neither phi nor theta has unique values, skip this band
-            continue
+    columns = skeaf_columns(skeaf_data)
+    x, xlabel = skeaf_axis(columns['phi'], columns['theta'])
+    # group the frequencies by band with a single sort, instead of one mask per band
+    order = np.argsort(columns['band'], kind='stable')
+    bounds = np.searchsorted(columns['band'][order], np.arange(len(columns['band_names']) + 1))
+    palette = plotly.colors.qualitative.Plotly
+
+    traces = []
+    for index, band in enumerate(columns['band_names']):
+        rows = order[bounds[index]:bounds[index + 1]]
+        traces.append(go.Scattergl(
+            x=x[rows],
+            y=columns['freq'][rows],
+            mode='markers',
+            name=str(band),
+            legendgroup=str(band),
+            marker={'color': palette[index % len(palette)], 'size': 6},
+            hovertemplate=f'Band {band}<br>%{{x}}<br>%{{y:.3f}} kT<extra></extra>',
+        ))
+
+    fig = go.FigureWidget(data=traces)
+    fig.update_layout(
+        title='Angular dependence of dHvA frequencies',
+        title_x=0.5,
+        xaxis_title=xlabel,
+        yaxis_title='Frequency (kT)',
+        legend_title_text='Band',
+        legend={'itemclick': 'toggle', 'itemdoubleclick': 'toggleothers'},
+    )
+    return fig
+
+def format_duration(seconds):
+    """Format a duration in seconds as e.g. ``42 s``, ``3 min 20 s`` or ``2 h 05 min``."""
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return f'{seconds} s'
+    minutes, seconds = divmod(seconds, 60)
+    if minutes < 60:
+        return f'{minutes} min {seconds:02d} s'
+    hours, minutes = divmod(minutes, 60)
+    return f'{hours} h {minutes:02d} min'
+
+def debounce(wait):
+    """Decorate a widget method so that bursts of calls only run it once, ``wait`` seconds after the last call.
+
+    The delayed call is scheduled on the running event loop of the kernel. Without a running loop (e.g.
+    outside Jupyter) the method is called immediately.
+    """
+    import asyncio
+    import functools
+
+    def decorator(func):
+        attribute = f'_debounce_{func.__name__}'
 
-        # This is to ensure that frequencies from the same Wannier band have the same color in the plot
-        labels.extend([band] * len(freq))
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                return func(self, *args, **kwargs)
+            pending = getattr(self, attribute, None)
+            if pending is not None:
+                pending.cancel()
+            setattr(self, attribute, loop.call_later(wait, functools.partial(func, self, *args, **kwargs)))
 
-    # Create scatter plot
-    fig = px.scatter(x=x, y=y, color=labels,
-                     labels={'x': xlabel, 'y': 'Frequency (kT)', 'color': 'Band'},
-                     title='Angular dependence of dHvA frequencies')
-    fig.update_layout(title_x=0.5)
+        return wrapper
 
-    return go.FigureWidget(fig)
+    return decorator
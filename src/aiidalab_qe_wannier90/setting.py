@@ -4,8 +4,31 @@ import ipywidgets as ipw
 from aiidalab_qe.common.infobox import InAppGuide
 from aiidalab_qe.common.panel import ConfigurationSettingsPanel
 
+from .estimate import CORE_HOURS_WARNING, SIZE_WARNING_BYTES, format_bytes
 from .model import Wannier90ConfigurationSettingsModel
 
+# Settings of the model changing the estimated cost of the workchain
+COST_ESTIMATE_TRAITS = [
+    'input_structure',
+    'protocol',
+    'exclude_semicore',
+    'plot_wannier_functions',
+    'scan_pdwf_parameter',
+    'compute_fermi_surface',
+    'fermi_surface_kpoint_distance',
+    'compute_dhva_frequencies',
+    'dhva_num_rotation',
+]
+# Descriptions of the estimated file sizes
+COST_ESTIMATE_FILES = {
+    'wavefunctions': 'NSCF wavefunctions (scratch)',
+    'amn': 'AMN projections',
+    'mmn': 'MMN overlaps',
+    'unk': 'UNK files (scratch)',
+    'xsf': 'XSF real-space Wannier functions',
+    'bxsf': 'BXSF Fermi surface',
+}
+
 
 class Wannier90ConfigurationSettingPanel(
     ConfigurationSettingsPanel[Wannier90ConfigurationSettingsModel],
@@ -29,6 +52,10 @@ class Wannier90ConfigurationSettingPanel(
             self._on_frozen_type_change,
             'frozen_type',
         )
+        self._model.observe(
+            self._on_cost_estimate_change,
+            COST_ESTIMATE_TRAITS,
+        )
 
     def render(self):
         if self.rendered:
@@ -89,6 +116,35 @@ class Wannier90ConfigurationSettingPanel(
             (self._model, 'retrieve_hamiltonian'),
             (self.retrieve_hamiltonian, 'value'),
         )
+        self.tight_binding_single_precision = ipw.Checkbox(
+            value=self._model.tight_binding_single_precision,
+            description='Store the tight-binding model in single precision',
+            indent=False,
+            layout=ipw.Layout(width='fit-content', margin='4px 2px 4px 24px'),
+        )
+        ipw.link(
+            (self._model, 'tight_binding_single_precision'),
+            (self.tight_binding_single_precision, 'value'),
+        )
+        self.tight_binding_threshold = ipw.BoundedFloatText(
+            value=self._model.tight_binding_threshold,
+            min=0.0,
+            max=1.0,
+            step=0.001,
+            description='Drop the hoppings below (eV)',
+            style={'description_width': '200px'},
+            layout=ipw.Layout(margin='4px 2px 4px 24px'),
+        )
+        ipw.link(
+            (self._model, 'tight_binding_threshold'),
+            (self.tight_binding_threshold, 'value'),
+        )
+        for widget in (self.tight_binding_single_precision, self.tight_binding_threshold):
+            ipw.dlink(
+                (self._model, 'retrieve_hamiltonian'),
+                (widget, 'disabled'),
+                lambda retrieve_hamiltonian: not retrieve_hamiltonian,
+            )
         self.retrieve_matrices = ipw.Checkbox(
             value=self._model.retrieve_matrices,
             description="Retrieve major input/output files: 'amn', 'mmn', 'eig', 'chk', 'spn' (if present)",
@@ -108,6 +164,22 @@ class Wannier90ConfigurationSettingPanel(
             (self._model, 'scan_pdwf_parameter'),
             (self.scan_pdwf_parameter, 'value'),
         )
+        self.pdwf_num_jobs = ipw.BoundedIntText(
+            value=self._model.pdwf_num_jobs,
+            min=1,
+            max=15,
+            description='Number of parallel PDWF jobs',
+            style={'description_width': '200px'},
+        )
+        ipw.link(
+            (self._model, 'pdwf_num_jobs'),
+            (self.pdwf_num_jobs, 'value'),
+        )
+        ipw.dlink(
+            (self._model, 'scan_pdwf_parameter'),
+            (self.pdwf_num_jobs, 'disabled'),
+            lambda scan_pdwf_parameter: not scan_pdwf_parameter,
+        )
         self.plot_wannier_functions = ipw.Checkbox(
             value=self._model.plot_wannier_functions,
             description='Compute real-space Wannier functions',
@@ -118,6 +190,38 @@ class Wannier90ConfigurationSettingPanel(
             (self._model, 'plot_wannier_functions'),
             (self.plot_wannier_functions, 'value'),
         )
+        self.precompute_isosurfaces = ipw.Checkbox(
+            value=self._model.precompute_isosurfaces,
+            description='Precompute the isosurfaces in the workflow (on the AiiDA daemon)',
+            indent=False,
+            layout=ipw.Layout(width='fit-content', margin='4px 2px 4px 24px'),
+        )
+        ipw.link(
+            (self._model, 'precompute_isosurfaces'),
+            (self.precompute_isosurfaces, 'value'),
+        )
+        ipw.dlink(
+            (self._model, 'plot_wannier_functions'),
+            (self.precompute_isosurfaces, 'disabled'),
+            lambda plot_wannier_functions: not plot_wannier_functions,
+        )
+        self.isosurface_max_workers = ipw.BoundedIntText(
+            value=self._model.isosurface_max_workers,
+            min=1,
+            max=64,
+            description='Number of isosurface processes',
+            style={'description_width': '200px'},
+            layout=ipw.Layout(margin='4px 2px 4px 24px'),
+        )
+        ipw.link(
+            (self._model, 'isosurface_max_workers'),
+            (self.isosurface_max_workers, 'value'),
+        )
+        ipw.dlink(
+            (self._model, 'precompute_isosurfaces'),
+            (self.isosurface_max_workers, 'disabled'),
+            lambda precompute_isosurfaces: not precompute_isosurfaces,
+        )
         self.compute_fermi_surface = ipw.Checkbox(
             value=self._model.compute_fermi_surface,
             description='Compute Fermi surface',
@@ -237,6 +341,17 @@ class Wannier90ConfigurationSettingPanel(
             (self._model, 'dhva_num_rotation'),
             (self.dhva_third_row, 'value'),
         )
+        self.dhva_num_jobs = ipw.BoundedIntText(
+            value=self._model.dhva_num_jobs,
+            min=1,
+            max=64,
+            description='Number of parallel SKEAF jobs',
+            style={'description_width': '200px'},
+        )
+        ipw.link(
+            (self._model, 'dhva_num_jobs'),
+            (self.dhva_num_jobs, 'value'),
+        )
 
         self.number_of_disproj_max = ipw.IntText(
             value=self._model.number_of_disproj_max,
@@ -360,10 +475,14 @@ class Wannier90ConfigurationSettingPanel(
                 <b>Note:</b> If <b>Optimize PDWF thresholds</b> is enabled, an
                 exhaustive scan of the PDWF thresholds is performed (up to 30
                 Wannierizations) to find those that bring the bands distance (for
-                bands up to 2 eV above the Fermi level) below 10 meV.
+                bands up to 2 eV above the Fermi level) below 10 meV. With more than
+                one parallel job, the scan is split in concurrent Wannierizations
+                reusing the same NSCF calculation, and the best one is kept.
             </div>"""
         )
 
+        self.cost_estimate = ipw.HTML()
+
         self.children = [
             self.error_message,
             self.warning_message,
@@ -371,7 +490,11 @@ class Wannier90ConfigurationSettingPanel(
             workflow_explanation,
             self.exclude_semicore,
             self.plot_wannier_functions,
+            self.precompute_isosurfaces,
+            self.isosurface_max_workers,
             self.retrieve_hamiltonian,
+            self.tight_binding_single_precision,
+            self.tight_binding_threshold,
             self.retrieve_matrices,
             self.compute_fermi_surface,
             self.params_fermi_surface_vbox,
@@ -380,7 +503,9 @@ class Wannier90ConfigurationSettingPanel(
             self.warning_message_pdwf,
             self.frozen_states_widget,
             self.scan_pdwf_parameter,
+            self.pdwf_num_jobs,
             optimize_pdwf_info,
+            self.cost_estimate,
         ]
 
         self.rendered = True
@@ -389,6 +514,7 @@ class Wannier90ConfigurationSettingPanel(
         self._toggle_energy_window_input()
         self._toggle_fermi_surface_parameters()
         self._toggle_dhva_freqs_parameters()
+        self._update_cost_estimate()
 
     def _on_electronic_type_change(self, _):
         self._toggle_insulator_warning()
@@ -449,6 +575,61 @@ class Wannier90ConfigurationSettingPanel(
                 self.dhva_first_row,
                 self.dhva_second_row,
                 self.dhva_third_row,
+                self.dhva_num_jobs,
             ]
         else:
             self.params_dhva_freqs_vbox.children = []
+
+    def _on_cost_estimate_change(self, _):
+        self._update_cost_estimate()
+
+    def _update_cost_estimate(self):
+        if not self.rendered:
+            return
+
+        estimate = self._model.get_cost_estimate()
+        if estimate is None:
+            self.cost_estimate.value = ''
+            return
+        cell = 'style="padding:2px 10px;"'
+        sizes = estimate['sizes']
+        core_hours = estimate['core_hours']
+        total_size = sum(sizes.values())
+        total_core_hours = sum(core_hours.values())
+        files_rows = ''.join(
+            f'<tr><td {cell}>{COST_ESTIMATE_FILES.get(name, name)}</td><td {cell}>{format_bytes(size)}</td></tr>'
+            for name, size in sizes.items()
+        )
+        steps_rows = ''.join(
+            f'<tr><td {cell}>{step}</td><td {cell}>{hours:.2g}</td></tr>' for step, hours in core_hours.items()
+        )
+        warnings = []
+        if total_size > SIZE_WARNING_BYTES:
+            warnings.append(f'the files would take about {format_bytes(total_size)}, check your scratch quota')
+        if total_core_hours > CORE_HOURS_WARNING:
+            warnings.append(f'the workflow would cost about {total_core_hours:.0f} core-hours')
+        warning = (
+            f'<div class="alert alert-warning"><b>Warning:</b> {"; ".join(warnings)}.</div>' if warnings else ''
+        )
+        self.cost_estimate.value = f"""
+            {warning}
+            <details style="margin-bottom: 10px;">
+            <summary title="Click to expand" style="font-weight: 600; cursor: pointer;">
+                ▶ Estimated cost: {format_bytes(total_size)} of files, about {total_core_hours:.2g} core-hours
+            </summary>
+            <p>
+                Order-of-magnitude estimate for {estimate['num_wann']} Wannier functions, {estimate['num_bands']}
+                bands, a {' × '.join(map(str, estimate['nscf_mesh']))} NSCF k-point mesh
+                ({estimate['num_kpoints']} k-points) and a wavefunction cutoff of {estimate['ecutwfc']:.0f} Ry,
+                assumed from the protocol (the actual cutoff is set by the pseudopotentials).
+            </p>
+            <table style="border-collapse:collapse; text-align:left; font-size:14px; margin-bottom:10px;">
+                <tr><th {cell}>File</th><th {cell}>Size</th></tr>
+                {files_rows}
+            </table>
+            <table style="border-collapse:collapse; text-align:left; font-size:14px;">
+                <tr><th {cell}>Step</th><th {cell}>Core-hours</th></tr>
+                {steps_rows}
+            </table>
+            </details>
+        """
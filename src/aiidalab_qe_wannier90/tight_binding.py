@@ -0,0 +1,214 @@
+"""Wannier90 tight-binding models: parsers of the ``_tb.dat`` and ``_wsvec.dat`` files, and Wannier interpolation."""
+
+import numpy as np
+
+from .utils import _read_datagrid
+
+# Arrays describing a tight-binding model, as stored in the `ArrayData` output of the workchain
+TIGHT_BINDING_ARRAYS = ('lattice_vectors', 'r_vectors', 'degeneracies', 'hamiltonian', 'position')
+WSVEC_ARRAYS = ('wsvec_r_vectors', 'wsvec_indices', 'wsvec_degeneracies', 'wsvec_shifts')
+# Maximum number of Wigner-Seitz entries checked at once by the vectorized fast path of `parse_wsvec`
+WSVEC_BLOCK_SIZE = 1 << 12
+# Memory budget of the temporary arrays of the Wannier interpolation of a chunk of k-points
+INTERPOLATION_MAX_BYTES = 256 * 1024**2
+# Default number of k-points per Å⁻¹ along the band paths
+INTERPOLATION_PATH_DENSITY = 100
+
+
+def parse_tb(handle, dtype=np.complex128):
+    """Parse a ``seedname_tb.dat`` file written by Wannier90 with ``write_tb = .true.``.
+
+    Returns a dict with:
+
+    - ``lattice_vectors``: the real-space lattice vectors (in Å), as rows;
+    - ``r_vectors``: the ``(nrpts, 3)`` lattice vectors R, in units of the lattice vectors;
+    - ``degeneracies``: the ``(nrpts,)`` Wigner-Seitz degeneracies of the R vectors;
+    - ``hamiltonian``: the ``(nrpts, num_wann, num_wann)`` matrices ``<0m|H|Rn>`` (in eV);
+    - ``position``: the ``(nrpts, 3, num_wann, num_wann)`` matrices ``<0m|r|Rn>`` (in Å).
+
+    The matrix elements are parsed in bulk (see ``_read_datagrid``) and returned with the complex ``dtype``.
+    """
+    handle.readline()  # header with the date of creation
+    lattice_vectors = np.array([[float(x) for x in handle.readline().split()] for _ in range(3)])
+    num_wann = int(handle.readline())
+    nrpts = int(handle.readline())
+    degeneracies = []
+    while len(degeneracies) < nrpts:
+        degeneracies.extend(int(x) for x in handle.readline().split())
+    hamiltonian_size = 3 + 4 * num_wann**2
+    position_size = 3 + 8 * num_wann**2
+    data = _read_datagrid(handle, nrpts * (hamiltonian_size + position_size))
+    hamiltonian_data = data[:nrpts * hamiltonian_size].reshape(nrpts, hamiltonian_size)
+    position_data = data[nrpts * hamiltonian_size:].reshape(nrpts, position_size)
+    # the matrices are written column by column, as lines of `m n Re(H_mn) Im(H_mn)`
+    values = hamiltonian_data[:, 3:].reshape(nrpts, num_wann, num_wann, 4)
+    hamiltonian = (values[..., 2] + 1j * values[..., 3]).transpose(0, 2, 1).astype(dtype)
+    values = position_data[:, 3:].reshape(nrpts, num_wann, num_wann, 8)
+    position = (values[..., 2::2] + 1j * values[..., 3::2]).transpose(0, 3, 2, 1).astype(dtype)
+    return {
+        'lattice_vectors': lattice_vectors,
+        'r_vectors': hamiltonian_data[:, :3].astype(np.int32),
+        'degeneracies': np.array(degeneracies, dtype=np.int32),
+        'hamiltonian': np.ascontiguousarray(hamiltonian),
+        'position': np.ascontiguousarray(position),
+    }
+
+
+def parse_wsvec(handle):
+    """Parse a ``seedname_wsvec.dat`` file written by Wannier90 with ``use_ws_distance = .true.``.
+
+    Each entry ``(R, m, n)`` of the file lists the lattice vectors ``T`` giving the minimal distance between
+    the Wannier function ``m`` in the home cell and ``n`` in the cell ``R + T``. Returns a dict with:
+
+    - ``wsvec_r_vectors``: the ``(num_entries, 3)`` vectors R;
+    - ``wsvec_indices``: the ``(num_entries, 2)`` (1-based) indices ``m, n`` of the Wannier functions;
+    - ``wsvec_degeneracies``: the ``(num_entries,)`` number of vectors T of each entry;
+    - ``wsvec_shifts``: the ``(sum(wsvec_degeneracies), 3)`` vectors T of all the entries, in order.
+    """
+    handle.readline()  # header with the date of creation
+    tokens = np.fromstring(handle.read(), dtype=np.int64, sep=' ')
+    # each entry is `R1 R2 R3 m n`, the number of vectors T, and the vectors T. Almost all the entries
+    # have a single vector T (9 tokens), which is checked for blocks of entries at once.
+    starts = []
+    position = 0
+    while position < len(tokens):
+        block = min(WSVEC_BLOCK_SIZE, (len(tokens) - position) // 9)
+        if block == 0:
+            raise ValueError('The Wigner-Seitz vectors file is truncated')
+        counts = tokens[position + 5:position + 5 + 9 * block:9]
+        irregular = np.flatnonzero(counts != 1)
+        regular = irregular[0] if irregular.size else block
+        starts.append(position + 9 * np.arange(regular))
+        position += 9 * regular
+        if irregular.size:
+            starts.append(np.array([position]))
+            position += 6 + 3 * int(tokens[position + 5])
+    starts = np.concatenate(starts)
+    headers = tokens[starts[:, None] + np.arange(6)]
+    degeneracies = headers[:, 5]
+    # indices of the tokens of the vectors T, each entry contributing `3 * degeneracy` consecutive tokens
+    lengths = 3 * degeneracies
+    offsets = np.repeat(starts + 6 - np.concatenate(([0], np.cumsum(lengths)[:-1])), lengths)
+    shifts = tokens[offsets + np.arange(lengths.sum())].reshape(-1, 3)
+    return {
+        'wsvec_r_vectors': headers[:, :3].astype(np.int32),
+        'wsvec_indices': headers[:, 3:5].astype(np.int32),
+        'wsvec_degeneracies': degeneracies.astype(np.int32),
+        'wsvec_shifts': shifts.astype(np.int32),
+    }
+
+
+def prune_tight_binding(model, threshold):
+    """Remove the R vectors whose hopping matrix elements are all smaller than ``threshold`` (in eV).
+
+    The home cell (R = 0) is always kept. The entries of the Wigner-Seitz vectors (if any) of the removed R
+    vectors are removed as well, they are expected in the order written by Wannier90 (R, then m, then n).
+    """
+    keep = np.abs(model['hamiltonian']).max(axis=(1, 2)) >= threshold
+    keep |= ~model['r_vectors'].any(axis=1)
+    pruned = dict(model)
+    for name in ('r_vectors', 'degeneracies', 'hamiltonian', 'position'):
+        pruned[name] = model[name][keep]
+    if 'wsvec_degeneracies' in model:
+        num_wann = model['hamiltonian'].shape[1]
+        keep_entries = np.repeat(keep, num_wann**2)
+        keep_shifts = np.repeat(keep_entries, model['wsvec_degeneracies'])
+        for name in ('wsvec_r_vectors', 'wsvec_indices', 'wsvec_degeneracies'):
+            pruned[name] = model[name][keep_entries]
+        pruned['wsvec_shifts'] = model['wsvec_shifts'][keep_shifts]
+    return pruned
+
+
+def read_tight_binding(folder, prefix='aiida', dtype=np.complex128, threshold=None):
+    """Read the tight-binding model (and the Wigner-Seitz vectors, if retrieved) from a ``FolderData``."""
+    with folder.open(f'{prefix}_tb.dat', 'r') as handle:
+        model = parse_tb(handle, dtype=dtype)
+    if f'{prefix}_wsvec.dat' in folder.list_object_names():
+        with folder.open(f'{prefix}_wsvec.dat', 'r') as handle:
+            model.update(parse_wsvec(handle))
+        if len(model['wsvec_degeneracies']) != len(model['r_vectors']) * model['hamiltonian'].shape[1] ** 2:
+            raise ValueError(f'The entries of {prefix}_wsvec.dat do not match the R vectors of {prefix}_tb.dat')
+    if threshold:
+        model = prune_tight_binding(model, threshold)
+    return model
+
+
+def get_tight_binding_folder(bands_outputs, prefix='aiida'):
+    """Return the retrieved folder with the ``_tb.dat`` file among the outputs of a ``Wannier90OptimizeWorkChain``.
+
+    The outputs of the plot, optimal and first Wannier90 calculations are searched in this order. Returns None if
+    the tight-binding model was not retrieved.
+    """
+    for namespace in ('wannier90_plot', 'wannier90_optimal', 'wannier90'):
+        if namespace in bands_outputs and f'{prefix}_tb.dat' in bands_outputs[namespace].retrieved.list_object_names():
+            return bands_outputs[namespace].retrieved
+    return None
+
+
+def load_tight_binding(node):
+    """Return the arrays of a tight-binding model stored in an ``ArrayData`` as a dict."""
+    return {name: node.get_array(name) for name in node.get_arraynames()}
+
+
+def fold_real_space_hamiltonian(model):
+    """Return the unique lattice vectors and the matrices ``H(R) / N_R`` to be Fourier transformed.
+
+    When the Wigner-Seitz vectors are available (``use_ws_distance``), each matrix element ``H_mn(R)`` is
+    spread evenly over the cells ``R + T`` of its vectors T, as done by Wannier90 for the interpolation.
+    Returns ``(r_vectors, hamiltonian)`` with shapes ``(num_r, 3)`` and ``(num_r, num_wann, num_wann)``.
+    """
+    hamiltonian = model['hamiltonian'] / model['degeneracies'][:, None, None]
+    if 'wsvec_degeneracies' not in model:
+        return model['r_vectors'], hamiltonian
+    num_wann = hamiltonian.shape[1]
+    # one row per vector T, the entries being ordered by R, then m, then n
+    entries = np.repeat(np.arange(len(model['wsvec_degeneracies'])), model['wsvec_degeneracies'])
+    r_vectors = model['wsvec_r_vectors'][entries] + model['wsvec_shifts']
+    m, n = (model['wsvec_indices'][entries] - 1).T
+    irpt = entries // num_wann**2
+    values = hamiltonian[irpt, m, n] / model['wsvec_degeneracies'][entries]
+    unique_r_vectors, index = np.unique(r_vectors, axis=0, return_inverse=True)
+    folded = np.zeros((len(unique_r_vectors), num_wann, num_wann), dtype=hamiltonian.dtype)
+    np.add.at(folded, (index.ravel(), m, n), values)
+    return unique_r_vectors, folded
+
+
+class WannierInterpolator:
+    """Wannier interpolation of the band structure from a tight-binding model (see ``parse_tb``).
+
+    ``H(k) = sum_R exp(2 pi i k.R) H(R) / N_R`` is evaluated for batches of k-points as a single matrix
+    product of the phase factors with the flattened matrices ``H(R)``, and diagonalized with a batched
+    ``eigvalsh``. The k-points are processed in chunks so that the temporary arrays stay below ``max_bytes``.
+    """
+
+    def __init__(self, model, max_bytes=INTERPOLATION_MAX_BYTES):
+        self.lattice_vectors = np.asarray(model['lattice_vectors'])
+        self.r_vectors, hamiltonian = fold_real_space_hamiltonian(model)
+        self.num_wann = hamiltonian.shape[1]
+        self._hamiltonian = hamiltonian.reshape(len(self.r_vectors), -1)
+        itemsize = np.dtype(self._hamiltonian.dtype).itemsize
+        # phase factors and H(k) of a chunk, plus the workspace of the diagonalization
+        self.chunk_size = max(1, max_bytes // (itemsize * (len(self.r_vectors) + 2 * self.num_wann**2)))
+
+    def hamiltonian(self, kpoints):
+        """Return the ``(num_k, num_wann, num_wann)`` matrices H(k) at the crystal ``kpoints``."""
+        phases = np.exp(2j * np.pi * (np.asarray(kpoints) @ self.r_vectors.T)).astype(self._hamiltonian.dtype)
+        return (phases @ self._hamiltonian).reshape(-1, self.num_wann, self.num_wann)
+
+    def eigenvalues(self, kpoints):
+        """Return the ``(num_k, num_wann)`` interpolated band energies (in eV) at the crystal ``kpoints``."""
+        kpoints = np.asarray(kpoints, dtype=np.float64).reshape(-1, 3)
+        eigenvalues = np.empty((len(kpoints), self.num_wann))
+        for start in range(0, len(kpoints), self.chunk_size):
+            stop = start + self.chunk_size
+            eigenvalues[start:stop] = np.linalg.eigvalsh(self.hamiltonian(kpoints[start:stop]))
+        return eigenvalues
+
+    def bandpath(self, path, density=INTERPOLATION_PATH_DENSITY):
+        """Return the ASE ``BandPath`` of the path string ``path`` (e.g. ``'GXWKGLUWLK,UX'``) in this lattice.
+
+        ``density`` is the number of k-points per Å⁻¹ (including the 2 pi factor).
+        """
+        from ase.cell import Cell
+
+        return Cell(self.lattice_vectors).bandpath(path, density=density)
@@ -0,0 +1,143 @@
+"""Wall time and core-hour accounting of the calculations run by a workchain."""
+
+from aiida import orm
+from aiida.common.links import LinkType
+
+# Name of the step of each calculation, by process label (the `PwCalculation`s are named by their `calculation`)
+STEP_NAMES = {
+    'ProjwfcCalculation': 'projwfc',
+    'Pw2wannier90Calculation': 'pw2wannier90',
+    'Wannier90Calculation': 'wannier90',
+    'Wan2skeafCalculation': 'wan2skeaf',
+    'SkeafCalculation': 'skeaf',
+}
+# Order of the steps in the totals
+STEP_ORDER = ('scf', 'bands', 'nscf', 'projwfc', 'wannier90_pp', 'pw2wannier90', 'wannier90', 'wan2skeaf', 'skeaf')
+
+
+def get_step_name(calcjob):
+    """Return the name of the step run by ``calcjob``, e.g. ``scf``, ``nscf`` or ``wannier90_pp``."""
+    label = calcjob.process_label
+    if label == 'PwCalculation':
+        parameters = calcjob.inputs.parameters.get_dict()
+        return parameters.get('CONTROL', {}).get('calculation', 'scf')
+    if label == 'Wannier90Calculation' and 'settings' in calcjob.inputs:
+        if calcjob.inputs.settings.get_dict().get('postproc_setup', False):
+            return 'wannier90_pp'
+    return STEP_NAMES.get(label, label)
+
+
+def get_workflow_name(node, root):
+    """Return the name of the child of ``root`` that (directly or not) called ``node``.
+
+    This is the call link label of the child if it was set (e.g. ``pdwf_trials_2``), its process label otherwise.
+    """
+    while node.caller is not None and node.caller.pk != root.pk:
+        node = node.caller
+    link = node.base.links.get_incoming(link_type=(LinkType.CALL_CALC, LinkType.CALL_WORK)).first()
+    if link is not None and link.link_label != 'CALL':
+        return link.link_label
+    return node.process_label
+
+
+def get_calcjob_timing(calcjob, origin):
+    """Return the timing and the resources of ``calcjob``.
+
+    ``start`` and ``end`` are the creation and last modification times of the node, in seconds from the datetime
+    ``origin``, so that ``end - start`` includes the time spent in the queue. ``wall_time`` is the run time reported
+    by the scheduler (or by the code), and ``core_hours`` the corresponding cost with the requested resources.
+    """
+    start = (calcjob.ctime - origin).total_seconds()
+    end = (calcjob.mtime - origin).total_seconds()
+
+    job_info = calcjob.get_last_job_info()
+    wall_time = getattr(job_info, 'wallclock_time_seconds', None) if job_info is not None else None
+    if wall_time is None and 'output_parameters' in calcjob.outputs:
+        wall_time = calcjob.outputs.output_parameters.get_dict().get('wall_time_seconds')
+    if wall_time is None:
+        wall_time = end - start
+
+    resources = calcjob.get_option('resources') or {}
+    num_machines = resources.get('num_machines', 1)
+    num_mpiprocs = resources.get('tot_num_mpiprocs') or num_machines * resources.get('num_mpiprocs_per_machine', 1)
+    num_cores = num_mpiprocs * resources.get('num_cores_per_mpiproc', 1)
+    return {
+        'pk': calcjob.pk,
+        'process_label': calcjob.process_label,
+        'exit_status': calcjob.exit_status,
+        'start': start,
+        'end': end,
+        'wall_time': float(wall_time),
+        'queue_time': max(0.0, end - start - float(wall_time)),
+        'num_machines': num_machines,
+        'num_mpiprocs': num_mpiprocs,
+        'num_cores': num_cores,
+        'core_hours': float(wall_time) * num_cores / 3600,
+    }
+
+
+def _step_order(name):
+    """Sort key of the step names, in the order of ``STEP_ORDER`` and then alphabetically."""
+    return (STEP_ORDER.index(name) if name in STEP_ORDER else len(STEP_ORDER), name)
+
+
+def mark_critical_path(steps):
+    """Set ``critical`` in each of the ``steps`` on the chain of calculations that determined the total time.
+
+    Starting from the last calculation to finish, the critical path goes back to the calculation that finished last
+    before it started, i.e. the one it waited for.
+    """
+    for step in steps:
+        step['critical'] = False
+    current = max(steps, key=lambda step: step['end'], default=None)
+    while current is not None:
+        current['critical'] = True
+        preceding = [step for step in steps if step['end'] <= current['start']]
+        current = max(preceding, key=lambda step: step['end'], default=None)
+    return steps
+
+
+def collect_timings(root):
+    """Return the timings of all the calculations called (directly or not) by the workflow ``root``.
+
+    Returns a dict with:
+
+    - ``steps``: the timing of each calculation (see ``get_calcjob_timing``), sorted by start time, with the
+      ``step`` and ``workflow`` names and whether it is on the ``critical`` path;
+    - ``totals``: the number of calculations, the wall time and the core-hours of each step name;
+    - ``elapsed``: the time from the start of ``root`` to the end of the last calculation, in seconds;
+    - ``critical_path_wall_time`` and ``core_hours``: the wall time on the critical path and the total cost;
+    - ``num_cached``: the number of calculations reused from the cache, which are not counted: they keep the job
+      information of their source, and did not run.
+    """
+    steps = []
+    num_cached = 0
+    for node in root.called_descendants:
+        if not isinstance(node, orm.CalcJobNode):
+            continue
+        if node.base.caching.is_created_from_cache:
+            num_cached += 1
+            continue
+        timing = get_calcjob_timing(node, root.ctime)
+        timing['step'] = get_step_name(node)
+        timing['workflow'] = get_workflow_name(node, root)
+        steps.append(timing)
+    steps.sort(key=lambda step: step['start'])
+    mark_critical_path(steps)
+
+    totals = {}
+    for name in sorted({step['step'] for step in steps}, key=_step_order):
+        selected = [step for step in steps if step['step'] == name]
+        totals[name] = {
+            'count': len(selected),
+            'wall_time': sum(step['wall_time'] for step in selected),
+            'core_hours': sum(step['core_hours'] for step in selected),
+        }
+    return {
+        'steps': steps,
+        'totals': totals,
+        'elapsed': max((step['end'] for step in steps), default=0.0),
+        'critical_path_wall_time': sum(step['wall_time'] for step in steps if step['critical']),
+        'core_hours': sum(step['core_hours'] for step in steps),
+        'num_cached': num_cached,
+    }
@@ -1,32 +1,260 @@
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatch
+import io
+import shutil
+import zipfile
+
 from aiida import orm
 import numpy as np
 from ase.io import read
 from skimage import measure
 
-def read_xsf_density(folder: orm.FolderData, filename: str):
+from .cache import LRUCache, xsf_grid_cache
 
-    with folder.open(filename, 'r') as f:
-        atoms = read(f, format='xsf')
-        lines = f.readlines()
-    for i, line in enumerate(lines):
+XSF_CHUNK_SIZE = 1 << 22  # characters of the datagrid parsed per bulk NumPy call
+
+
+def _iter_datagrid_text(handle, chunk_size=XSF_CHUNK_SIZE, cut_at_line_break=False):
+    """Yield the text of a datagrid read from ``handle`` in chunks of about ``chunk_size`` characters.
+
+    Each chunk is cut at the last whitespace (or line break, with ``cut_at_line_break``), the rest being carried
+    over to the next chunk so that no token is split. Reading stops at the ``END_`` marker (``END_DATAGRID_3D``
+    or ``END_BANDGRID_3D``), or at the end of the file.
+    """
+    tail = ''
+    while True:
+        chunk = handle.read(chunk_size)
+        text = tail + chunk
+        end = text.find('END_')
+        if end != -1 or not chunk:
+            yield text[:end] if end != -1 else text
+            return
+        cut = text.rfind('\n') if cut_at_line_break else max(text.rfind(' '), text.rfind('\n'))
+        text, tail = text[:cut + 1], text[cut + 1:]
+        yield text
+
+
+def _parse_floats(text, dtype=np.float64):
+    """Parse the whitespace-separated floats of ``text`` with a single ``np.fromstring`` call.
+
+    Blank text gives an empty array: ``np.fromstring`` would return ``[-1.]`` for it.
+    """
+    if not text.strip():
+        return np.empty(0, dtype=dtype)
+    return np.fromstring(text, dtype=dtype, sep=' ')
+
+
+def _read_datagrid(handle, size, dtype=np.float64, chunk_size=XSF_CHUNK_SIZE):
+    """Parse ``size`` whitespace-separated floats from ``handle`` into a preallocated array.
+
+    The text is consumed in chunks of ``chunk_size`` characters (see ``_iter_datagrid_text``), each chunk being
+    parsed by a single ``np.fromstring`` call, so that the peak memory stays close to the size of the returned
+    array. Parsing stops at the ``END_DATAGRID_3D`` (or ``END_BANDGRID_3D``) marker, or at the end of the file.
+    """
+    data = np.empty(size, dtype=dtype)
+    filled = 0
+    for text in _iter_datagrid_text(handle, chunk_size):
+        values = _parse_floats(text, dtype)
+        if filled + values.size > size:
+            raise ValueError(f'Mismatch in data size: expected {size}, got more')
+        data[filled:filled + values.size] = values
+        filled += values.size
+    if filled != size:
+        raise ValueError(f'Mismatch in data size: expected {size}, got {filled}')
+    return data
+
+
+def parse_xsf_density(handle, dtype=np.float64):
+    """Parse the atoms and the first 3D datagrid from an open XSF text file handle.
+
+    ASE only consumes the structure header of the file, the datagrid is then located by scanning
+    the remaining lines and parsed in bulk, so that the file is read exactly once.
+    """
+    atoms = read(handle, format='xsf')
+    for line in handle:
         if 'BEGIN_DATAGRID_3D' in line:
-            grid_start = i + 1
-            break
-    nx, ny, nz = map(int, lines[grid_start].split())
-    origin = np.array([float(x) for x in lines[grid_start + 1].split()])
-    lattice_vectors = np.array([list(map(float, lines[grid_start + j].split())) for j in range(2, 5)])
-    density_data = []
-    for line in lines[grid_start + 5:]:
-        if 'END_DATAGRID_3D' in line:
             break
-        density_data.extend(map(float, line.split()))
-    expected_size = nx * ny * nz
-    actual_size = len(density_data)
-    if actual_size != expected_size:
-        raise ValueError(f'Mismatch in density data size: expected {expected_size}, got {actual_size}')
-    density_array = np.array(density_data).reshape((nz, ny, nx), order='F')
+    else:
+        raise ValueError('No BEGIN_DATAGRID_3D block found in the XSF file')
+    nx, ny, nz = map(int, handle.readline().split())
+    origin = np.array([float(x) for x in handle.readline().split()])
+    lattice_vectors = np.array([list(map(float, handle.readline().split())) for _ in range(3)])
+    density_data = _read_datagrid(handle, nx * ny * nz, dtype=dtype)
+    # the x index runs fastest in the XSF datagrid, the array is indexed as [ix, iy, iz]
+    density_array = density_data.reshape((nx, ny, nz), order='F')
     return atoms, nx, ny, nz, origin, lattice_vectors, density_array
 
+
+def read_xsf_density(folder: orm.FolderData, filename: str, dtype=np.float64):
+    """Read the atoms and the density grid of an XSF file stored in ``folder``."""
+    with folder.open(filename, 'r') as f:
+        return parse_xsf_density(f, dtype=dtype)
+
+
+def load_xsf_density(folder: orm.FolderData, filename: str):
+    """Return the parsed XSF file, using the on-disk cache of parsed grids when possible.
+
+    The returned density array is memory-mapped from the cache, it is parsed and cached on first access.
+    """
+    cached = xsf_grid_cache.load(folder.uuid, filename)
+    if cached is not None:
+        return cached
+    atoms, nx, ny, nz, origin, lattice_vectors, density_array = read_xsf_density(folder, filename)
+    xsf_grid_cache.store(folder.uuid, filename, atoms, origin, lattice_vectors, density_array)
+    return atoms, nx, ny, nz, origin, lattice_vectors, density_array
+
+
+ARCHIVE_PATTERNS = ('aiida_*.xsf', '*_tb.dat', '*_wsvec.dat', '*.bxsf')
+ARCHIVE_COPY_CHUNK_SIZE = 1 << 20
+
+
+def list_archive_files(folder: orm.FolderData, patterns=ARCHIVE_PATTERNS):
+    """Return the names of the files of ``folder`` matching one of the glob ``patterns``."""
+    return sorted(name for name in folder.list_object_names() if any(fnmatch(name, pattern) for pattern in patterns))
+
+
+def xsf_to_npz(folder: orm.FolderData, filename: str, dtype=np.float64):
+    """Convert an XSF file to the content of a compressed ``.npz`` file.
+
+    The archive holds the ``density`` grid (in ``dtype``), its ``origin`` and ``lattice_vectors``, and the
+    ``numbers``, ``positions`` and ``cell`` of the atoms.
+    """
+    atoms, _, _, _, origin, lattice_vectors, density_array = read_xsf_density(folder, filename, dtype=dtype)
+    buffer = io.BytesIO()
+    np.savez_compressed(
+        buffer,
+        density=density_array,
+        origin=origin,
+        lattice_vectors=lattice_vectors,
+        numbers=atoms.get_atomic_numbers(),
+        positions=atoms.get_positions(),
+        cell=np.asarray(atoms.get_cell()),
+    )
+    return buffer.getvalue()
+
+
+def write_archive(
+    folder: orm.FolderData,
+    fileobj,
+    filenames=None,
+    convert_xsf=False,
+    dtype=np.float64,
+    compresslevel=6,
+    max_workers=4,
+    progress=None,
+):
+    """Write a zip archive of files of ``folder`` to the (possibly unseekable) stream ``fileobj``.
+
+    The files are streamed from the repository into the archive, nothing is staged on disk. With
+    ``convert_xsf``, the XSF files are stored as ``.npz`` files instead (see ``xsf_to_npz``, ``dtype``
+    can be ``np.float32`` to halve their size); the conversions run in a pool of ``max_workers``
+    threads, ahead of the files being written. ``progress(index, total, filename)`` is called after
+    each file has been written.
+    """
+    filenames = list_archive_files(folder) if filenames is None else list(filenames)
+    converted = [name for name in filenames if convert_xsf and name.endswith('.xsf')]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor, zipfile.ZipFile(
+        fileobj, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=compresslevel
+    ) as archive:
+        # keep a bounded number of conversions in flight, to bound the memory
+        pending = deque()
+        queue = iter(converted)
+        for name in queue:
+            pending.append(executor.submit(xsf_to_npz, folder, name, dtype))
+            if len(pending) >= 2 * max_workers:
+                break
+        for index, name in enumerate(filenames, start=1):
+            if convert_xsf and name.endswith('.xsf'):
+                data = pending.popleft().result()
+                for next_name in queue:
+                    pending.append(executor.submit(xsf_to_npz, folder, next_name, dtype))
+                    break
+                # the npz content is already compressed
+                archive.writestr(f'{name[:-4]}.npz', data, compress_type=zipfile.ZIP_STORED)
+            else:
+                with folder.open(name, 'rb') as source, archive.open(name, 'w', force_zip64=True) as target:
+                    shutil.copyfileobj(source, target, ARCHIVE_COPY_CHUNK_SIZE)
+            if progress is not None:
+                progress(index, len(filenames), name)
+
+
+WOUT_CACHE_MAX_BYTES = 64 * 1024**2
+wout_cache = LRUCache(WOUT_CACHE_MAX_BYTES)
+
+
+def _parse_float(text):
+    """Convert Fortran-formatted numbers, returning NaN for overflowed fields (``*****``)."""
+    try:
+        return float(text)
+    except ValueError:
+        return float('nan')
+
+
+def parse_wout(handle):
+    """Parse the convergence of the disentanglement and of the wannierisation from a Wannier90 output file.
+
+    The file is read line by line in a single pass, the values being accumulated in typed ``array``
+    buffers, so that long runs do not build lists of Python floats. Returns a dict of NumPy arrays:
+
+    - ``omega_i``: Omega_I at each disentanglement iteration;
+    - ``omega_d``, ``omega_od``, ``omega_tot``: the spreads at each wannierisation iteration;
+    - ``wf_centres`` (shape ``(n, num_wann, 3)``) and ``wf_spreads`` (shape ``(n, num_wann)``): the centres
+      and spreads of the Wannier functions at each of the ``n`` printed cycles (including the initial and
+      final states).
+    """
+    omega_i = array('d')
+    omega_d = array('d')
+    omega_od = array('d')
+    omega_tot = array('d')
+    centres = array('d')
+    spreads = array('d')
+    num_wann = 0
+    block_size = 0
+    for line in handle:
+        if '  <-- DIS' in line:
+            # the '+-----+<-- DIS' and '|  Iter ... |<-- DIS' table borders do not match
+            omega_i.append(_parse_float(line.split()[2]))
+        elif '<-- SPRD' in line:
+            _, o_d, o_od, o_tot = line.split('<-- SPRD')[0].split('=')
+            omega_d.append(_parse_float(o_d.split()[0]))
+            omega_od.append(_parse_float(o_od.split()[0]))
+            omega_tot.append(_parse_float(o_tot.split()[0]))
+        elif line.startswith('  WF centre and spread'):
+            centre, spread = line.split('(')[1].split(')')
+            centres.extend(_parse_float(x) for x in centre.split(','))
+            spreads.append(_parse_float(spread))
+            block_size += 1
+        elif block_size:
+            # the first line after a block of WF centres closes it
+            num_wann = num_wann or block_size
+            block_size = 0
+    num_wann = num_wann or block_size
+    num_blocks = len(spreads) // num_wann if num_wann else 0
+    centres = np.frombuffer(centres, dtype=np.float64)[:num_blocks * num_wann * 3]
+    spreads = np.frombuffer(spreads, dtype=np.float64)[:num_blocks * num_wann]
+    return {
+        'omega_i': np.frombuffer(omega_i, dtype=np.float64),
+        'omega_d': np.frombuffer(omega_d, dtype=np.float64),
+        'omega_od': np.frombuffer(omega_od, dtype=np.float64),
+        'omega_tot': np.frombuffer(omega_tot, dtype=np.float64),
+        'wf_centres': centres.reshape(num_blocks, num_wann, 3),
+        'wf_spreads': spreads.reshape(num_blocks, num_wann),
+    }
+
+
+def load_wout(folder: orm.FolderData, filename: str = 'aiida.wout'):
+    """Return the parsed Wannier90 output file of a retrieved folder, cached by the UUID of the folder."""
+    key = (folder.uuid, filename)
+    wout = wout_cache.get(key)
+    if wout is None:
+        with folder.open(filename) as handle:
+            wout = parse_wout(handle)
+        wout_cache.put(key, wout)
+    return wout
+
+
 def find_isovalue(density_array, percentile=90):
     """Find the isovalue for the isosurface by taking the 90th percentile of the density values """
 
@@ -37,34 +265,239 @@ def compute_isosurface(density_array, isovalue, origin, lattice_vectors, step_si
     verts, faces, _, _ = measure.marching_cubes(density_array, level=isovalue, step_size=step_size)
     # Convert vertices from grid to Cartesian coordinates
     cartesian_verts = np.dot((verts / np.array(density_array.shape)), lattice_vectors) + origin
-    # flatten the vertices and faces
-    cartesian_verts = cartesian_verts.flatten()
-    faces = faces.flatten()
+    # flatten the vertices and faces, single precision is enough for display and halves the memory
+    cartesian_verts = cartesian_verts.astype(np.float32).ravel()
+    faces = faces.astype(np.int32).ravel()
     return cartesian_verts, faces
 
-def process_xsf_file(folder: orm.FolderData, prefix: str = '', isovalue: float = None):
+def load_wannier_grid(folder: orm.FolderData, prefix: str):
+    """Load the grid of ``{prefix}.xsf`` together with its default isovalue, return None on failure."""
+    filename = f'{prefix}.xsf'
+    try:
+        atoms, nx, ny, nz, origin, lattice_vectors, density_array = load_xsf_density(folder, filename)
+    except Exception as e:
+        print(f'Error processing xsf file {filename}: {e}')
+        return None
+    return {
+        'atoms': atoms,
+        'origin': origin,
+        'lattice_vectors': lattice_vectors,
+        'density_array': density_array,
+        'isovalue': abs(find_isovalue(density_array)),
+    }
+
+def weld_vertices(verts, faces, tolerance=1e-5):
+    """Merge the vertices closer than ``tolerance`` and drop the faces that become degenerate.
+
+    ``verts`` is a ``(N, 3)`` array and ``faces`` a ``(M, 3)`` array of vertex indices.
+    """
+    keys = np.floor(verts / tolerance + 0.5).astype(np.int64)
+    _, index, inverse = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+    faces = inverse.reshape(-1)[faces]
+    return verts[index], _remove_degenerate_faces(faces)
+
+def _remove_degenerate_faces(faces):
+    """Drop the faces with repeated vertices and the duplicated faces."""
+    faces = faces[(faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 2] != faces[:, 0])]
+    _, index = np.unique(np.sort(faces, axis=1), axis=0, return_index=True)
+    return faces[np.sort(index)]
+
+def _cluster_vertices(verts, faces, cell_size):
+    """Collapse the vertices falling in the same cubic cell into one quadric-error-minimising vertex.
+
+    Each face contributes the quadric of its plane, weighted by its area, to the cells of its vertices.
+    The new vertex of a cell minimises the summed quadric error (Lindstrom's out-of-core simplification);
+    the mean position is used when the quadric is ill-conditioned or its minimum lies outside the cell.
+    """
+    cells = np.floor((verts - verts.min(axis=0)) / cell_size).astype(np.int64)
+    _, cluster = np.unique(cells, axis=0, return_inverse=True)
+    cluster = cluster.reshape(-1)
+    num_clusters = cluster.max() + 1
+
+    counts = np.bincount(cluster, minlength=num_clusters)[:, None]
+    mean = np.stack([np.bincount(cluster, weights=verts[:, i], minlength=num_clusters) for i in range(3)], axis=1)
+    mean /= counts
+
+    v0, v1, v2 = (verts[faces[:, i]] for i in range(3))
+    normals = np.cross(v1 - v0, v2 - v0)
+    areas = np.linalg.norm(normals, axis=1)
+    valid = areas > 0
+    normals[valid] /= areas[valid, None]
+    planes = np.concatenate([normals, -np.einsum('ij,ij->i', normals, v0)[:, None]], axis=1)
+    quadrics = np.einsum('i,ij,ik->ijk', areas, planes, planes)
+    q = np.zeros((num_clusters, 4, 4))
+    for i in range(3):
+        np.add.at(q, cluster[faces[:, i]], quadrics)
+
+    a, b = q[:, :3, :3], q[:, :3, 3]
+    det = np.linalg.det(a)
+    scale = np.einsum('ijj->i', a) ** 3
+    well_conditioned = np.abs(det) > 1e-8 * np.maximum(scale, 1e-300)
+    new_verts = mean.copy()
+    if well_conditioned.any():
+        optimal = np.linalg.solve(a[well_conditioned], -b[well_conditioned][..., None])[..., 0]
+        inside = np.linalg.norm(optimal - mean[well_conditioned], axis=1) < cell_size
+        new_verts[np.flatnonzero(well_conditioned)[inside]] = optimal[inside]
+    return new_verts, _remove_degenerate_faces(cluster[faces])
+
+def decimate_mesh(verts, faces, target_faces):
+    """Decimate a ``(N, 3)``/``(M, 3)`` triangle mesh to approximately ``target_faces`` triangles.
+
+    The cell size of the vertex clustering is estimated from the surface area (a cell of size ``h``
+    leaves about ``2 * area / h**2`` triangles) and corrected for a few iterations.
+    """
+    if len(faces) <= target_faces:
+        return verts, faces
+    v0, v1, v2 = (verts[faces[:, i]] for i in range(3))
+    area = 0.5 * np.linalg.norm(np.cross(v1 - v0, v2 - v0), axis=1).sum()
+    cell_size = np.sqrt(2 * area / target_faces)
+    for _ in range(4):
+        new_verts, new_faces = _cluster_vertices(verts, faces, cell_size)
+        if len(new_faces) <= 1.1 * target_faces:
+            break
+        cell_size *= np.sqrt(len(new_faces) / target_faces)
+    return new_verts, new_faces
 
-    data = {}
+def smooth_mesh(verts, faces, iterations=5, lamb=0.5, mu=-0.53):
+    """Smooth a ``(N, 3)``/``(M, 3)`` triangle mesh with Taubin's lambda/mu scheme, which does not shrink it."""
+    edges = np.concatenate([faces[:, [0, 1]], faces[:, [1, 2]], faces[:, [2, 0]]])
+    edges = np.concatenate([edges, edges[:, ::-1]])
+    num_verts = len(verts)
+    degree = np.maximum(np.bincount(edges[:, 0], minlength=num_verts), 1)[:, None]
+    verts = verts.astype(np.float64)
+    for _ in range(iterations):
+        for factor in (lamb, mu):
+            neighbours = np.stack(
+                [np.bincount(edges[:, 0], weights=verts[edges[:, 1], i], minlength=num_verts) for i in range(3)],
+                axis=1,
+            )
+            verts = verts + factor * (neighbours / degree - verts)
+    return verts
+
+def simplify_mesh(verts, faces, target_faces=None, smoothing_iterations=0):
+    """Weld, decimate and smooth the flattened vertices and faces returned by ``compute_isosurface``."""
+    if faces.size == 0:
+        return verts, faces
+    dtype = verts.dtype
+    verts = verts.reshape(-1, 3).astype(np.float64)
+    faces = faces.reshape(-1, 3)
+    verts, faces = weld_vertices(verts, faces)
+    if target_faces:
+        verts, faces = decimate_mesh(verts, faces, target_faces)
+    if smoothing_iterations:
+        verts = smooth_mesh(verts, faces, iterations=smoothing_iterations)
+    return verts.astype(dtype).ravel(), faces.astype(np.int32).ravel()
+
+_isosurface_executor = None
+
+def _get_isosurface_executor():
+    """Return the thread pool used to extract the isosurfaces, created on first use."""
+    global _isosurface_executor
+    if _isosurface_executor is None:
+        _isosurface_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='isosurface')
+    return _isosurface_executor
+
+def compute_isosurfaces(density_array, isovalue, origin, lattice_vectors, step_size=1):
+    """Compute the isosurfaces at ``+isovalue`` and ``-isovalue`` concurrently.
+
+    The grid is converted once to the C-contiguous float32 layout used by marching cubes, and the two
+    extractions run in a thread pool (skimage releases the GIL). A level outside the data range gives
+    empty vertices and faces. Returns ``{'positive': (verts, faces), 'negative': (verts, faces)}``.
+    """
+    density_array = np.ascontiguousarray(density_array, dtype=np.float32)
+    vmin, vmax = float(density_array.min()), float(density_array.max())
+    executor = _get_isosurface_executor()
+    futures = {}
+    for item, level in (('positive', isovalue), ('negative', -isovalue)):
+        if vmin < level < vmax:
+            futures[item] = executor.submit(
+                compute_isosurface, density_array, level, origin, lattice_vectors, step_size=step_size
+            )
+    empty = (np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int32))
+    return {item: futures[item].result() if item in futures else empty for item in ('positive', 'negative')}
+
+def compute_mesh_data(
+    prefix: str, grid: dict, isovalue: float, step_size: int = 1, target_faces=None, smoothing_iterations=0
+):
+    """Compute the positive and negative isosurfaces of a grid loaded with ``load_wannier_grid``.
+
+    If ``target_faces`` or ``smoothing_iterations`` are given, the meshes are simplified with ``simplify_mesh_data``.
+    """
+    surfaces = compute_isosurfaces(
+        grid['density_array'], isovalue, grid['origin'], grid['lattice_vectors'], step_size=step_size
+    )
     mesh_data = {}
+    for item, (verts, faces) in surfaces.items():
+        mesh_data[f'{prefix}_{item}_vertices'] = verts
+        mesh_data[f'{prefix}_{item}_faces'] = faces
+    if target_faces or smoothing_iterations:
+        mesh_data = simplify_mesh_data(prefix, mesh_data, target_faces, smoothing_iterations)
+    return mesh_data
+
+def simplify_mesh_data(prefix: str, mesh_data: dict, target_faces=None, smoothing_iterations=0):
+    """Simplify the meshes returned by ``compute_mesh_data``, sharing ``target_faces`` between the two lobes."""
+    total_faces = count_mesh_faces(mesh_data)
+    simplified = {}
+    for item in ('positive', 'negative'):
+        verts = mesh_data[f'{prefix}_{item}_vertices']
+        faces = mesh_data[f'{prefix}_{item}_faces']
+        lobe_target = None
+        if target_faces and total_faces:
+            lobe_target = max(1, round(target_faces * (faces.size // 3) / total_faces))
+        verts, faces = simplify_mesh(verts, faces, lobe_target, smoothing_iterations)
+        simplified[f'{prefix}_{item}_vertices'] = verts
+        simplified[f'{prefix}_{item}_faces'] = faces
+    return simplified
+
+def count_mesh_faces(mesh_data: dict):
+    """Return the total number of triangles in a mesh returned by ``compute_mesh_data``."""
+    return sum(value.size for key, value in mesh_data.items() if key.endswith('_faces')) // 3
+
+def estimate_step_size(num_faces: int, step_size: int, triangle_budget: int):
+    """Estimate the marching-cubes step size that keeps a mesh within ``triangle_budget`` triangles.
+
+    ``num_faces`` is the number of triangles obtained with ``step_size``. The number of triangles of
+    an isosurface scales as ``1 / step_size**2``, which is used to extrapolate to other step sizes.
+    """
+    full_resolution_faces = num_faces * step_size**2
+    return max(1, int(np.ceil(np.sqrt(full_resolution_faces / triangle_budget))))
+
+# Meshes precomputed by the workchain are kept within these budgets, see `compute_xsf_isosurfaces`
+PRECOMPUTED_TRIANGLE_BUDGET = 200_000
+PRECOMPUTED_TARGET_FACES = 100_000
+
+def compute_xsf_isosurfaces(path, triangle_budget=PRECOMPUTED_TRIANGLE_BUDGET, target_faces=PRECOMPUTED_TARGET_FACES):
+    """Compute the default isosurfaces of the XSF file at ``path``, for the batch precomputation.
+
+    The step size is chosen to stay within ``triangle_budget`` and the meshes are decimated to
+    ``target_faces``. Returns the isovalue and the ``{'positive_vertices': ..., ...}`` arrays.
+    """
+    with open(path) as handle:
+        _, _, _, _, origin, lattice_vectors, density_array = parse_xsf_density(handle)
+    grid = {'density_array': density_array, 'origin': origin, 'lattice_vectors': lattice_vectors}
+    isovalue = float(abs(find_isovalue(density_array)))
+    mesh_data = compute_mesh_data('', grid, isovalue)
+    step_size = estimate_step_size(count_mesh_faces(mesh_data), 1, triangle_budget)
+    if step_size > 1:
+        mesh_data = compute_mesh_data('', grid, isovalue, step_size=step_size)
+    mesh_data = simplify_mesh_data('', mesh_data, target_faces)
+    return isovalue, {key.lstrip('_'): value for key, value in mesh_data.items()}
+
+def process_xsf_file(folder: orm.FolderData, prefix: str = '', isovalue: float = None):
+
+    grid = load_wannier_grid(folder, prefix)
+    if grid is None:
+        return None
+    if isovalue is None:
+        isovalue = grid['isovalue']
     try:
-        key = prefix
-        filename = f'{prefix}.xsf'
-        atoms, nx, ny, nz, origin, lattice_vectors, density_array = read_xsf_density(folder, filename)
-        data['atoms'] = atoms
-        if isovalue is None:
-            isovalue = abs(find_isovalue(density_array))
-        data['isovalue'] = isovalue
-        verts, faces = compute_isosurface(density_array, isovalue, origin, lattice_vectors)
-        verts_neg, faces_neg = compute_isosurface(density_array, -isovalue, origin, lattice_vectors)
-        # the verts is in a nx, ny, nz grid, we need to transform it to fractional coordinates
-        # then to cartesian coordinates using the lattice vectors
-        mesh_data[f'{key}_positive_vertices'] = verts
-        mesh_data[f'{key}_positive_faces'] = faces
-        mesh_data[f'{key}_negative_vertices'] = verts_neg
-        mesh_data[f'{key}_negative_faces'] = faces_neg
-        data['mesh_data'] = mesh_data
+        mesh_data = compute_mesh_data(prefix, grid, isovalue)
     except Exception as e:
-        print(f'Error processing xsf file {filename}: {e}')
+        print(f'Error processing xsf file {prefix}.xsf: {e}')
         return None
 
-    return data
+    return {
+        'atoms': grid['atoms'],
+        'isovalue': isovalue,
+        'mesh_data': mesh_data,
+    }
@@ -1,12 +1,318 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
 import numpy as np
 from aiida import orm
-from aiida.engine import WorkChain, if_
+from aiida.common import AttributeDict
+from aiida.engine import WorkChain, append_, calcfunction, if_
 from aiida_wannier90_workflows.workflows.bands import Wannier90BandsWorkChain
 from aiida_wannier90_workflows.workflows.optimize import Wannier90OptimizeWorkChain
+from aiida_quantumespresso.calculations.functions.seekpath_structure_analysis import seekpath_structure_analysis
+from aiida_quantumespresso.workflows.pw.base import PwBaseWorkChain
 from aiida_quantumespresso.workflows.pw.bands import PwBandsWorkChain
 from aiida_skeaf.workflows import SkeafWorkChain
 from aiidalab_qe.utils import enable_pencil_decomposition, set_component_resources
 
+from .tight_binding import get_tight_binding_folder, read_tight_binding
+from .timings import collect_timings
+from .utils import compute_xsf_isosurfaces
+
+# kwargs used by the app workchain only, not passed to the `Wannier90OptimizeWorkChain` protocol
+APP_KWARGS = (
+    'compute_dhva_frequencies',
+    'dHvA_frequencies_parameters',
+    'dhva_num_jobs',
+    'isosurface_max_workers',
+    'precompute_isosurfaces',
+    'tight_binding_parameters',
+)
+
+# the k-point pools of the NSCF, projwfc and pw2wannier90 keep at least one process per this number of bands
+BANDS_PER_POOL_PROCESS = 64
+# the bands distance compares the DFT and Wannier bands up to 2 eV above the Fermi energy, with a smearing in eV
+BANDS_DISTANCE_FERMI_SHIFT = 2.0
+BANDS_DISTANCE_SMEARING = 0.1
+
+
+@calcfunction
+def generate_isosurface(retrieved, max_workers=None):
+    """Compute the default isosurfaces of all the real-space Wannier functions (``aiida_*.xsf``) in ``retrieved``.
+
+    The files are processed in parallel in a pool of at most ``max_workers`` processes (one by default, in the
+    current process). Returns one ``ArrayData`` per Wannier function, labelled by the file prefix, with the float32
+    vertices and int32 faces of the positive and negative lobes, and the isovalue stored in the ``isovalue``
+    attribute.
+    """
+    filenames = sorted(
+        name for name in retrieved.base.repository.list_object_names()
+        if name.startswith('aiida_') and name.endswith('.xsf')
+    )
+    outputs = {}
+    if not filenames:
+        return outputs
+    with retrieved.base.repository.as_path() as folder:
+        paths = [Path(folder) / filename for filename in filenames]
+        max_workers = min(len(paths), max_workers.value if max_workers is not None else 1)
+        if max_workers > 1:
+            # spawn the workers, forking a daemon worker with open database connections is not safe
+            context = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(max_workers=max_workers, mp_context=context) as executor:
+                results = list(executor.map(compute_xsf_isosurfaces, paths))
+        else:
+            results = [compute_xsf_isosurfaces(path) for path in paths]
+    for filename, (isovalue, arrays) in zip(filenames, results):
+        node = orm.ArrayData()
+        for name, array in arrays.items():
+            node.set_array(name, array)
+        node.base.attributes.set('isovalue', isovalue)
+        outputs[filename[:-len('.xsf')]] = node
+    return outputs
+
+
+@calcfunction
+def generate_tight_binding(retrieved, parameters=None):
+    """Convert the tight-binding model (``aiida_tb.dat`` and ``aiida_wsvec.dat``) in ``retrieved`` to an ``ArrayData``.
+
+    The arrays are described in ``parse_tb`` and ``parse_wsvec``. The optional ``parameters`` accept
+    ``single_precision`` (store the matrix elements as complex64) and ``threshold`` (in eV, remove the R vectors
+    whose hopping matrix elements are all smaller, see ``prune_tight_binding``).
+    """
+    parameters = parameters.get_dict() if parameters is not None else {}
+    model = read_tight_binding(
+        retrieved,
+        dtype=np.complex64 if parameters.get('single_precision', False) else np.complex128,
+        threshold=parameters.get('threshold'),
+    )
+    node = orm.ArrayData()
+    for name, array in model.items():
+        node.set_array(name, array)
+    return node
+
+
+def get_bands_distance(reference_bands, wannier_bands, mu, sigma, exclude_bands=()):
+    """Return the distance between the DFT ``reference_bands`` and the ``wannier_bands`` (arrays of eigenvalues).
+
+    This is the weighted root mean square difference of the eigenvalues, each weighted by the geometric mean of the
+    Fermi-Dirac occupations of the DFT and Wannier eigenvalues at ``mu`` with the smearing ``sigma``. The
+    ``exclude_bands`` (1-based indices, as in Wannier90) are removed from the DFT bands before the comparison.
+    """
+    reference_bands = np.delete(np.asarray(reference_bands), [band - 1 for band in exclude_bands], axis=-1)
+    wannier_bands = np.asarray(wannier_bands)
+    num_bands = min(reference_bands.shape[-1], wannier_bands.shape[-1])
+    reference_bands = reference_bands[..., :num_bands]
+    wannier_bands = wannier_bands[..., :num_bands]
+
+    def occupations(energies):
+        return 1 / (np.exp(np.clip((energies - mu) / sigma, -500, 500)) + 1)
+
+    weights = np.sqrt(occupations(reference_bands) * occupations(wannier_bands))
+    return float(np.sqrt(np.sum(weights * (reference_bands - wannier_bands) ** 2) / np.sum(weights)))
+
+
+@calcfunction
+def compute_bands_distance(reference_bands, wannier_bands, scf_parameters, wannier90_parameters):
+    """Compute the bands distance of the Wannier-interpolated bands with respect to the DFT bands, in eV.
+
+    The bands are compared up to ``BANDS_DISTANCE_FERMI_SHIFT`` above the Fermi energy of the SCF, see
+    ``get_bands_distance``; the bands excluded from the Wannierization are taken from the ``wannier90_parameters``.
+    """
+    distance = get_bands_distance(
+        reference_bands.get_bands(),
+        wannier_bands.get_bands(),
+        mu=scf_parameters['fermi_energy'] + BANDS_DISTANCE_FERMI_SHIFT,
+        sigma=BANDS_DISTANCE_SMEARING,
+        exclude_bands=wannier90_parameters.get_dict().get('exclude_bands', []),
+    )
+    return orm.Float(distance)
+
+
+def get_npool(num_kpoints, num_mpiprocs, num_bands=None):
+    """Return the number of k-point pools (``-nk``) for ``num_kpoints`` k-points on ``num_mpiprocs`` MPI processes.
+
+    This is the largest divisor of ``num_mpiprocs`` not larger than ``num_kpoints``, so that all the pools have the
+    same number of processes and none is left without k-points. If ``num_bands`` is given, each pool keeps at least
+    one process per ``BANDS_PER_POOL_PROCESS`` bands, to distribute the memory of the wavefunctions.
+    """
+    num_kpoints = max(1, int(num_kpoints))
+    num_mpiprocs = max(1, int(num_mpiprocs))
+    min_pool_size = -(-int(num_bands) // BANDS_PER_POOL_PROCESS) if num_bands else 1
+    candidates = [
+        npool for npool in range(1, num_mpiprocs + 1)
+        if num_mpiprocs % npool == 0 and npool <= num_kpoints and num_mpiprocs // npool >= min_pool_size
+    ]
+    return max(candidates, default=1)
+
+
+def get_num_mpiprocs(component):
+    """Return the number of MPI processes requested by the calculation ``component`` of a builder."""
+    resources = component.metadata.options.resources
+    if 'tot_num_mpiprocs' in resources:
+        return resources['tot_num_mpiprocs']
+    return resources.get('num_machines', 1) * resources.get('num_mpiprocs_per_machine', 1)
+
+
+def set_npool(component, npool):
+    """Run the calculation ``component`` of a builder with ``npool`` k-point pools, via the ``-nk`` option."""
+    settings = component.settings.get_dict() if 'settings' in component else {}
+    cmdline = []
+    options = iter(settings.get('CMDLINE', []))
+    for option in options:
+        if option in ('-nk', '-npool', '-npools'):
+            next(options, None)
+        else:
+            cmdline.append(option)
+    settings['CMDLINE'] = cmdline + ['-nk', str(npool)]
+    component.settings = orm.Dict(settings)
+
+
+def count_kpoints(kpoints):
+    """Return the number of k-points of a ``KpointsData``, given as a list or as a mesh."""
+    try:
+        return len(kpoints.get_kpoints())
+    except AttributeError:
+        mesh, _ = kpoints.get_kpoints_mesh()
+        return int(np.prod(mesh))
+
+
+def get_calculations(workchain, process_label):
+    """Return the calculations ``process_label`` called (directly or not) by ``workchain``, by creation time.
+
+    The order of ``called_descendants`` is not guaranteed, it can interleave calcfunctions and other calculations.
+    """
+    return sorted(
+        (node for node in workchain.called_descendants if node.process_label == process_label),
+        key=lambda node: node.ctime,
+    )
+
+
+def get_wannierization(workchain):
+    """Return the last Wannier90 calculation of a ``Wannier90OptimizeWorkChain`` that did not plot the functions."""
+    return [
+        node for node in get_calculations(workchain, 'Wannier90Calculation')
+        if not node.inputs.parameters.get_dict().get('wannier_plot', False)
+    ][-1]
+
+
+@calcfunction
+def record_timings(timings):
+    """Return a copy of the ``timings`` collected by the workchain, which cannot create data itself."""
+    return orm.Dict(timings.get_dict())
+
+
+def get_bands_inputs(builder, scf_parameters):
+    """Return the inputs of the bands `PwBaseWorkChain` of the `PwBandsWorkChain` ``builder``.
+
+    Mirrors `PwBandsWorkChain.run_bands` of aiida-quantumespresso v4.8, which cannot be run on its own: the
+    calculation is set to ``bands`` with the ``cg`` diagonalization and full accuracy by default, and the number of
+    bands from the ``nbands_factor`` and the ``scf_parameters`` (the output parameters of the SCF). The structure,
+    parent folder and k-points are left to the caller.
+    """
+    inputs = AttributeDict(builder.bands._inputs(prune=True))
+    parameters = inputs.pw['parameters'].get_dict()
+    parameters.setdefault('CONTROL', {})['calculation'] = 'bands'
+    parameters.setdefault('ELECTRONS', {}).setdefault('diagonalization', 'cg')
+    parameters['ELECTRONS'].setdefault('diago_full_acc', True)
+    if 'nbands_factor' in builder:
+        nspin_factor = 2 if int(scf_parameters['number_of_spin_components']) > 1 else 1
+        nelectron = int(scf_parameters['number_of_electrons'])
+        parameters.setdefault('SYSTEM', {})['nbnd'] = max(
+            int(0.5 * nelectron * nspin_factor * builder.nbands_factor.value),
+            int(0.5 * nelectron * nspin_factor) + 4 * nspin_factor,
+            int(scf_parameters['number_of_bands']),
+        )
+    else:
+        parameters.setdefault('SYSTEM', {}).setdefault('nbnd', scf_parameters['number_of_bands'])
+    inputs.pw['parameters'] = orm.Dict(parameters)
+    inputs.pop('kpoints_distance', None)
+    return inputs
+
+
+def split_rotations(parameters, num_jobs):
+    """Split the rotation of the magnetic field of the SKEAF ``parameters`` into ``num_jobs`` consecutive ranges.
+
+    The ``num_rotation`` orientations are assumed evenly spaced from the starting to the ending angles, both
+    included. Returns, for each range, the ``starting_*``, ``ending_*`` and ``num_rotation`` parameters; each
+    range has at least two orientations, so fewer ranges are returned for short rotations.
+    """
+    num_rotation = parameters['num_rotation']
+    num_jobs = max(1, min(num_jobs, num_rotation // 2))
+    if num_jobs == 1:
+        return [{}]
+    ranges = []
+    bounds = np.linspace(0, num_rotation, num_jobs + 1).round().astype(int)
+    for first, stop in zip(bounds[:-1], bounds[1:]):
+        last = stop - 1
+        rotation = {'num_rotation': int(stop - first)}
+        for angle in ('phi', 'theta'):
+            start, end = parameters[f'starting_{angle}'], parameters[f'ending_{angle}']
+            step = (end - start) / (num_rotation - 1)
+            rotation[f'starting_{angle}'] = float(start + first * step)
+            rotation[f'ending_{angle}'] = float(start + last * step)
+        ranges.append(rotation)
+    return ranges
+
+
+def split_pdwf_trials(disprojmax_range, disprojmin_range, num_jobs, baseline=None):
+    """Split the scan of the PDWF thresholds in trials of consecutive ``dis_proj_max`` values.
+
+    Each trial is a ``(disprojmax_values, disprojmin)`` tuple at a single ``dis_proj_min``, there are about
+    ``num_jobs`` trials in total and at least one per ``dis_proj_min``. The ``baseline`` pair of thresholds
+    ``(dis_proj_max, dis_proj_min)``, already computed, is skipped.
+    """
+    num_jobs = max(1, num_jobs // len(disprojmin_range))
+    trials = []
+    for disprojmin in disprojmin_range:
+        values = [
+            float(value) for value in disprojmax_range
+            if baseline is None or not np.allclose((value, disprojmin), baseline)
+        ]
+        if values:
+            trials.extend(
+                ([float(value) for value in chunk], float(disprojmin))
+                for chunk in np.array_split(values, min(num_jobs, len(values)))
+            )
+    return trials
+
+
+def set_pdwf_trial_inputs(builder, parameters, remote_input_folder, disprojmax_values, disprojmin):
+    """Set up the ``builder`` of a `Wannier90OptimizeWorkChain` to run a trial of `split_pdwf_trials`.
+
+    The NSCF, projwfc and pw2wannier90 are not rerun, the Wannierizations restart from the pw2wannier90
+    ``remote_input_folder``. The first one uses the Wannier90 ``parameters`` with the first ``dis_proj_max`` value,
+    the other values are scanned by the optimization. The parameters plotting the Wannier functions are kept from
+    the builder.
+    """
+    for namespace in ('nscf', 'projwfc', 'pw2wannier90'):
+        builder.pop(namespace, None)
+    builder.wannier90.wannier90.remote_input_folder = remote_input_folder
+    plot_parameters = {
+        key: value for key, value in builder.wannier90.wannier90.parameters.get_dict().items()
+        if key.startswith('wannier_plot')
+    }
+    builder.wannier90.wannier90.parameters = orm.Dict({
+        **{key: value for key, value in parameters.items() if not key.startswith('wannier_plot')},
+        **plot_parameters,
+        'dis_proj_max': disprojmax_values[0],
+        'dis_proj_min': disprojmin,
+    })
+    builder.optimize_disproj = orm.Bool(len(disprojmax_values) > 1)
+    if len(disprojmax_values) > 1:
+        builder.optimize_disprojmax_range = orm.List(list=disprojmax_values[1:])
+        builder.optimize_disprojmin_range = orm.List(list=[disprojmin])
+    return builder
+
+
+@calcfunction
+def merge_skeaf_frequencies(**frequencies):
+    """Concatenate the ``frequency`` arrays of SKEAF runs on consecutive ranges of angles (``chunk_0``, ...)."""
+    chunks = [frequencies[key] for key in sorted(frequencies, key=lambda key: int(key.split('_')[-1]))]
+    names = set.intersection(*(set(chunk.get_arraynames()) for chunk in chunks))
+    merged = orm.ArrayData()
+    for name in sorted(names):
+        merged.set_array(name, np.concatenate([chunk.get_array(name) for chunk in chunks]))
+    return merged
+
 
 class QeAppWannier90BandsWorkChain(WorkChain):
     """Workchain to run a bands calculation with Quantum ESPRESSO and Wannier90."""
@@ -47,17 +353,67 @@ class QeAppWannier90BandsWorkChain(WorkChain):
                 'help': 'Outputs of the `SkeafWorkChain`.',
             },
         )
-        spec.output_namespace('generate_isosurface', required=False, dynamic=True)
+        spec.output_namespace(
+            'generate_isosurface',
+            valid_type=orm.ArrayData,
+            required=False,
+            dynamic=True,
+            help='Precomputed isosurfaces of the real-space Wannier functions, one per `aiida_*.xsf` file.',
+        )
+        spec.output(
+            'tight_binding',
+            valid_type=orm.ArrayData,
+            required=False,
+            help='Tight-binding model (Hamiltonian, position matrix elements, R vectors and Wigner-Seitz vectors) '
+                 'converted from the retrieved `_tb.dat` and `_wsvec.dat` files.',
+        )
+
+        spec.output(
+            'timings',
+            valid_type=orm.Dict,
+            required=False,
+            help='Wall time, resources and core-hours of all the calculations, with the totals of each step and the '
+                 'critical path, see `collect_timings`.',
+        )
+
+        spec.input(
+            'skeaf_parent_folder',
+            valid_type=orm.RemoteData,
+            required=False,
+            help='Remote folder of the last Wannier90 calculation of a finished workchain, with its `.bxsf` file. '
+                 'If given, only the dHvA frequencies are computed (`wan2skeaf` and `skeaf`), see '
+                 '`get_builder_for_skeaf_restart`.',
+        )
 
         spec.outline(cls.setup,
-                     cls.run_bands,
-                     cls.inspect_pw_bands,
-                     cls.run_optimize,
-                     cls.inspect_optimize,
-                     if_(cls.should_run_skeaf)(
+                     if_(cls.is_skeaf_restart)(
                          cls.run_skeaf,
-                         cls.inspect_skeaf
-                        ),
+                         cls.run_skeaf_chunks,
+                         cls.inspect_skeaf,
+                     ).else_(
+                         cls.run_scf,
+                         cls.inspect_scf,
+                         cls.run_bands_and_optimize,
+                         cls.inspect_pw_bands,
+                         cls.run_bands_distance,
+                         if_(cls.should_run_pdwf_trials)(
+                             cls.run_pdwf_trials,
+                             cls.inspect_pdwf_trials,
+                         ),
+                         cls.inspect_optimize,
+                         if_(cls.should_generate_isosurface)(
+                             cls.run_generate_isosurface,
+                         ),
+                         if_(cls.should_generate_tight_binding)(
+                             cls.run_generate_tight_binding,
+                         ),
+                         if_(cls.should_run_skeaf)(
+                             cls.run_skeaf,
+                             cls.run_skeaf_chunks,
+                             cls.inspect_skeaf
+                            ),
+                     ),
+                     cls.run_collect_timings,
                      )
 
         spec.exit_code(
@@ -68,6 +424,10 @@ class QeAppWannier90BandsWorkChain(WorkChain):
             401, 'ERROR_WANNIER90_BANDS_WORKCHAIN_FAILED',
             message='The wannier90 bands workchain failed.',
         )
+        spec.exit_code(
+            402, 'ERROR_SKEAF_WORKCHAIN_FAILED',
+            message='The skeaf workchain failed.',
+        )
 
     @classmethod
     def get_builder_from_protocol(
@@ -99,12 +459,58 @@ class QeAppWannier90BandsWorkChain(WorkChain):
             builder.kwargs = kwargs
         return builder
 
+    @classmethod
+    def get_builder_for_skeaf_restart(cls, node, codes, resources=None, protocol=None, **kwargs):
+        """Return a builder computing only the dHvA frequencies from the Wannier90 run of a finished workchain.
+
+        The SCF, NSCF and Wannierization of ``node`` (a finished ``QeAppWannier90BandsWorkChain``) are reused,
+        only ``wan2skeaf`` and ``skeaf`` are run, e.g. with new ``dHvA_frequencies_parameters`` or
+        ``dhva_num_jobs`` given in ``kwargs``.
+
+        The inputs of ``wan2skeaf`` (the parent folder, the number of electrons and the parameters) are the same
+        for all the restarts from ``node``, so that with caching enabled for the ``wan2skeaf`` calculation in
+        the AiiDA profile, its output is reused by the repeated scans instead of being recomputed.
+
+        :param node: the finished ``QeAppWannier90BandsWorkChain``.
+        :param codes: the codes, at least ``wan2skeaf`` and ``skeaf``.
+        :param resources: the computational resources of ``wan2skeaf`` and ``skeaf``.
+        :param protocol: protocol to use, by default the one of ``node``.
+        """
+        builder = cls.get_builder()
+        builder.structure = node.inputs.structure
+        builder.protocol = protocol if protocol is not None else node.inputs.protocol
+        builder.codes = codes
+        builder.resources = resources or {}
+        builder.kwargs = {**kwargs, 'compute_dhva_frequencies': True}
+        # with the PDWF trials, several Wannierizations were run: use the selected one, whose outputs were exposed
+        band_structure = node.outputs.wannier90_bands.band_structure
+        wannier_node = next(
+            (
+                child for child in node.called
+                if child.process_label == 'Wannier90OptimizeWorkChain'
+                and 'band_structure' in child.outputs and child.outputs.band_structure.pk == band_structure.pk
+            ),
+            None,
+        )
+        if wannier_node is None:
+            raise ValueError(f'No `Wannier90OptimizeWorkChain` called by <PK={node.pk}> has its Wannier bands.')
+        builder.skeaf_parent_folder = cls.get_skeaf_parent_folder(wannier_node)
+        return builder
+
+    @staticmethod
+    def get_skeaf_parent_folder(wannier_node):
+        """Return the remote folder of the last Wannier90 calculation of a ``Wannier90OptimizeWorkChain``."""
+        return get_calculations(wannier_node, 'Wannier90Calculation')[-1].outputs.remote_folder
+
+    def is_skeaf_restart(self):
+        return 'skeaf_parent_folder' in self.inputs
+
     def setup(self):
         """Define the current workchain"""
         pass
 
-    def run_bands(self):
-        """Run the bands workchain"""
+    def get_pw_bands_builder(self):
+        """Return the builder of a `PwBandsWorkChain` from the protocol, providing the inputs of the SCF and bands"""
         if 'overrides' in self.inputs:
             overrides = self.inputs.overrides.get('pw_bands', {})
         else:
@@ -120,7 +526,6 @@ class QeAppWannier90BandsWorkChain(WorkChain):
             **kwargs,
         )
         builder.pop('relax')
-        builder.metadata.call_link_label = 'pw_bands'
 
         pw_code_info = {
             'code': self.inputs.codes['pw'],
@@ -132,57 +537,91 @@ class QeAppWannier90BandsWorkChain(WorkChain):
 
         set_component_resources(builder.bands.pw, pw_code_info)
         enable_pencil_decomposition(builder.bands.pw)
+        return builder
 
-        node = self.submit(builder)
-        self.report(f'submitting `WorkChain` <PK={node.pk}>')
-        self.to_context(**{'pw_bands': node})
+    def run_scf(self):
+        """Run seekpath and the SCF calculation on the primitive structure.
+
+        The steps of the `PwBandsWorkChain` are run directly, so that the DFT bands and the Wannierization can both
+        start as soon as the SCF is completed, see `run_bands_and_optimize`.
+        """
+        builder = self.get_pw_bands_builder()
+        seekpath = seekpath_structure_analysis(
+            self.inputs.structure,
+            reference_distance=builder.get('bands_kpoints_distance', None),
+            metadata={'call_link_label': 'seekpath'},
+        )
+        self.ctx.current_structure = seekpath['primitive_structure']
+        self.ctx.bands_kpoints = seekpath['explicit_kpoints']
+        self.out('pw_bands.primitive_structure', seekpath['primitive_structure'])
+        self.out('pw_bands.seekpath_parameters', seekpath['parameters'])
+
+        inputs = AttributeDict(builder.scf._inputs(prune=True))
+        inputs.pw['structure'] = self.ctx.current_structure
+        inputs.metadata = {'call_link_label': 'scf'}
+        node = self.submit(PwBaseWorkChain, **inputs)
+        self.report(f'submitting SCF `WorkChain` <PK={node.pk}>')
+        self.to_context(scf=node)
+
+    def inspect_scf(self):
+        """Inspect the results of the SCF workchain"""
+        workchain = self.ctx.scf
+
+        if not workchain.is_finished_ok:
+            self.report('SCF workchain failed')
+            return self.exit_codes.ERROR_PW_BANDS_WORKCHAIN_FAILED
+        self.out('pw_bands.scf_parameters', workchain.outputs.output_parameters)
+
+    def run_bands_and_optimize(self):
+        """Run the DFT bands and the Wannierization concurrently, both restarting from the SCF"""
+        self.run_bands()
+        self.run_optimize()
+
+    def run_bands(self):
+        """Run the DFT bands calculation along the seekpath path, see `get_bands_inputs`"""
+        inputs = get_bands_inputs(self.get_pw_bands_builder(), self.ctx.scf.outputs.output_parameters.get_dict())
+        inputs.pw['structure'] = self.ctx.current_structure
+        inputs.pw['parent_folder'] = self.ctx.scf.outputs.remote_folder
+        inputs.kpoints = self.ctx.bands_kpoints
+        inputs.metadata = {'call_link_label': 'bands'}
+        node = self.submit(PwBaseWorkChain, **inputs)
+        self.report(f'submitting bands `WorkChain` <PK={node.pk}>')
+        self.to_context(pw_bands=node)
 
     def inspect_pw_bands(self):
         """Inspect the results of the bands workchain"""
-        workchain = self.ctx['pw_bands']
+        workchain = self.ctx.pw_bands
 
         if not workchain.is_finished_ok:
             self.report('Pw bands workchain failed')
-            return self.exit_codes.ERROR_WORKCHAIN_FAILED
-        else:
-            self.out_many(
-                self.exposed_outputs(
-                    self.ctx['pw_bands'], PwBandsWorkChain, namespace='pw_bands'
-                )
-            )
-            self.report('Pw bands workchain completed successfully')
-
-    def run_optimize(self):
-        """Run the optimize workchain"""
-        pw_bands_node = self.ctx.pw_bands
-        if not pw_bands_node.is_finished_ok:
-            self.report('Bands workchain failed')
-            return self.exit_codes.ERROR_WORKCHAIN_FAILED
-
-        scf_calc = pw_bands_node.outputs.scf_parameters.creator
-        parent_folder = scf_calc.outputs.remote_folder
-        structure = scf_calc.inputs.structure
-        reference_bands = pw_bands_node.outputs.band_structure
-        bands_kpoints = reference_bands.creator.inputs.kpoints
+            return self.exit_codes.ERROR_PW_BANDS_WORKCHAIN_FAILED
+        self.out('pw_bands.band_parameters', workchain.outputs.output_parameters)
+        self.out('pw_bands.band_structure', workchain.outputs.output_band)
+        self.report('Pw bands workchain completed successfully')
 
+    def get_optimize_overrides(self):
+        """Return the protocol overrides of the `Wannier90OptimizeWorkChain`, without the app parameters"""
         if 'overrides' in self.inputs:
-            overrides = self.inputs.overrides.get('wannier90_bands', {})
+            overrides = dict(self.inputs.overrides.get('wannier90_bands', {}))
         else:
             overrides = {}
+        overrides.pop('wannier90_parameters', None)
+        return overrides
 
-        wannier90_parameters = overrides.pop('wannier90_parameters', {})
-        scan_pdwf_parameter = wannier90_parameters.pop('scan_pdwf_parameter', False)
+    def get_optimize_builder(self, reference_bands=None):
+        """Return the builder of the `Wannier90OptimizeWorkChain` restarting from the SCF.
 
-        if scan_pdwf_parameter:
-            number_of_disproj_max = 15
-            number_of_disproj_min = 2
-        else:
-            number_of_disproj_max = 1
-            number_of_disproj_min = 1
+        The PDWF thresholds can only be optimized if the DFT ``reference_bands`` are given.
+        """
+        parent_folder = self.ctx.scf.outputs.remote_folder
+        structure = self.ctx.current_structure
+        bands_kpoints = self.ctx.bands_kpoints
+        overrides = self.get_optimize_overrides()
 
-        kwargs_filtered = {k: v for k, v in self.inputs.kwargs.items() if k not in ['compute_dhva_frequencies','dHvA_frequencies_parameters']}
+        kwargs_filtered = {k: v for k, v in self.inputs.kwargs.items() if k not in APP_KWARGS}
 
-        codes = {key: value for key, value in self.inputs.codes.items()}
+        # the code of the NSCF is set below with its resources
+        codes = {key: value for key, value in self.inputs.codes.items() if key != 'nscf'}
 
         builder = Wannier90OptimizeWorkChain.get_builder_from_protocol(
             codes = codes,
@@ -193,8 +632,6 @@ class QeAppWannier90BandsWorkChain(WorkChain):
             overrides=overrides,
             **kwargs_filtered,
         )
-        builder.optimize_disprojmax_range = orm.List(list=list(np.linspace(0.99, 0.85, number_of_disproj_max)))
-        builder.optimize_disprojmin_range = orm.List(list=list(np.linspace(0.01, 0.15, number_of_disproj_min)))
 
         kwargs = self.inputs.kwargs if 'kwargs' in self.inputs else {}
         if kwargs.get('plot_wannier_functions', False):
@@ -205,23 +642,43 @@ class QeAppWannier90BandsWorkChain(WorkChain):
         builder.pop('scf')
         builder.nscf.pw.parent_folder = parent_folder
 
+        # the NSCF runs on the full k-point grid, it can have its own resources, by default those of the SCF
+        nscf_key = 'nscf' if 'nscf' in self.inputs.resources else 'pw'
+        nscf_resources = dict(self.inputs.resources[nscf_key])
+        nscf_parallelization = nscf_resources.pop('parallelization', None) or {}
         set_component_resources(
             builder.nscf.pw,
             {
-                'code': self.inputs.codes['pw'],
-                **self.inputs.resources['pw']
+                'code': self.inputs.codes.get(nscf_key, self.inputs.codes['pw']),
+                **nscf_resources
             }
         )
         enable_pencil_decomposition(builder.nscf.pw)
 
-        # set_component_resources(
-        #     builder.projwfc.projwfc,
-        #     {
-        #         'code': self.inputs.codes['projwfc'],
-        #         **self.inputs.resources['projwfc']
-        #     }
-        # )
-        # enable_pencil_decomposition(builder.projwfc)
+        # the NSCF and projwfc are parallel over the k-points of the full grid, use as many pools as possible
+        # unless set in the resources panel
+        num_kpoints = count_kpoints(builder.nscf.kpoints)
+        num_bands = builder.nscf.pw.parameters.get_dict().get('SYSTEM', {}).get('nbnd')
+        npool = nscf_parallelization.get('npool') or get_npool(
+            num_kpoints, get_num_mpiprocs(builder.nscf.pw), num_bands
+        )
+        builder.nscf.pw.parallelization = orm.Dict({'npool': npool})
+
+        if 'projwfc' in builder:
+            # pools are set through the command line, projwfc.x does not take the `parallelization` input of pw.x
+            projwfc_resources = dict(self.inputs.resources['projwfc'])
+            parallelization = projwfc_resources.pop('parallelization', None) or {}
+            set_component_resources(
+                builder.projwfc.projwfc,
+                {
+                    'code': self.inputs.codes['projwfc'],
+                    **projwfc_resources
+                }
+            )
+            npool = parallelization.get('npool') or get_npool(
+                num_kpoints, get_num_mpiprocs(builder.projwfc.projwfc), num_bands
+            )
+            set_npool(builder.projwfc.projwfc, npool)
 
         set_component_resources(
             builder.wannier90.wannier90,
@@ -231,39 +688,220 @@ class QeAppWannier90BandsWorkChain(WorkChain):
             }
         )
 
+        # older pw2wannier90.x versions do not support k-point pools and fail with `-nk`, so pools are only used
+        # if set in the resources panel
+        pw2wannier90_resources = dict(self.inputs.resources['pw2wannier90'])
+        parallelization = pw2wannier90_resources.pop('parallelization', None) or {}
         set_component_resources(
             builder.pw2wannier90.pw2wannier90,
             {
                 'code': self.inputs.codes['pw2wannier90'],
-                **self.inputs.resources['pw2wannier90']
+                **pw2wannier90_resources
             }
         )
+        if parallelization.get('npool'):
+            set_npool(builder.pw2wannier90.pw2wannier90, parallelization['npool'])
+        return builder
+
+    def run_optimize(self):
+        """Run the optimize workchain, without the DFT bands which are computed concurrently.
+
+        The PDWF thresholds are optimized afterwards by `run_pdwf_trials`, which needs the DFT bands: with
+        ``scan_pdwf_parameter``, the whole scan is run, otherwise a single trial is run if the bands distance is
+        too large, as the `Wannier90OptimizeWorkChain` does when it is given the DFT bands.
+        """
+        if 'overrides' in self.inputs:
+            wannier90_parameters = self.inputs.overrides.get('wannier90_bands', {}).get('wannier90_parameters', {})
+        else:
+            wannier90_parameters = {}
+
+        self.ctx.scan_pdwf_parameter = wannier90_parameters.get('scan_pdwf_parameter', False)
+        if self.ctx.scan_pdwf_parameter:
+            number_of_disproj_max = 15
+            number_of_disproj_min = 2
+        else:
+            # a single trial, only run if the bands distance is too large, see `run_bands_distance`
+            number_of_disproj_max = 1
+            number_of_disproj_min = 1
+        self.ctx.pdwf_disprojmax_range = [
+            float(value) for value in np.linspace(0.99, 0.85, number_of_disproj_max)
+        ]
+        # the scan is split in concurrent workchains reusing the pw2wannier90 folder of this one
+        self.ctx.pdwf_num_jobs = wannier90_parameters.get('pdwf_num_jobs', 1)
+        self.ctx.pdwf_disprojmin_range = [
+            float(value) for value in np.linspace(0.01, 0.15, number_of_disproj_min)
+        ]
+
+        # without a threshold, the `Wannier90OptimizeWorkChain` always tries to improve the Wannierization
+        protocol_inputs = Wannier90OptimizeWorkChain.get_protocol_inputs(
+            self.inputs.protocol.value, self.get_optimize_overrides()
+        )
+        self.ctx.bands_distance_threshold = protocol_inputs.get('optimize_bands_distance_threshold', None)
+
+        builder = self.get_optimize_builder()
+        builder.optimize_disproj = orm.Bool(False)
 
         node = self.submit(builder)
         self.report(f'submitting `WorkChain` <PK={node.pk}>')
         self.to_context(**{'wannier90_bands': node})
 
+    def run_bands_distance(self):
+        """Compute the bands distance of the Wannierization with respect to the DFT bands"""
+        workchain = self.ctx.wannier90_bands
+        if not workchain.is_finished_ok:
+            self.report('Optimize workchain failed')
+            return self.exit_codes.ERROR_WANNIER90_BANDS_WORKCHAIN_FAILED
+
+        self.ctx.bands_distance = self.get_wannier_bands_distance(workchain)
+        self.report(f'Bands distance of the Wannierization: {self.ctx.bands_distance.value} eV')
+
+        threshold = self.ctx.bands_distance_threshold
+        if self.ctx.scan_pdwf_parameter:
+            self.ctx.run_pdwf_trials = True
+        elif threshold is None or self.ctx.bands_distance.value > threshold:
+            self.report('Trying to improve the Wannierization with the PDWF thresholds')
+            self.ctx.run_pdwf_trials = True
+        else:
+            self.ctx.run_pdwf_trials = False
+
+    def get_wannier_bands_distance(self, workchain):
+        """Return the bands distance of the Wannier bands of ``workchain``, see `compute_bands_distance`.
+
+        All the candidate Wannierizations are compared with this distance, the PDWF trials also output the one
+        computed by the `Wannier90OptimizeWorkChain`, which is not computed for the first Wannierization.
+        """
+        return compute_bands_distance(
+            self.ctx.pw_bands.outputs.output_band,
+            workchain.outputs.band_structure,
+            self.ctx.scf.outputs.output_parameters,
+            get_wannierization(workchain).inputs.parameters,
+        )
+
+    def should_run_pdwf_trials(self):
+        return self.ctx.run_pdwf_trials
+
+    def run_pdwf_trials(self):
+        """Run the scan of the PDWF thresholds as concurrent `Wannier90OptimizeWorkChain`s.
+
+        Each workchain scans a range of ``dis_proj_max`` values against the DFT bands, restarting from the
+        pw2wannier90 folder of the first workchain with the parameters of its Wannierization, see
+        `set_pdwf_trial_inputs`. The thresholds of the first Wannierization are not computed again. The parameters
+        plotting the Wannier functions are those of the protocol, so that each workchain only plots its optimal
+        Wannier functions.
+        """
+        baseline = self.ctx.wannier90_bands
+        pw2wannier90_calc = get_calculations(baseline, 'Pw2wannier90Calculation')[-1]
+        parameters = get_wannierization(baseline).inputs.parameters.get_dict()
+        if 'dis_proj_max' in parameters and 'dis_proj_min' in parameters:
+            baseline_thresholds = (parameters['dis_proj_max'], parameters['dis_proj_min'])
+        else:
+            baseline_thresholds = None
+
+        self.ctx.pdwf_trials = []
+        trials = split_pdwf_trials(
+            self.ctx.pdwf_disprojmax_range, self.ctx.pdwf_disprojmin_range, self.ctx.pdwf_num_jobs,
+            baseline_thresholds,
+        )
+        for index, (disprojmax_values, disprojmin) in enumerate(trials):
+            builder = set_pdwf_trial_inputs(
+                self.get_optimize_builder(reference_bands=self.ctx.pw_bands.outputs.output_band),
+                parameters,
+                pw2wannier90_calc.outputs.remote_folder,
+                disprojmax_values,
+                disprojmin,
+            )
+            builder.metadata.call_link_label = f'pdwf_trials_{index}'
+            node = self.submit(builder)
+            self.report(
+                f'submitting PDWF trials `WorkChain` <PK={node.pk}> for dis_proj_max in {disprojmax_values} and '
+                f'dis_proj_min {disprojmin}'
+            )
+            self.to_context(pdwf_trials=append_(node))
+
+    def inspect_pdwf_trials(self):
+        """Keep the Wannierization with the smallest bands distance among the first one and the PDWF trials"""
+        distances = {self.ctx.wannier90_bands.pk: self.ctx.bands_distance}
+        candidates = [self.ctx.wannier90_bands]
+        for node in self.ctx.pdwf_trials:
+            if node.is_finished_ok and 'band_structure' in node.outputs:
+                distances[node.pk] = self.get_wannier_bands_distance(node)
+                candidates.append(node)
+            else:
+                self.report(f'PDWF trials `WorkChain` <PK={node.pk}> failed, ignoring it')
+        best = min(candidates, key=lambda node: distances[node.pk].value)
+        self.report(f'Selected `WorkChain` <PK={best.pk}> with bands distance {distances[best.pk].value} eV')
+        self.ctx.wannier90_bands = best
+        self.ctx.bands_distance = distances[best.pk]
+
     def inspect_optimize(self):
         """Attach the bands results"""
         workchain = self.ctx['wannier90_bands']
 
         if not workchain.is_finished_ok:
             self.report('Optimize workchain failed')
-            return self.exit_codes.ERROR_WORKCHAIN_FAILED
+            return self.exit_codes.ERROR_WANNIER90_BANDS_WORKCHAIN_FAILED
         else:
-            self.out_many(
-                self.exposed_outputs(
-                    self.ctx['wannier90_bands'], Wannier90OptimizeWorkChain, namespace='wannier90_bands'
-                )
+            outputs = self.exposed_outputs(
+                self.ctx['wannier90_bands'], Wannier90OptimizeWorkChain, namespace='wannier90_bands'
             )
+            # the distance the Wannierization was selected with, see `get_wannier_bands_distance`
+            outputs['wannier90_bands.bands_distance'] = self.ctx.bands_distance
+            self.out_many(outputs)
             self.report('Optimize workchain completed successfully')
 
+    def should_generate_isosurface(self):
+        kwargs = self.inputs.kwargs if 'kwargs' in self.inputs else {}
+        return kwargs.get('plot_wannier_functions', False) and kwargs.get('precompute_isosurfaces', False)
+
+    def run_generate_isosurface(self):
+        """Precompute the isosurfaces of all the real-space Wannier functions"""
+        bands_outputs = self.ctx['wannier90_bands'].outputs
+        if 'wannier90_plot' in bands_outputs:
+            retrieved = bands_outputs.wannier90_plot.retrieved
+        elif 'wannier90_optimal' in bands_outputs:
+            retrieved = bands_outputs.wannier90_optimal.retrieved
+        else:
+            retrieved = bands_outputs.wannier90.retrieved
+        kwargs = self.inputs.kwargs if 'kwargs' in self.inputs else {}
+        try:
+            # the calcfunction blocks the daemon worker, the number of processes is set in the settings panel
+            isosurfaces = generate_isosurface(retrieved, orm.Int(kwargs.get('isosurface_max_workers', 1)))
+        except Exception as exception:
+            # the isosurfaces are only a cache for the results panel, they can still be computed there
+            self.report(f'Failed to precompute the Wannier function isosurfaces: {exception}')
+            return
+        self.out('generate_isosurface', isosurfaces)
+        self.report(f'Precomputed the isosurfaces of {len(isosurfaces)} Wannier functions')
+
+    def should_generate_tight_binding(self):
+        kwargs = self.inputs.kwargs if 'kwargs' in self.inputs else {}
+        return kwargs.get('retrieve_hamiltonian', False)
+
+    def run_generate_tight_binding(self):
+        """Convert the retrieved tight-binding model to binary arrays"""
+        retrieved = get_tight_binding_folder(self.ctx['wannier90_bands'].outputs)
+        if retrieved is None:
+            self.report('No `aiida_tb.dat` file retrieved, skipping the conversion of the tight-binding model')
+            return
+        kwargs = self.inputs.kwargs if 'kwargs' in self.inputs else {}
+        parameters = kwargs.get('tight_binding_parameters', None)
+        try:
+            if parameters:
+                tight_binding = generate_tight_binding(retrieved, orm.Dict(parameters))
+            else:
+                tight_binding = generate_tight_binding(retrieved)
+        except Exception as exception:
+            # the text files are still available in the retrieved folder
+            self.report(f'Failed to convert the tight-binding model: {exception}')
+            return
+        self.out('tight_binding', tight_binding)
+
     def should_run_skeaf(self):
         kwargs = self.inputs.kwargs if 'kwargs' in self.inputs else {}
         return kwargs.get('compute_dhva_frequencies', False)
 
-    def run_skeaf(self):
-        """Run the `SkeafWorkChain` to compute the dHvA frequencies"""
+    def get_skeaf_builder(self):
+        """Return the builder of the `SkeafWorkChain` and its SKEAF parameters, for the whole rotation."""
         from aiida_wannier90_workflows.utils.pseudo import get_number_of_electrons
 
         if 'overrides' in self.inputs:
@@ -272,13 +910,22 @@ class QeAppWannier90BandsWorkChain(WorkChain):
             overrides = {}
 
         kwargs = self.inputs.kwargs if 'kwargs' in self.inputs else {}
-        wannier_node = self.ctx.wannier90_bands
-        last_wannier_calc = wannier_node.called_descendants[-1]
-        parent_folder = last_wannier_calc.outputs.remote_folder
-        pseudos = self.inputs.overrides.pw_bands['scf']['pw']['pseudos']
+        if self.is_skeaf_restart():
+            parent_folder = self.inputs.skeaf_parent_folder
+        else:
+            parent_folder = self.get_skeaf_parent_folder(self.ctx.wannier90_bands)
+        last_wannier_calc = parent_folder.creator
         structure = last_wannier_calc.inputs.structure
         num_excl_bands = last_wannier_calc.inputs.parameters.get('exclude_bands', [])
-        num_elec_pw = get_number_of_electrons(structure, pseudos)
+        if self.is_skeaf_restart():
+            # the pseudopotentials are not inputs of the restart, use the electrons counted by the previous SCF
+            previous = last_wannier_calc.caller
+            while previous.process_label != self.__class__.__name__:
+                previous = previous.caller
+            num_elec_pw = previous.outputs.pw_bands.scf_parameters['number_of_electrons']
+        else:
+            pseudos = self.inputs.overrides.pw_bands['scf']['pw']['pseudos']
+            num_elec_pw = get_number_of_electrons(structure, pseudos)
         num_electrons = num_elec_pw - 2 * len(num_excl_bands)
 
         if abs(num_electrons - int(num_electrons)) > 1e-5:
@@ -301,7 +948,6 @@ class QeAppWannier90BandsWorkChain(WorkChain):
         skeaf_params.update(
             kwargs.get('dHvA_frequencies_parameters', {}),
         )
-        builder.skeaf.parameters = orm.Dict(skeaf_params)
 
         set_component_resources(
             builder.skeaf,
@@ -319,21 +965,67 @@ class QeAppWannier90BandsWorkChain(WorkChain):
             }
         )
 
+        return builder, skeaf_params
+
+    def submit_skeaf(self, builder, skeaf_params, rotation):
+        """Submit the `SkeafWorkChain` computing the range of angles ``rotation`` (see `split_rotations`)."""
+        builder.skeaf.parameters = orm.Dict({**skeaf_params, **rotation})
         node = self.submit(builder)
         self.report(f'submitting `WorkChain` <PK={node.pk}>')
-        self.to_context(**{'skeaf': node})
+        self.to_context(skeaf=append_(node))
+
+    def run_skeaf(self):
+        """Run the `SkeafWorkChain` of the first range of angles to compute the dHvA frequencies.
+
+        SKEAF is serial, the rotation is split in ranges of angles computed by separate workchains. They all run
+        ``wan2skeaf`` with the same inputs, the other ranges are therefore only submitted once the first one has
+        finished (see `run_skeaf_chunks`), so that they reuse its ``wan2skeaf`` if caching is enabled for it.
+        """
+        builder, skeaf_params = self.get_skeaf_builder()
+        kwargs = self.inputs.kwargs if 'kwargs' in self.inputs else {}
+        rotations = split_rotations(skeaf_params, kwargs.get('dhva_num_jobs', 1))
+        self.ctx.skeaf_rotations = rotations[1:]
+        self.submit_skeaf(builder, skeaf_params, rotations[0])
+
+    def run_skeaf_chunks(self):
+        """Run the `SkeafWorkChain`s of the other ranges of angles concurrently, if the first one succeeded"""
+        if not self.ctx.skeaf_rotations or not self.ctx.skeaf[0].is_finished_ok:
+            return
+        builder, skeaf_params = self.get_skeaf_builder()
+        for rotation in self.ctx.skeaf_rotations:
+            self.submit_skeaf(builder, skeaf_params, rotation)
 
     def inspect_skeaf(self):
-        """Attach the skeaf results"""
-        workchain = self.ctx['skeaf']
+        """Attach the skeaf results, merging the ranges of angles computed by separate workchains"""
+        workchains = self.ctx['skeaf']
 
-        if not workchain.is_finished_ok:
+        if not all(workchain.is_finished_ok for workchain in workchains):
             self.report('SKEAF workchain failed')
-            return self.exit_codes.ERROR_WORKCHAIN_FAILED
-        else:
-            self.out_many(
-                self.exposed_outputs(
-                    self.ctx['skeaf'], SkeafWorkChain, namespace='skeaf'
-                )
-            )
-            self.report('SKEAF workchain completed successfully')
+            return self.exit_codes.ERROR_SKEAF_WORKCHAIN_FAILED
+
+        outputs = self.exposed_outputs(workchains[0], SkeafWorkChain, namespace='skeaf')
+        if len(workchains) > 1:
+            frequencies = {}
+            for index, workchain in enumerate(workchains):
+                for band in workchain.outputs.skeaf:
+                    frequencies.setdefault(band, {})[f'chunk_{index}'] = workchain.outputs.skeaf[band].frequency
+            outputs['skeaf.skeaf'] = {
+                band: {'frequency': merge_skeaf_frequencies(**chunks)} for band, chunks in frequencies.items()
+            }
+            self.report(f'Merged the dHvA frequencies of {len(workchains)} SKEAF workchains')
+        self.out_many(outputs)
+        self.report('SKEAF workchain completed successfully')
+
+    def run_collect_timings(self):
+        """Collect the timings and the resources of all the calculations run by the workchain"""
+        try:
+            timings = record_timings(orm.Dict(collect_timings(self.node)))
+        except Exception as exception:
+            # the timings are only informative, do not fail a completed workchain because of them
+            self.report(f'Failed to collect the timings of the calculations: {exception}')
+            return
+        self.out('timings', timings)
+        self.report(
+            f"Elapsed time {timings['elapsed']:.0f} s, {timings['critical_path_wall_time']:.0f} s on the critical "
+            f"path, {timings['core_hours']:.2f} core-hours"
+        )
@@ -25,6 +25,10 @@ def get_builder(codes, structure, parameters, **kwargs):
     fermi_surface_kpoint_distance=wannier90_parameters.pop('fermi_surface_kpoint_distance', False)
     compute_dhva_frequencies=wannier90_parameters.pop('compute_dhva_frequencies', False)
     dHvA_frequencies_parameters = wannier90_parameters.pop('dHvA_frequencies_parameters', None)
+    dhva_num_jobs = wannier90_parameters.pop('dhva_num_jobs', 1)
+    tight_binding_parameters = wannier90_parameters.pop('tight_binding_parameters', None)
+    precompute_isosurfaces = wannier90_parameters.pop('precompute_isosurfaces', False)
+    isosurface_max_workers = wannier90_parameters.pop('isosurface_max_workers', 1)
 
     all_codes = {
         'pw': codes['pw'].pop('code'),
@@ -32,6 +36,8 @@ def get_builder(codes, structure, parameters, **kwargs):
         'projwfc': codes['projwfc'].pop('code'),
         'wannier90': codes['wannier90'].pop('code')
     }
+    if 'nscf' in codes:
+        all_codes['nscf'] = codes['nscf'].pop('code')
     if compute_dhva_frequencies:
         all_codes['skeaf'] = codes['skeaf'].pop('code')
         all_codes['wan2skeaf'] = codes['wan2skeaf'].pop('code')
@@ -63,6 +69,8 @@ def get_builder(codes, structure, parameters, **kwargs):
         overrides=overrides,
         exclude_semicore=exclude_semicore,
         plot_wannier_functions=plot_wannier_functions,
+        precompute_isosurfaces=precompute_isosurfaces,
+        isosurface_max_workers=isosurface_max_workers,
         electronic_type=ElectronicType(parameters['workchain']['electronic_type']),
         spin_type=SpinType(parameters['workchain']['spin_type']),
         initial_magnetic_moments=parameters['advanced']['initial_magnetic_moments'],
@@ -74,6 +82,8 @@ def get_builder(codes, structure, parameters, **kwargs):
         fermi_surface_kpoint_distance=fermi_surface_kpoint_distance,
         compute_dhva_frequencies=compute_dhva_frequencies,
         dHvA_frequencies_parameters=dHvA_frequencies_parameters,
+        dhva_num_jobs=dhva_num_jobs,
+        tight_binding_parameters=tight_binding_parameters,
         **kwargs,
     )
 
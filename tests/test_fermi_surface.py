@@ -0,0 +1,48 @@
+"""Tests of the BXSF parser."""
+
+import io
+
+import numpy as np
+import pytest
+
+from aiidalab_qe_wannier90.fermi_surface import parse_bxsf
+
+
+def _bxsf_text(energies, indent, values_per_line=6):
+    """Return a BXSF file of the band ``energies`` (on the periodic mesh), with indented band grids."""
+    num_bands, *mesh = energies.shape
+    lines = [
+        'BEGIN_INFO',
+        '  Fermi Energy: 0.50000000',
+        'END_INFO',
+        'BEGIN_BLOCK_BANDGRID_3D',
+        'from_wannier90',
+        ' BEGIN_BANDGRID_3D_fermi',
+        f' {num_bands}',
+        ' ' + ' '.join(str(n + 1) for n in mesh),
+        ' 0.0 0.0 0.0',
+        ' 1.0 0.0 0.0',
+        ' 0.0 1.0 0.0',
+        ' 0.0 0.0 1.0',
+    ]
+    for band in range(num_bands):
+        lines.append(f'{indent}BAND: {band + 1}')
+        values = np.pad(energies[band], ((0, 1), (0, 1), (0, 1)), mode='wrap').ravel()
+        lines.extend(
+            indent + ' '.join(f'{value:.6f}' for value in values[start:start + values_per_line])
+            for start in range(0, len(values), values_per_line)
+        )
+    lines += [f'{indent}END_BANDGRID_3D', 'END_BLOCK_BANDGRID_3D']
+    return '\n'.join(lines) + '\n'
+
+
+@pytest.mark.parametrize('indent', ['', '   '])
+def test_parse_bxsf_chunk_boundaries(indent):
+    """The band grids are parsed whatever the chunk boundaries, including just before an indented end marker."""
+    energies = np.random.default_rng(0).random((2, 3, 3, 3))
+    text = _bxsf_text(energies, indent)
+    for chunk_size in range(1, len(text) + 2):
+        parsed = parse_bxsf(io.StringIO(text), chunk_size=chunk_size)
+        np.testing.assert_allclose(parsed['energies'], energies, atol=1e-6, err_msg=f'chunk_size={chunk_size}')
+        assert list(parsed['bands']) == [0, 1]
+        assert parsed['fermi_energy'] == 0.5
@@ -0,0 +1,34 @@
+"""Tests of the XSF datagrid parser."""
+
+import io
+
+import numpy as np
+import pytest
+
+from aiidalab_qe_wannier90.utils import _read_datagrid
+
+
+def _datagrid_text(values, indent, values_per_line=6):
+    """Return the text of a datagrid block, with each line (and the end marker) indented by ``indent``."""
+    lines = [
+        indent + ' '.join(f'{value:.6f}' for value in values[start:start + values_per_line])
+        for start in range(0, len(values), values_per_line)
+    ]
+    return '\n'.join(lines) + f'\n{indent}END_DATAGRID_3D\nEND_BLOCK_DATAGRID_3D\n'
+
+
+@pytest.mark.parametrize('indent', ['', '   ', '\t'])
+def test_read_datagrid_chunk_boundaries(indent):
+    """The grid is parsed whatever the chunk boundaries, including just before an indented end marker."""
+    values = np.linspace(-1, 1, 24)
+    text = _datagrid_text(values, indent)
+    for chunk_size in range(1, len(text) + 2):
+        data = _read_datagrid(io.StringIO(text), len(values), chunk_size=chunk_size)
+        np.testing.assert_allclose(data, values, atol=1e-6, err_msg=f'chunk_size={chunk_size}')
+
+
+def test_read_datagrid_size_mismatch():
+    """A grid with fewer values than expected is rejected."""
+    text = _datagrid_text(np.zeros(24), '   ')
+    with pytest.raises(ValueError, match='expected 25, got 24'):
+        _read_datagrid(io.StringIO(text), 25, chunk_size=32)
@@ -0,0 +1,56 @@
+"""Tests of the PDWF trials of the Wannier90 workchain."""
+
+import numpy as np
+import pytest
+
+pytest.importorskip('aiida_wannier90_workflows')
+
+from aiida import orm  # noqa: E402
+from aiida_wannier90_workflows.workflows.optimize import Wannier90OptimizeWorkChain  # noqa: E402
+
+from aiidalab_qe_wannier90.wannier90_workchain import set_pdwf_trial_inputs, split_pdwf_trials  # noqa: E402
+
+pytest_plugins = ['aiida.manage.tests.pytest_fixtures']
+
+
+def test_split_pdwf_trials():
+    """Every pair of thresholds is in a single trial, except the baseline which is never computed again."""
+    disprojmax_range = [float(value) for value in np.linspace(0.99, 0.85, 15)]
+    disprojmin_range = [0.01, 0.15]
+    for num_jobs in range(1, 6):
+        trials = split_pdwf_trials(disprojmax_range, disprojmin_range, num_jobs, baseline=(0.95, 0.01))
+        pairs = [(disprojmax, disprojmin) for values, disprojmin in trials for disprojmax in values]
+        assert len(pairs) == len(set(pairs)) == 29
+        assert not any(np.allclose(pair, (0.95, 0.01)) for pair in pairs)
+    assert split_pdwf_trials([0.99], [0.01], 1, baseline=(0.99, 0.01)) == []
+
+
+def test_set_pdwf_trial_inputs(aiida_profile, aiida_localhost):
+    """The trial restarts from the pw2wannier90 folder, from the first threshold of its own range."""
+    builder = Wannier90OptimizeWorkChain.get_builder()
+    builder.nscf.pw.parameters = orm.Dict({'CONTROL': {'calculation': 'nscf'}})
+    builder.pw2wannier90.pw2wannier90.parameters = orm.Dict({'inputpp': {}})
+    builder.wannier90.wannier90.parameters = orm.Dict(
+        {'num_wann': 4, 'wannier_plot': True, 'wannier_plot_supercell': 3}
+    )
+    remote_folder = orm.RemoteData(remote_path='/tmp', computer=aiida_localhost)
+    parameters = {'num_wann': 8, 'dis_proj_max': 0.95, 'dis_proj_min': 0.01, 'wannier_plot': False}
+
+    set_pdwf_trial_inputs(builder, parameters, remote_folder, [0.97, 0.96], 0.15)
+
+    for namespace in ('nscf', 'projwfc', 'pw2wannier90'):
+        assert namespace not in builder
+    assert builder.wannier90.wannier90.remote_input_folder.uuid == remote_folder.uuid
+    assert builder.wannier90.wannier90.parameters.get_dict() == {
+        'num_wann': 8,
+        'wannier_plot': True,
+        'wannier_plot_supercell': 3,
+        'dis_proj_max': 0.97,
+        'dis_proj_min': 0.15,
+    }
+    assert builder.optimize_disproj.value
+    assert builder.optimize_disprojmax_range.get_list() == [0.96]
+    assert builder.optimize_disprojmin_range.get_list() == [0.15]
+
+    set_pdwf_trial_inputs(builder, parameters, remote_folder, [0.97], 0.15)
+    assert not builder.optimize_disproj.value